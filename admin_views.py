@@ -1,44 +1,37 @@
 import streamlit as st
 import sqlite3
-from database import DATABASE_PATH, get_audit_logs, get_response_info, get_response_details, update_response_detail, get_user_by_username, update_user_allowed_surveys, add_governorate_admin, get_health_admins, update_user, update_survey, get_governorates_list, add_user,  save_survey, delete_survey
+from database import get_connection, get_audit_logs, get_user_by_username, update_user_allowed_surveys, add_governorate_admin, get_health_admins, update_user, update_survey, get_governorates_list, add_user,  save_survey, delete_survey, get_reference_data, get_surveys_list, get_health_admins_by_governorate, bump_reference_data_version, bump_user_version
 import json
 import pandas as pd
 from datetime import datetime
+from openpyxl import Workbook
+from navigation import render_sections
+from assignments import show_bulk_assignment
+from exports import show_export_panel
+from audit import AuditLogFilter, AUDIT_LOG_COLUMNS, iter_audit_logs
+from metrics import show_metrics_strip, show_field_statistics
+from response_browser import show_response_browser
+from response_editor import show_response_editor
 
 def show_admin_dashboard():
     st.title("لوحة تحكم النظام")
     
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "إدارة المستخدمين",
-        "إدارة المحافظات", 
-        "إدارة الإدارات الصحية",     
-        "إدارة الاستبيانات", 
-        "عرض البيانات",
-       
-    ])
-    
-    with tab1:
-        manage_users()
-    
-    with tab2:
-        manage_governorates()
-    
-    with tab3:
-        manage_regions()
-    
-    with tab4:
-        manage_surveys()
-    
-    with tab5:
-        view_data()
+    render_sections([
+        ("إدارة المستخدمين", manage_users),
+        ("إدارة المحافظات", manage_governorates),
+        ("إدارة الإدارات الصحية", manage_regions),
+        ("إدارة الاستبيانات", manage_surveys),
+        ("عرض البيانات", view_data),
+    ], key="admin_dashboard")
     
         
 def manage_users():
     st.header("إدارة المستخدمين")
     
     # عرض المستخدمين الحاليين
-    conn = sqlite3.connect(DATABASE_PATH)
-    users = conn.execute('''
+    conn = get_connection()
+    try:
+        users = conn.execute('''
     SELECT u.user_id, u.username, u.role, 
            COALESCE(g.governorate_name, ga.governorate_name) as governorate_name, 
            h.admin_name
@@ -52,7 +45,8 @@ def manage_users():
     ) ga ON u.user_id = ga.user_id
     ORDER BY u.user_id
 ''').fetchall()
-    conn.close()
+    finally:
+        conn.close()
     
     # عرض جدول المستخدمين
     for user in users:
@@ -80,11 +74,12 @@ def manage_users():
     with st.expander("إضافة مستخدم جديد"):
         add_user_form()
 
+    show_bulk_assignment("admin_bulk_assignment")
+
 def add_user_form():
-    conn = sqlite3.connect(DATABASE_PATH)
-    governorates = conn.execute("SELECT governorate_id, governorate_name FROM Governorates").fetchall()
-    surveys = conn.execute("SELECT survey_id, survey_name FROM Surveys").fetchall()
-    conn.close()
+    ref = get_reference_data()
+    governorates = get_governorates_list()
+    surveys = get_surveys_list()
 
     # تهيئة حالة الجلسة
     if 'add_user_form_data' not in st.session_state:
@@ -128,7 +123,7 @@ def add_user_form():
                     index=[g[0] for g in governorates].index(
                         st.session_state.add_user_form_data['governorate_id']) 
                         if st.session_state.add_user_form_data['governorate_id'] in [g[0] for g in governorates] else 0,
-                    format_func=lambda x: next(g[1] for g in governorates if g[0] == x),
+                    format_func=lambda x: ref.governorate_names[x],
                     key="gov_admin_select")
                 st.session_state.add_user_form_data['governorate_id'] = selected_gov
             else:
@@ -145,17 +140,12 @@ def add_user_form():
                     index=[g[0] for g in governorates].index(
                         st.session_state.add_user_form_data['governorate_id']) 
                         if st.session_state.add_user_form_data['governorate_id'] in [g[0] for g in governorates] else 0,
-                    format_func=lambda x: next(g[1] for g in governorates if g[0] == x),
+                    format_func=lambda x: ref.governorate_names[x],
                     key="employee_gov_select")
                 st.session_state.add_user_form_data['governorate_id'] = selected_gov
 
                 # اختيار الإدارة الصحية
-                conn = sqlite3.connect(DATABASE_PATH)
-                health_admins = conn.execute(
-                    "SELECT admin_id, admin_name FROM HealthAdministrations WHERE governorate_id=?",
-                    (selected_gov,)
-                ).fetchall()
-                conn.close()
+                health_admins = get_health_admins_by_governorate(selected_gov)
 
                 if health_admins:
                     selected_admin = st.selectbox(
@@ -164,7 +154,7 @@ def add_user_form():
                         index=[a[0] for a in health_admins].index(
                             st.session_state.add_user_form_data['admin_id']) 
                             if st.session_state.add_user_form_data['admin_id'] in [a[0] for a in health_admins] else 0,
-                        format_func=lambda x: next(a[1] for a in health_admins if a[0] == x),
+                        format_func=lambda x: ref.health_admin_names[x],
                         key="employee_admin_select")
                     st.session_state.add_user_form_data['admin_id'] = selected_admin
                 else:
@@ -179,7 +169,7 @@ def add_user_form():
                 "الاستبيانات المسموح بها",
                 options=[s[0] for s in surveys],
                 default=st.session_state.add_user_form_data['allowed_surveys'],
-                format_func=lambda x: next(s[1] for s in surveys if s[0] == x),
+                format_func=lambda x: ref.survey_names[x],
                 key="allowed_surveys_select")
             st.session_state.add_user_form_data['allowed_surveys'] = selected_surveys
 
@@ -239,7 +229,7 @@ def add_user_form():
             st.rerun()
                 
 def edit_user_form(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         user = conn.execute('''
             SELECT username, role, assigned_region 
@@ -252,15 +242,16 @@ def edit_user_form(user_id):
             del st.session_state.editing_user
             return
             
-        governorates = conn.execute("SELECT governorate_id, governorate_name FROM Governorates").fetchall()
-        surveys = conn.execute("SELECT survey_id, survey_name FROM Surveys").fetchall()
+        ref = get_reference_data()
+        governorates = get_governorates_list()
+        surveys = get_surveys_list()
         allowed_surveys = conn.execute('''
             SELECT survey_id FROM UserSurveys WHERE user_id=?
         ''', (user_id,)).fetchall()
         allowed_surveys = [s[0] for s in allowed_surveys]
         
         # Filter allowed_surveys to only include surveys that exist in current surveys
-        valid_allowed_surveys = [s for s in allowed_surveys if s in [survey[0] for survey in surveys]]
+        valid_allowed_surveys = [s for s in allowed_surveys if s in ref.survey_names]
         
         # الحصول على المحافظة الحالية للمستخدم (إذا كان مسؤول محافظة)
         current_gov = None
@@ -292,7 +283,7 @@ def edit_user_form(user_id):
                 "المحافظة",
                 options=[g[0] for g in governorates],
                 index=[g[0] for g in governorates].index(current_gov) if current_gov else 0,
-                format_func=lambda x: next(g[1] for g in governorates if g[0] == x),
+                format_func=lambda x: ref.governorate_names[x],
                 key=f"gov_edit_{user_id}"
             )
         elif new_role == "employee":
@@ -301,16 +292,11 @@ def edit_user_form(user_id):
                 "المحافظة",
                 options=[g[0] for g in governorates],
                 index=[g[0] for g in governorates].index(current_gov) if current_gov else 0,
-                format_func=lambda x: next(g[1] for g in governorates if g[0] == x),
+                format_func=lambda x: ref.governorate_names[x],
                 key=f"emp_gov_{user_id}"
             )
             
-            conn = sqlite3.connect(DATABASE_PATH)
-            health_admins = conn.execute(
-                "SELECT admin_id, admin_name FROM HealthAdministrations WHERE governorate_id=?",
-                (selected_gov,)
-            ).fetchall()
-            conn.close()
+            health_admins = get_health_admins_by_governorate(selected_gov)
             
             # Fix: Handle case where current_admin is not in health_admins
             admin_options = [a[0] for a in health_admins]
@@ -323,7 +309,7 @@ def edit_user_form(user_id):
                 "الإدارة الصحية",
                 options=admin_options,
                 index=admin_index,
-                format_func=lambda x: next(a[1] for a in health_admins if a[0] == x),
+                format_func=lambda x: ref.health_admin_names[x],
                 key=f"admin_edit_{user_id}"
             )
         
@@ -333,7 +319,7 @@ def edit_user_form(user_id):
                 "الاستبيانات المسموح بها",
                 options=[s[0] for s in surveys],
                 default=valid_allowed_surveys,  # Use the filtered list
-                format_func=lambda x: next(s[1] for s in surveys if s[0] == x),
+                format_func=lambda x: ref.survey_names[x],
                 key=f"surveys_edit_{user_id}"
             )
         
@@ -343,7 +329,7 @@ def edit_user_form(user_id):
                 if new_role == "governorate_admin":
                     # تحديث بيانات مسؤول المحافظة
                     update_user(user_id, new_username, new_role)
-                    conn = sqlite3.connect(DATABASE_PATH)
+                    conn = get_connection()
                     try:
                         # حذف أي تعيينات سابقة
                         conn.execute("DELETE FROM GovernorateAdmins WHERE user_id=?", (user_id,))
@@ -356,6 +342,7 @@ def edit_user_form(user_id):
                         if new_role != "admin":
                             update_user_allowed_surveys(user_id, selected_surveys)
                         conn.commit()
+                        bump_user_version(user_id)
                     finally:
                         conn.close()
                 else:
@@ -371,7 +358,7 @@ def edit_user_form(user_id):
                 st.rerun()
 
 def delete_user(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         # التحقق من وجود إجابات مرتبطة بالمستخدم
         has_responses = conn.execute("SELECT 1 FROM Responses WHERE user_id=?", (user_id,)).fetchone()
@@ -381,6 +368,7 @@ def delete_user(user_id):
         
         conn.execute("DELETE FROM Users WHERE user_id=?", (user_id,))
         conn.commit()
+        bump_user_version(user_id)
         st.success("تم حذف المستخدم بنجاح")
         return True
     except sqlite3.Error as e:
@@ -393,9 +381,7 @@ def manage_surveys():
     st.header("إدارة الاستبيانات")
     
     # Display existing surveys
-    conn = sqlite3.connect(DATABASE_PATH)
-    surveys = conn.execute("SELECT survey_id, survey_name, created_at, is_active FROM Surveys").fetchall()
-    conn.close()
+    surveys = get_reference_data().surveys
     
     # عرض الاستبيانات مع أزرار الإدارة
     for survey in surveys:
@@ -422,20 +408,20 @@ def manage_surveys():
         create_survey_form()
 
 def edit_survey(survey_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    
-    # الحصول على بيانات الاستبيان
-    survey = conn.execute("SELECT survey_name, is_active FROM Surveys WHERE survey_id=?", (survey_id,)).fetchone()
-    
-    # الحصول على حقول الاستبيان الحالية
-    fields = conn.execute('''
-        SELECT field_id, field_label, field_type, field_options, is_required, field_order
-        FROM Survey_Fields
-        WHERE survey_id = ?
-        ORDER BY field_order
-    ''', (survey_id,)).fetchall()
-    
-    conn.close()
+    conn = get_connection()
+    try:
+        # الحصول على بيانات الاستبيان
+        survey = conn.execute("SELECT survey_name, is_active FROM Surveys WHERE survey_id=?", (survey_id,)).fetchone()
+
+        # الحصول على حقول الاستبيان الحالية
+        fields = conn.execute('''
+            SELECT field_id, field_label, field_type, field_options, is_required, field_order
+            FROM Survey_Fields
+            WHERE survey_id = ?
+            ORDER BY field_order
+        ''', (survey_id,)).fetchall()
+    finally:
+        conn.close()
     
     # تهيئة حالة الجلسة للحقول الجديدة إذا لم تكن موجودة
     if 'new_survey_fields' not in st.session_state:
@@ -551,9 +537,8 @@ def create_survey_form():
     if 'create_survey_fields' not in st.session_state:
         st.session_state.create_survey_fields = []
     
-    conn = sqlite3.connect(DATABASE_PATH)
-    governorates = conn.execute("SELECT governorate_id, governorate_name FROM Governorates").fetchall()
-    conn.close()
+    ref = get_reference_data()
+    governorates = get_governorates_list()
     
     with st.form("create_survey_form"):
         survey_name = st.text_input("اسم الاستبيان")
@@ -562,7 +547,7 @@ def create_survey_form():
         selected_governorates = st.multiselect(
             "المحافظات المسموحة",
             options=[g[0] for g in governorates],
-            format_func=lambda x: next(g[1] for g in governorates if g[0] == x)
+            format_func=lambda x: ref.governorate_names[x]
         )
         
         # إدارة الحقول
@@ -609,7 +594,7 @@ def create_survey_form():
                 st.rerun()
 def display_survey_data(survey_id):
     """عرض بيانات استجابات الاستبيان وتصدير شامل لجميع البيانات"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     
     try:
         # الحصول على اسم الاستبيان
@@ -624,205 +609,22 @@ def display_survey_data(survey_id):
             
         survey_name = survey_name[0]
         st.subheader(f"بيانات الاستبيان: {survey_name}")
-        if st.button("📊 تصدير إلى Google Sheets", key=f"export_gsheet_{survey_id}"):
-                    sheet_name = st.text_input("أدخل اسم ملف Google Sheets", 
-                                             value=f"استبيانات_{datetime.now().strftime('%Y%m%d')}")
-                    
-                    if sheet_name and st.button("تأكيد التصدير"):
-                        if export_to_google_sheet(survey_id, sheet_name):
-                            st.success(f"تم تصدير البيانات بنجاح إلى ملف Google Sheets: {sheet_name}")
-                        else:
-                            st.error("فشل في تصدير البيانات")
-        # الحصول على عدد الإجابات
-        total_responses = conn.execute(
-            "SELECT COUNT(*) FROM Responses WHERE survey_id = ?", 
-            (survey_id,)
-        ).fetchone()[0]
+        show_export_panel(survey_id, survey_name)
+        # عرض الإحصائيات (محسوبة داخل قاعدة البيانات)
+        metrics = show_metrics_strip(survey_id)
 
-        if total_responses == 0:
+        if metrics.total == 0:
             st.info("لا توجد بيانات متاحة لهذا الاستبيان بعد")
             return
 
-        # الحصول على جميع الإجابات
-        responses = conn.execute('''
-            SELECT r.response_id, u.username, h.admin_name, g.governorate_name,
-                   r.submission_date, r.is_completed
-            FROM Responses r
-            JOIN Users u ON r.user_id = u.user_id
-            JOIN HealthAdministrations h ON r.region_id = h.admin_id
-            JOIN Governorates g ON h.governorate_id = g.governorate_id
-            WHERE r.survey_id = ?
-            ORDER BY r.submission_date DESC
-        ''', (survey_id,)).fetchall()
+        if st.toggle("📈 عرض إحصائيات الحقول", key=f"field_stats_{survey_id}"):
+            show_field_statistics(survey_id)
 
-        # عرض الإحصائيات
-        completed_responses = sum(1 for r in responses if r[5])
-        regions_count = len(set(r[2] for r in responses))
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("إجمالي الإجابات", total_responses)
-        with col2:
-            st.metric("الإجابات المكتملة", completed_responses)
-        with col3:
-            st.metric("عدد المناطق", regions_count)
-
-        # تحضير البيانات للعرض في DataFrame
-        df = pd.DataFrame(
-            [(r[0], r[1], r[2], r[3], r[4], "مكتملة" if r[5] else "مسودة") for r in responses],
-            columns=["ID", "المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
-        )
-        
-        # عرض البيانات
-        st.dataframe(df)
-        
-        # زر تصدير شامل لجميع البيانات
-        if st.button("تصدير شامل لجميع البيانات إلى Excel", key=f"export_excel_{survey_id}"):
-            # إنشاء اسم ملف مناسب
-            import re
-            from io import BytesIO
-            
-            filename = re.sub(r'[^\w\-_]', '_', survey_name) + "_كامل_" + datetime.now().strftime("%Y%m%d_%H%M") + ".xlsx"
-            
-            # إنشاء ملف Excel متعدد الأوراق
-            with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-                # 1. ورقة ملخص الإجابات
-                df.to_excel(writer, sheet_name='ملخص_الإجابات', index=False)
-                
-                # 2. ورقة تفاصيل جميع الإجابات
-                all_details = []
-                for response in responses:
-                    details = conn.execute('''
-                        SELECT sf.field_label, rd.answer_value, 
-                               u.username as entered_by, 
-                               r.submission_date as entry_date,
-                               r.is_completed
-                        FROM Response_Details rd
-                        JOIN Survey_Fields sf ON rd.field_id = sf.field_id
-                        JOIN Responses r ON rd.response_id = r.response_id
-                        JOIN Users u ON r.user_id = u.user_id
-                        WHERE rd.response_id = ?
-                        ORDER BY sf.field_order
-                    ''', (response[0],)).fetchall()
-                    
-                    for detail in details:
-                        all_details.append({
-                            "ID الإجابة": response[0],
-                            "الحقل": detail[0],
-                            "القيمة": detail[1],
-                            "أدخلها": detail[2],
-                            "تاريخ الإدخال": detail[3],
-                            "حالة الإجابة": "مكتملة" if detail[4] else "مسودة"
-                        })
-                
-                if all_details:
-                    details_df = pd.DataFrame(all_details)
-                    details_df.to_excel(writer, sheet_name='تفاصيل_الإجابات', index=False)
-                
-                # 3. ورقة حقول الاستبيان
-                fields = conn.execute('''
-                    SELECT field_label, field_type, field_options, is_required
-                    FROM Survey_Fields
-                    WHERE survey_id = ?
-                    ORDER BY field_order
-                ''', (survey_id,)).fetchall()
-                
-                fields_df = pd.DataFrame(
-                    [(f[0], f[1], json.loads(f[2]) if f[2] else None, "نعم" if f[3] else "لا") for f in fields],
-                    columns=["اسم الحقل", "نوع الحقل", "الخيارات", "مطلوب"]
-                )
-                fields_df.to_excel(writer, sheet_name='حقول_الاستبيان', index=False)
-                
-                # 4. ورقة المستخدمين الذين أدخلوا بيانات
-                users_df = pd.DataFrame(
-                    [(r[1], r[2], r[3], r[4], "مكتملة" if r[5] else "مسودة") for r in responses],
-                    columns=["المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
-                )
-                users_df.drop_duplicates().to_excel(writer, sheet_name='المستخدمين', index=False)
-   
-            # تقديم ملف للتنزيل
-            with open(filename, "rb") as f:
-                st.download_button(
-                    label="تنزيل ملف Excel الكامل",
-                    data=f,
-                    file_name=filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    key=f"download_excel_{survey_id}"
-                )
-            st.success("تم إنشاء ملف Excel الشامل بنجاح")
-
-        # عرض تفاصيل إجابة محددة
-        selected_response_id = st.selectbox(
-            "اختر إجابة لعرض وتعديل تفاصيلها",
-            options=[r[0] for r in responses],
-            format_func=lambda x: f"إجابة #{x}",
-            key=f"select_response_{survey_id}"
-        )
+        # تصفح الإجابات (صفحات ومرشحات داخل الاستعلام)
+        selected_response_id = show_response_browser(survey_id, key=f"responses_{survey_id}")
 
         if selected_response_id:
-            response_info = get_response_info(selected_response_id)
-            if response_info:
-                st.subheader(f"تفاصيل الإجابة #{selected_response_id}")
-                st.markdown(f"""
-                **الاستبيان:** {response_info[1]}  
-                **المستخدم:** {response_info[2]}  
-                **الإدارة الصحية:** {response_info[3]}  
-                **المحافظة:** {response_info[4]}  
-                **تاريخ التقديم:** {response_info[5]}
-                """)
-                
-                details = get_response_details(selected_response_id)
-                updates = {}  # لتخزين التعديلات
-                
-                # استخدم نموذج لتجميع التعديلات
-                with st.form(key=f"edit_response_form_{selected_response_id}"):
-                    for detail in details:
-                        detail_id, field_id, label, field_type, options, answer = detail
-                        
-                        col1, col2 = st.columns([1, 3])
-                        with col1:
-                            st.markdown(f"**{label}**")
-                        with col2:
-                            if field_type == 'dropdown':
-                                options_list = json.loads(options) if options else []
-                                new_value = st.selectbox(
-                                    label,
-                                    options_list,
-                                    index=options_list.index(answer) if answer in options_list else 0,
-                                    key=f"dropdown_{detail_id}_{selected_response_id}"
-                                )
-                            else:
-                                new_value = st.text_input(
-                                    label,
-                                    value=answer,
-                                    key=f"input_{detail_id}_{selected_response_id}"
-                                )
-                            
-                            if new_value != answer:
-                                updates[detail_id] = new_value
-                    
-                    # زر حفظ التعديلات
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        save_clicked = st.form_submit_button("💾 حفظ جميع التعديلات")
-                        if save_clicked:
-                            if updates:
-                                success_count = 0
-                                for detail_id, new_value in updates.items():
-                                    if update_response_detail(detail_id, new_value):
-                                        success_count += 1
-                                
-                                if success_count == len(updates):
-                                    st.success("تم تحديث جميع التعديلات بنجاح")
-                                else:
-                                    st.error(f"تم تحديث {success_count} من أصل {len(updates)} تعديلات")
-                                st.rerun()
-                            else:
-                                st.info("لم تقم بإجراء أي تعديلات")
-                    with col2:
-                        cancel_clicked = st.form_submit_button("❌ إلغاء التعديلات")
-                        if cancel_clicked:
-                            st.rerun()
+            show_response_editor(selected_response_id, key=f"response_editor_{survey_id}")
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في قاعدة البيانات: {str(e)}")
     finally:
@@ -831,11 +633,8 @@ def display_survey_data(survey_id):
 def view_data():
     st.header("عرض البيانات المجمعة")
     
-    conn = sqlite3.connect(DATABASE_PATH)
     try:
-        surveys = conn.execute(
-            "SELECT survey_id, survey_name FROM Surveys ORDER BY survey_name"
-        ).fetchall()
+        surveys = [(s[0], s[1]) for s in get_reference_data().surveys_by_name]
         
         if not surveys:
             st.warning("لا توجد استبيانات متاحة")
@@ -852,14 +651,10 @@ def view_data():
             display_survey_data(selected_survey[0])
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في قاعدة البيانات: {str(e)}")
-    finally:
-        conn.close()
 
 def manage_governorates():
     st.header("إدارة المحافظات")
-    conn = sqlite3.connect(DATABASE_PATH)
-    governorates = conn.execute("SELECT governorate_id, governorate_name, description FROM Governorates").fetchall()
-    conn.close()
+    governorates = get_reference_data().governorates
     
     for gov in governorates:
         col1, col2, col3, col4 = st.columns([4, 3, 1, 1])
@@ -887,7 +682,7 @@ def manage_governorates():
             
             if submitted:
                 if governorate_name:
-                    conn = sqlite3.connect(DATABASE_PATH)
+                    conn = get_connection()
                     try:
                         existing = conn.execute("SELECT 1 FROM Governorates WHERE governorate_name=?", 
                                               (governorate_name,)).fetchone()
@@ -899,6 +694,7 @@ def manage_governorates():
                                 (governorate_name, description)
                             )
                             conn.commit()
+                            bump_reference_data_version()
                             st.success("تمت إضافة المحافظة بنجاح")
                             st.rerun()
                     except sqlite3.Error as e:
@@ -909,10 +705,12 @@ def manage_governorates():
                     st.warning("يرجى إدخال اسم المحافظة")
 
 def edit_governorate(gov_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    gov = conn.execute("SELECT governorate_name, description FROM Governorates WHERE governorate_id=?", 
-                      (gov_id,)).fetchone()
-    conn.close()
+    conn = get_connection()
+    try:
+        gov = conn.execute("SELECT governorate_name, description FROM Governorates WHERE governorate_id=?",
+                           (gov_id,)).fetchone()
+    finally:
+        conn.close()
     
     with st.form(f"edit_gov_{gov_id}"):
         new_name = st.text_input("اسم المحافظة", value=gov[0])
@@ -921,7 +719,7 @@ def edit_governorate(gov_id):
         col1, col2 = st.columns(2)
         with col1:
             if st.form_submit_button("حفظ التعديلات"):
-                conn = sqlite3.connect(DATABASE_PATH)
+                conn = get_connection()
                 try:
                     existing = conn.execute("SELECT 1 FROM Governorates WHERE governorate_name=? AND governorate_id!=?", 
                                           (new_name, gov_id)).fetchone()
@@ -933,6 +731,7 @@ def edit_governorate(gov_id):
                             (new_name, new_desc, gov_id)
                         )
                         conn.commit()
+                        bump_reference_data_version()
                         st.success("تم تحديث المحافظة بنجاح")
                         del st.session_state.editing_gov
                         st.rerun()
@@ -946,7 +745,7 @@ def edit_governorate(gov_id):
                 st.rerun()
 
 def delete_governorate(gov_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         has_regions = conn.execute("SELECT 1 FROM HealthAdministrations WHERE governorate_id=?", 
                                  (gov_id,)).fetchone()
@@ -956,6 +755,7 @@ def delete_governorate(gov_id):
         
         conn.execute("DELETE FROM Governorates WHERE governorate_id=?", (gov_id,))
         conn.commit()
+        bump_reference_data_version()
         st.success("تم حذف المحافظة بنجاح")
         return True
     except sqlite3.Error as e:
@@ -967,13 +767,9 @@ def delete_governorate(gov_id):
 def manage_regions():
     st.header("إدارة الإدارات الصحية")
     
-    conn = sqlite3.connect(DATABASE_PATH)
-    regions = conn.execute('''
-        SELECT h.admin_id, h.admin_name, h.description, g.governorate_name 
-        FROM HealthAdministrations h
-        JOIN Governorates g ON h.governorate_id = g.governorate_id
-    ''').fetchall()
-    conn.close()
+    ref = get_reference_data()
+    regions = [(a[0], a[1], a[2], ref.governorate_names[a[3]])
+               for a in ref.health_admins if a[3] in ref.governorate_names]
     for reg in regions:
         col1, col2, col3, col4, col5 = st.columns([3, 3, 2, 1, 1])
         with col1:
@@ -993,9 +789,7 @@ def manage_regions():
         edit_health_admin(st.session_state.editing_reg)
     
     with st.expander("إضافة إدارة صحية جديدة"):
-        conn = sqlite3.connect(DATABASE_PATH)
-        governorates = conn.execute("SELECT governorate_id, governorate_name FROM Governorates").fetchall()
-        conn.close()
+        governorates = get_governorates_list()
         
         if not governorates:
             st.warning("لا توجد محافظات متاحة. يرجى إضافة محافظة أولاً.")
@@ -1007,13 +801,13 @@ def manage_regions():
             governorate_id = st.selectbox(
                 "المحافظة",
                 options=[g[0] for g in governorates],
-                format_func=lambda x: next(g[1] for g in governorates if g[0] == x))
+                format_func=lambda x: ref.governorate_names[x])
             
             submitted = st.form_submit_button("حفظ")
             
             if submitted:
                 if admin_name:
-                    conn = sqlite3.connect(DATABASE_PATH)
+                    conn = get_connection()
                     try:
                         existing = conn.execute('''
                             SELECT 1 FROM HealthAdministrations 
@@ -1028,6 +822,7 @@ def manage_regions():
                                 (admin_name, description, governorate_id)
                             )
                             conn.commit()
+                            bump_reference_data_version()
                             st.success("تمت إضافة الإدارة الصحية بنجاح")
                             st.rerun()
                     except sqlite3.Error as e:
@@ -1038,14 +833,10 @@ def manage_regions():
                     st.warning("يرجى إدخال اسم الإدارة الصحية")
 
 def edit_health_admin(admin_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    admin = conn.execute('''
-        SELECT h.admin_name, h.description, h.governorate_id, g.governorate_name
-        FROM HealthAdministrations h
-        JOIN Governorates g ON h.governorate_id = g.governorate_id
-        WHERE h.admin_id=?
-    ''', (admin_id,)).fetchone()
-    conn.close()
+    ref = get_reference_data()
+    admin = ref.health_admins_by_id.get(admin_id)
+    if admin is not None:
+        admin = (admin[1], admin[2], admin[3], ref.governorate_names[admin[3]]) if admin[3] in ref.governorate_names else None
     
     # Check if admin exists
     if admin is None:
@@ -1062,12 +853,12 @@ def edit_health_admin(admin_id):
             "المحافظة",
             options=[g[0] for g in governorates],
             index=[g[0] for g in governorates].index(admin[2]),
-            format_func=lambda x: next(g[1] for g in governorates if g[0] == x))
+            format_func=lambda x: ref.governorate_names[x])
         
         col1, col2 = st.columns(2)
         with col1:
             if st.form_submit_button("حفظ التعديلات"):
-                conn = sqlite3.connect(DATABASE_PATH)
+                conn = get_connection()
                 try:
                     existing = conn.execute('''
                         SELECT 1 FROM HealthAdministrations 
@@ -1082,6 +873,7 @@ def edit_health_admin(admin_id):
                             (new_name, new_desc, new_gov, admin_id)
                         )
                         conn.commit()
+                        bump_reference_data_version()
                         st.success("تم تحديث الإدارة الصحية بنجاح")
                         del st.session_state.editing_reg
                         st.rerun()
@@ -1095,7 +887,7 @@ def edit_health_admin(admin_id):
                 st.rerun()
 
 def delete_health_admin(admin_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         has_users = conn.execute("SELECT 1 FROM Users WHERE assigned_region=?", 
                                (admin_id,)).fetchone()
@@ -1105,6 +897,7 @@ def delete_health_admin(admin_id):
         
         conn.execute("DELETE FROM HealthAdministrations WHERE admin_id=?", (admin_id,))
         conn.commit()
+        bump_reference_data_version()
         st.success("تم حذف الإدارة الصحية بنجاح")
         return True
     except sqlite3.Error as e:
@@ -1115,58 +908,66 @@ def delete_health_admin(admin_id):
         
 
 
-def export_to_excel(data):
-    """تصدير البيانات إلى ملف Excel"""
+def export_to_excel(flt: AuditLogFilter = AuditLogFilter()):
+    """تصدير سجل التعديلات إلى ملف Excel بالكتابة المتدفقة صفحة بعد صفحة"""
     from io import BytesIO
     import time
+    from collections import Counter
     
-    # إنشاء DataFrame
-    df = pd.DataFrame(
-        [(log[0], log[1], log[2], log[3], log[4], 
-          log[5], log[6], log[7]) for log in data],
-        columns=["ID", "المستخدم", "الإجراء", "الجدول", "رقم السجل", 
-                 "القيمة القديمة", "القيمة الجديدة", "الوقت"]
-    )
-    
-    # إنشاء ملف Excel
-    output = BytesIO()
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     filename = f"audit_logs_export_{timestamp}.xlsx"
     
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='سجل التعديلات')
-        
-        # إضافة ورقة ملخص
-        summary = df.groupby(['الجدول', 'الإجراء']).size().unstack(fill_value=0)
-        summary.to_excel(writer, sheet_name='ملخص الإجراءات')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('سجل التعديلات')
+    sheet.append(AUDIT_LOG_COLUMNS)
+    counts = Counter()
+    for log in iter_audit_logs(flt):
+        sheet.append(list(log))
+        counts[(log[3], log[2])] += 1
+    
+    # إضافة ورقة ملخص (الجدول × الإجراء)
+    summary = workbook.create_sheet('ملخص الإجراءات')
+    actions = sorted({action for _, action in counts})
+    summary.append(["الجدول"] + actions)
+    for table in sorted({table for table, _ in counts}):
+        summary.append([table] + [counts[(table, action)] for action in actions])
+    
+    buffer = BytesIO()
+    workbook.save(buffer)
+    data = buffer.getvalue()
     
     # تقديم ملف للتنزيل
     st.download_button(
         label="⬇️ تنزيل ملف Excel",
-        data=output.getvalue(),
+        data=data,
         file_name=filename,
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
     
     st.success("تم إنشاء ملف التصدير بنجاح")
 
-def export_to_csv(data):
-    """تصدير البيانات إلى ملف CSV"""
+def export_to_csv(flt: AuditLogFilter = AuditLogFilter()):
+    """تصدير سجل التعديلات إلى ملف CSV بالكتابة المتدفقة صفحة بعد صفحة"""
+    import csv
+    import io
     import time
     
-    df = pd.DataFrame(
-        [(log[0], log[1], log[2], log[3], log[4], 
-         log[5], log[6], log[7]) for log in data],
-        columns=["ID", "المستخدم", "الإجراء", "الجدول", "رقم السجل", 
-                 "القيمة القديمة", "القيمة الجديدة", "الوقت"]
-    )
-    
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     filename = f"audit_logs_export_{timestamp}.csv"
     
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+    writer.writerow(AUDIT_LOG_COLUMNS)
+    for log in iter_audit_logs(flt):
+        writer.writerow(log)
+    text.flush()
+    data = buffer.getvalue()
+    text.detach()
+    
     st.download_button(
         label="⬇️ تنزيل ملف CSV",
-        data=df.to_csv(index=False, encoding='utf-8-sig'),
+        data=data,
         file_name=filename,
         mime="text/csv"
     )
@@ -1,9 +1,9 @@
 import streamlit as st
 from datetime import datetime, timedelta 
-from auth import authenticate, logout
+from auth import authenticate, logout, get_principal
 from admin_views import show_admin_dashboard
 from employee_views import show_employee_dashboard
-from database import init_db, get_user_role
+from database import init_db
 from governorate_admin_views import show_governorate_admin_dashboard
 
 # تهيئة قاعدة البيانات
@@ -18,7 +18,11 @@ def main():
         st.session_state.last_activity = datetime.now()  # لن يظهر الخطأ الآن
         
         # عرض واجهة المستخدم حسب الدور
-        user_role = get_user_role(st.session_state.user_id)
+        principal = get_principal()
+        if principal is None:  # تم حذف المستخدم
+            logout()
+            return
+        user_role = principal.role
         
         # زر تسجيل الخروج
         st.sidebar.button("تسجيل الخروج", on_click=logout)
@@ -0,0 +1,58 @@
+from typing import Optional
+
+import streamlit as st
+
+from database import assign_survey_to_employees, get_governorate_surveys, get_reference_data
+
+
+def show_bulk_assignment(key: str, governorate_id: Optional[int] = None):
+    """
+    نموذج منح أو سحب استبيان لجميع موظفي محافظة أو إدارة صحية دفعة واحدة
+    governorate_id: تثبيت المحافظة (لوحة مسؤول المحافظة)
+    """
+    ref = get_reference_data()
+
+    with st.expander("📌 تعيين استبيان لمجموعة موظفين"):
+        if governorate_id is None:
+            selected_gov = st.selectbox(
+                "المحافظة",
+                [g[0] for g in ref.governorates],
+                format_func=lambda x: ref.governorate_names[x],
+                key=f"{key}_governorate"
+            )
+        else:
+            selected_gov = governorate_id
+        if selected_gov is None:
+            st.info("لا توجد محافظات")
+            return
+
+        surveys = get_governorate_surveys(selected_gov)
+        if not surveys:
+            st.info("لا توجد استبيانات متاحة لهذه المحافظة")
+            return
+
+        with st.form(f"{key}_form"):
+            survey_id = st.selectbox(
+                "الاستبيان",
+                [s[0] for s in surveys],
+                format_func=lambda x: ref.survey_names.get(x, str(x)),
+                key=f"{key}_survey"
+            )
+            admin_id = st.selectbox(
+                "الإدارة الصحية",
+                [None] + [a[0] for a in ref.health_admins_by_governorate.get(selected_gov, [])],
+                format_func=lambda x: "جميع الإدارات" if x is None else ref.health_admin_names[x],
+                key=f"{key}_admin"
+            )
+            revoke = st.radio(
+                "العملية",
+                [False, True],
+                format_func=lambda x: "سحب الاستبيان" if x else "منح الاستبيان",
+                horizontal=True,
+                key=f"{key}_revoke"
+            )
+
+            if st.form_submit_button("تطبيق على جميع الموظفين"):
+                changed = assign_survey_to_employees(survey_id, selected_gov, admin_id, revoke)
+                if changed is not None:
+                    st.success(f"تم {'سحب' if revoke else 'منح'} الاستبيان لـ {changed} موظف")
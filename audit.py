@@ -0,0 +1,548 @@
+import atexit
+import gzip
+import json
+import os
+import shutil
+import queue
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from database import DATABASE_DIR, get_connection
+
+# أوضاع الكتابة في سجل التعديلات (يمكن تعديلها عبر متغيرات البيئة)
+# - sync: كتابة وتأكيد فوري في مسار الطلب (السلوك السابق)
+# - group: يضاف الحدث للطابور وينتظر الطلب حتى يكتب مع غيره في دفعة واحدة (لا فقد للبيانات)
+# - async: يعود الطلب فوراً والكتابة في الخلفية؛ قد تفقد أحداث آخر دفعة إذا توقفت العملية فجأة
+AUDIT_MODES = ('sync', 'group', 'async')
+AUDIT_MODE = os.environ.get("SURVEY_AUDIT_MODE", "async")
+AUDIT_BATCH_SIZE = int(os.environ.get("SURVEY_AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("SURVEY_AUDIT_FLUSH_INTERVAL", "1"))
+AUDIT_QUEUE_SIZE = int(os.environ.get("SURVEY_AUDIT_QUEUE_SIZE", "10000"))
+# مدة انتظار مكان في الطابور الممتلئ قبل الكتابة المباشرة من مسار الطلب
+AUDIT_ENQUEUE_TIMEOUT = float(os.environ.get("SURVEY_AUDIT_ENQUEUE_TIMEOUT", "0.5"))
+AUDIT_FLUSH_RETRIES = int(os.environ.get("SURVEY_AUDIT_FLUSH_RETRIES", "3"))
+
+# الاحتفاظ بسجل التعديلات: الصفوف الأقدم من AUDIT_RETENTION_DAYS تنقل إلى ملفات شهرية مضغوطة
+AUDIT_RETENTION_DAYS = int(os.environ.get("SURVEY_AUDIT_RETENTION_DAYS", "365"))
+AUDIT_ARCHIVE_DIR = os.environ.get("SURVEY_AUDIT_ARCHIVE_DIR", str(DATABASE_DIR / "audit_archive"))
+
+_INSERT_AUDIT = """INSERT INTO AuditLog
+                   (user_id, action_type, table_name, record_id, old_value, new_value, action_timestamp)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+class AuditEvent(NamedTuple):
+    """حدث في سجل التعديلات بالقيم الجاهزة للإدخال (الوقت يسجل لحظة وقوع الإجراء)"""
+    user_id: int
+    action_type: str
+    table_name: str
+    record_id: Optional[int]
+    old_value: Optional[str]
+    new_value: Optional[str]
+    action_timestamp: str
+
+
+def make_audit_event(user_id: int, action_type: str, table_name: str,
+                     record_id: int = None, old_value=None, new_value=None) -> AuditEvent:
+    return AuditEvent(
+        user_id, action_type, table_name, record_id,
+        json.dumps(old_value) if old_value else None,
+        json.dumps(new_value) if new_value else None,
+        datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+
+class _Flush(NamedTuple):
+    """طلب كتابة فورية لما في الطابور (done يطلق بعد الكتابة)"""
+    done: threading.Event
+
+
+_STOP = object()
+
+
+class AuditWriter:
+    """
+    كاتب سجل التعديلات على دفعات من خيط خلفي
+    - يكتب الدفعة عند بلوغ batch_size أو مرور flush_interval أو عند الإغلاق
+    - الطابور محدود الحجم؛ عند امتلائه ينتظر الطلب ثم يكتب مباشرة (ضغط عكسي)
+    """
+
+    def __init__(self, mode: str = AUDIT_MODE, connect: Callable = get_connection,
+                 batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 queue_size: int = AUDIT_QUEUE_SIZE, enqueue_timeout: float = AUDIT_ENQUEUE_TIMEOUT):
+        if mode not in AUDIT_MODES:
+            raise ValueError(f"وضع سجل التعديلات غير معروف: {mode}")
+        self.mode = mode
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'sync_writes': 0,
+            'queue_full_waits': 0,
+            'queue_full_fallbacks': 0,
+            'flush_errors': 0,
+            'dropped': 0,
+            'max_queue_depth': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+        }
+
+    def _count(self, name: str, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _write(self, events: List[AuditEvent]):
+        """كتابة مجموعة أحداث في معاملة واحدة"""
+        conn = self.connect()
+        try:
+            conn.executemany(_INSERT_AUDIT, events)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def log(self, event: AuditEvent):
+        """تسجيل حدث حسب وضع الكتابة"""
+        if self.mode == 'sync' or self._closed:
+            self._write([event])
+            self._count('sync_writes')
+            return
+
+        self._start()
+        done = threading.Event() if self.mode == 'group' else None
+        try:
+            self._queue.put_nowait((event, done))
+        except queue.Full:
+            self._count('queue_full_waits')
+            try:
+                self._queue.put((event, done), timeout=self.enqueue_timeout)
+            except queue.Full:
+                # الطابور ما زال ممتلئاً: الكتابة من مسار الطلب بدلاً من فقد الحدث
+                self._count('queue_full_fallbacks')
+                self._write([event])
+                self._count('sync_writes')
+                return
+
+        with self._lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._queue.qsize())
+        if done is not None:
+            done.wait()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """كتابة كل ما في الطابور الآن، ويعيد True إذا اكتملت الكتابة خلال المهلة"""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        request = _Flush(threading.Event())
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # الطابور الممتلئ أو الخيط المتوقف لا يحجب الطلب أكثر من المهلة
+            self._queue.put(request, timeout=timeout)
+        except queue.Full:
+            return False
+        return request.done.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def close(self, timeout: float = 10):
+        """إيقاف الخيط الخلفي بعد كتابة الأحداث المتبقية (يستدعى عند إنهاء العملية)"""
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _flush_pending(self, pending: List[tuple]):
+        if not pending:
+            return
+        events = [event for event, _ in pending]
+        start = time.perf_counter()
+        for attempt in range(AUDIT_FLUSH_RETRIES):
+            try:
+                self._write(events)
+                break
+            except sqlite3.Error as e:
+                self._count('flush_errors')
+                print(f"خطأ في كتابة سجل التعديلات: {e}")
+                time.sleep(min(0.1 * 2 ** attempt, 1))
+        else:
+            self._count('dropped', len(events))
+            events = []
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats['written'] += len(events)
+            self._stats['batches'] += 1
+            self._stats['last_flush_ms'] = elapsed
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed)
+        for _, done in pending:
+            if done is not None:
+                done.set()
+
+    def _run(self):
+        pending: List[tuple] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if pending else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # انتهت مهلة الدفعة الحالية
+
+            if item is _STOP or isinstance(item, _Flush):
+                self._flush_pending(pending)
+                pending = []
+                if item is _STOP:
+                    return
+                item.done.set()
+                continue
+
+            if item is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+                # group: الكتابة بمجرد فراغ الطابور (ما تجمع أثناء الكتابة السابقة يكتب معاً)
+                waiting = self.mode == 'group' and self._queue.empty()
+                if len(pending) < self.batch_size and time.monotonic() < deadline and not waiting:
+                    continue
+
+            self._flush_pending(pending)
+            pending = []
+
+    def stats(self) -> Dict[str, float]:
+        """إحصائيات الطابور والكتابة (لمراقبة الضغط العكسي)"""
+        with self._lock:
+            result = dict(self._stats)
+        result['queue_depth'] = self._queue.qsize()
+        result['mode'] = self.mode
+        return result
+
+
+_writer: Optional[AuditWriter] = None
+_writer_lock = threading.Lock()
+
+def get_audit_writer() -> AuditWriter:
+    """كاتب سجل التعديلات المشترك (ينشأ عند أول استخدام ويغلق عند إنهاء العملية)"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter()
+                atexit.register(_writer.close)
+    return _writer
+
+def flush_audit_writer(timeout: float = 5):
+    """كتابة الأحداث المنتظرة قبل قراءة السجل (لا شيء إذا لم يستخدم الكاتب بعد)"""
+    if _writer is not None:
+        _writer.flush(timeout)
+
+def get_audit_stats() -> Dict[str, float]:
+    """إحصائيات كاتب سجل التعديلات"""
+    return get_audit_writer().stats()
+
+
+# ==================== قراءة السجل ====================
+
+AUDIT_PAGE_SIZE = 100
+AUDIT_LOG_COLUMNS = ["ID", "المستخدم", "الإجراء", "الجدول", "رقم السجل",
+                     "القيمة القديمة", "القيمة الجديدة", "الوقت"]
+
+
+class AuditLogFilter(NamedTuple):
+    """مرشحات سجل التعديلات (تطبق داخل استعلام SQL)"""
+    table_name: Optional[str] = None
+    action_type: Optional[str] = None
+    username: Optional[str] = None      # جزء من اسم المستخدم
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None      # شامل
+    search: Optional[str] = None        # بحث نصي في المستخدم والجدول والإجراء والقيم
+
+
+def _fts_query(text: str) -> str:
+    """تحويل نص البحث إلى استعلام FTS5: كل كلمة كبادئة، وجميع الكلمات مطلوبة"""
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in text.split())
+
+
+def _audit_search_available(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'AuditLogSearch'"
+    ).fetchone() is not None
+
+
+def _audit_filter_sql(conn, flt: AuditLogFilter) -> Tuple[List[str], list]:
+    conditions, params = [], []
+    if flt.table_name:
+        conditions.append("a.table_name = ?")
+        params.append(flt.table_name)
+    if flt.action_type:
+        conditions.append("a.action_type = ?")
+        params.append(flt.action_type)
+    if flt.username:
+        conditions.append("u.username LIKE ?")
+        params.append(f"%{flt.username}%")
+    # نطاق على العمود نفسه حتى يستخدم فهرس action_timestamp
+    if flt.date_from is not None:
+        conditions.append("a.action_timestamp >= ?")
+        params.append(flt.date_from.isoformat())
+    if flt.date_to is not None:
+        conditions.append("a.action_timestamp < ?")
+        params.append((flt.date_to + timedelta(days=1)).isoformat())
+    if flt.search and flt.search.strip():
+        if _audit_search_available(conn):
+            conditions.append("a.log_id IN (SELECT rowid FROM AuditLogSearch WHERE AuditLogSearch MATCH ?)")
+            params.append(_fts_query(flt.search))
+        else:
+            conditions.append("""
+                (a.old_value LIKE ? OR a.new_value LIKE ? OR u.username LIKE ? OR
+                 a.table_name LIKE ? OR a.action_type LIKE ?)
+            """)
+            params.extend([f"%{flt.search}%"] * 5)
+    return conditions, params
+
+
+def fetch_audit_log_page(flt: AuditLogFilter = AuditLogFilter(),
+                         cursor: Optional[Tuple[str, int]] = None,
+                         page_size: int = AUDIT_PAGE_SIZE) -> Tuple[List[Tuple], Optional[Tuple[str, int]]]:
+    """
+    صفحة من سجل التعديلات مرتبة من الأحدث باستخدام keyset على (action_timestamp, log_id)
+    يعيد (الصفوف، مؤشر الصفحة التالية أو None)
+    """
+    flush_audit_writer()
+    conn = get_connection()
+    try:
+        conditions, params = _audit_filter_sql(conn, flt)
+        if cursor is not None:
+            conditions.append("(a.action_timestamp, a.log_id) < (?, ?)")
+            params.extend(cursor)
+        rows = conn.execute(f'''
+            SELECT a.log_id, u.username, a.action_type, a.table_name,
+                   a.record_id, a.old_value, a.new_value, a.action_timestamp
+            FROM AuditLog a
+            LEFT JOIN Users u ON a.user_id = u.user_id
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            ORDER BY a.action_timestamp DESC, a.log_id DESC
+            LIMIT ?
+        ''', params + [page_size + 1]).fetchall()
+    finally:
+        conn.close()
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, (rows[-1][7], rows[-1][0])
+    return rows, None
+
+
+def iter_audit_logs(flt: AuditLogFilter = AuditLogFilter(), page_size: int = 1000,
+                    include_archives: bool = True) -> Iterator[Tuple]:
+    """
+    المرور على جميع صفوف السجل المطابقة صفحة بعد صفحة دون تحميلها كلها في الذاكرة
+    إذا بدأ نطاق التاريخ قبل أحدث شهر مؤرشف تضاف صفوف الأرشيف بعد صفوف الجدول
+    """
+    cursor = None
+    while True:
+        rows, cursor = fetch_audit_log_page(flt, cursor, page_size)
+        yield from rows
+        if cursor is None:
+            break
+    if include_archives and flt.date_from is not None:
+        yield from _iter_archived_logs(flt)
+
+
+# ==================== الأرشفة ====================
+
+def get_audit_archives() -> List[Tuple]:
+    """فهرس الأرشيف: (الشهر، الملف، عدد الصفوف، أول وآخر log_id، أول وآخر وقت) من الأحدث"""
+    conn = get_connection()
+    try:
+        return conn.execute('''
+            SELECT month, file_name, row_count, first_log_id, last_log_id,
+                   first_timestamp, last_timestamp
+            FROM AuditArchives
+            ORDER BY month DESC
+        ''').fetchall()
+    finally:
+        conn.close()
+
+
+def _next_month(month: str) -> str:
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def archive_audit_logs(older_than_days: int = AUDIT_RETENTION_DAYS,
+                       archive_dir: str = AUDIT_ARCHIVE_DIR) -> Dict[str, int]:
+    """
+    نقل صفوف السجل الأقدم من older_than_days يوماً إلى ملف gzip JSONL لكل شهر
+    الصفوف الجديدة لشهر مؤرشف سابقاً تضاف كجزء gzip جديد في نسخة جديدة من الملف،
+    ولا تحذف من الجدول إلا بعد حفظ الملف، والفهرس يشير دائماً إلى ملف مكتمل
+    يعيد عدد الصفوف المؤرشفة لكل شهر
+    """
+    flush_audit_writer()
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    conn = get_connection()
+    try:
+        months = [row[0] for row in conn.execute('''
+            SELECT DISTINCT substr(action_timestamp, 1, 7)
+            FROM AuditLog
+            WHERE action_timestamp < ?
+            ORDER BY 1
+        ''', (cutoff,))]
+    finally:
+        conn.close()
+
+    archived = {}
+    for month in months:
+        start = f"{month}-01"
+        end = min(f"{_next_month(month)}-01", cutoff)
+        archived[month] = _archive_month(month, start, end, archive_dir)
+    return archived
+
+
+def _archive_month(month: str, start: str, end: str, archive_dir: str) -> int:
+    """أرشفة صفوف شهر واحد في النطاق [start, end)"""
+    conn = get_connection()
+    try:
+        previous = conn.execute(
+            "SELECT file_name, row_count, first_log_id, first_timestamp FROM AuditArchives WHERE month = ?",
+            (month,)
+        ).fetchone()
+        rows = conn.execute('''
+            SELECT a.log_id, a.user_id, u.username, a.action_type, a.table_name,
+                   a.record_id, a.old_value, a.new_value, a.action_timestamp
+            FROM AuditLog a
+            LEFT JOIN Users u ON u.user_id = a.user_id
+            WHERE a.action_timestamp >= ? AND a.action_timestamp < ?
+            ORDER BY a.log_id
+        ''', (start, end))
+
+        count, first_id, last_id, first_ts, last_ts = 0, None, None, None, None
+        temp_path = os.path.join(archive_dir, f".audit_{month}.tmp")
+        with open(temp_path, "wb") as output:
+            # نسخ الملف السابق كما هو ثم إضافة جزء gzip جديد (يقرأ gzip الأجزاء المتتالية كملف واحد)
+            if previous:
+                with open(os.path.join(archive_dir, previous[0]), "rb") as existing:
+                    shutil.copyfileobj(existing, output)
+            with gzip.GzipFile(fileobj=output, mode="wb") as archive:
+                for log_id, user_id, username, action, table, record_id, old, new, timestamp in rows:
+                    archive.write((json.dumps({
+                        "log_id": log_id, "user_id": user_id, "username": username,
+                        "action_type": action, "table_name": table, "record_id": record_id,
+                        "old_value": old, "new_value": new, "action_timestamp": timestamp
+                    }, ensure_ascii=False) + "\n").encode("utf-8"))
+                    count += 1
+                    first_id = log_id if first_id is None else min(first_id, log_id)
+                    last_id = log_id if last_id is None else max(last_id, log_id)
+                    first_ts = timestamp if first_ts is None else min(first_ts, timestamp)
+                    last_ts = timestamp if last_ts is None else max(last_ts, timestamp)
+            output.flush()
+            os.fsync(output.fileno())
+    finally:
+        conn.close()
+
+    if count == 0:
+        os.remove(temp_path)
+        return 0
+
+    file_name = f"audit_{month}_{last_id}.jsonl.gz"
+    os.replace(temp_path, os.path.join(archive_dir, file_name))
+
+    with get_connection() as conn:
+        conn.execute(
+            "DELETE FROM AuditLog WHERE action_timestamp >= ? AND action_timestamp < ? AND log_id <= ?",
+            (start, end, last_id)
+        )
+        conn.execute('''
+            INSERT INTO AuditArchives
+                (month, file_name, row_count, first_log_id, last_log_id, first_timestamp, last_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(month) DO UPDATE SET
+                file_name = excluded.file_name,
+                row_count = row_count + excluded.row_count,
+                first_log_id = MIN(first_log_id, excluded.first_log_id),
+                last_log_id = MAX(last_log_id, excluded.last_log_id),
+                first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp),
+                archived_at = CURRENT_TIMESTAMP
+        ''', (month, file_name, count, first_id, last_id, first_ts, last_ts))
+
+    # الملف السابق لم يعد مستخدماً في الفهرس
+    if previous and previous[0] != file_name:
+        try:
+            os.remove(os.path.join(archive_dir, previous[0]))
+        except OSError:
+            pass
+    return count
+
+
+def _search_text(value: Optional[str]) -> str:
+    """نص البحث من قيمة JSON (المفاتيح والقيم) كما في فهرس FTS"""
+    if not value:
+        return ""
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return value
+    parts = []
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            for key, nested in item.items():
+                parts.append(str(key))
+                stack.append(nested)
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif item is not None:
+            parts.append(str(item))
+    return " ".join(parts)
+
+
+def _archive_row_matches(row: dict, flt: AuditLogFilter, terms: List[str]) -> bool:
+    if flt.table_name and row["table_name"] != flt.table_name:
+        return False
+    if flt.action_type and row["action_type"] != flt.action_type:
+        return False
+    if flt.username and flt.username.lower() not in (row["username"] or "").lower():
+        return False
+    if terms:
+        text = " ".join([row["username"] or "", row["table_name"], row["action_type"],
+                         _search_text(row["old_value"]), _search_text(row["new_value"])]).lower()
+        return all(term in text for term in terms)
+    return True
+
+
+def _iter_archived_logs(flt: AuditLogFilter, archive_dir: str = AUDIT_ARCHIVE_DIR) -> Iterator[Tuple]:
+    """صفوف الأرشيف المطابقة للمرشحات من الأشهر التي يغطيها نطاق التاريخ (من الأحدث)"""
+    start = flt.date_from.isoformat()
+    end = (flt.date_to + timedelta(days=1)).isoformat() if flt.date_to is not None else None
+    terms = [term.lower() for term in flt.search.split()] if flt.search else []
+
+    for month, file_name, _, _, _, first_ts, last_ts in get_audit_archives():
+        if last_ts < start or (end is not None and first_ts >= end):
+            continue
+        matched = []
+        with gzip.open(os.path.join(archive_dir, file_name), "rt", encoding="utf-8") as archive:
+            for line in archive:
+                row = json.loads(line)
+                timestamp = row["action_timestamp"]
+                if timestamp < start or (end is not None and timestamp >= end):
+                    continue
+                if _archive_row_matches(row, flt, terms):
+                    matched.append((row["log_id"], row["username"], row["action_type"], row["table_name"],
+                                    row["record_id"], row["old_value"], row["new_value"], timestamp))
+        matched.sort(key=lambda r: (r[7], r[0]), reverse=True)
+        yield from matched
@@ -1,7 +1,8 @@
 import streamlit as st
 import hashlib
 from datetime import datetime, timedelta
-from database import get_user_by_username, update_last_login, init_db, update_user_activity
+from typing import Optional
+from database import get_user_by_username, update_last_login, init_db, update_user_activity, load_principal, get_principal_version, Principal
 
 def authenticate():
     # التحقق من وجود بيانات الجلسة وانتهاء المدة
@@ -35,12 +36,27 @@ def authenticate():
                 st.session_state.last_activity = datetime.now()
                 st.session_state.login_time = datetime.now()
                 update_last_login(user['user_id'])
+                st.session_state.principal = load_principal(user['user_id'])
                 st.rerun()
                 return True
             else:
                 st.error("اسم المستخدم أو كلمة المرور غير صحيحة")
     return False
 
+def get_principal() -> Optional[Principal]:
+    """بيانات المستخدم المسجل من الجلسة، يعاد تحميلها فقط عند تغير إصدار بياناته"""
+    user_id = st.session_state.get('user_id')
+    if user_id is None:
+        return None
+    principal = st.session_state.get('principal')
+    if principal is None or principal.version != get_principal_version(user_id):
+        principal = load_principal(user_id)
+        st.session_state.principal = principal
+        if principal:
+            st.session_state.role = principal.role
+            st.session_state.region_id = principal.region_id
+    return principal
+
 def check_password(hashed_password, user_password):
     return hashed_password == hash_password(user_password)
 
@@ -0,0 +1,337 @@
+"""
+قياس أداء طبقة قاعدة البيانات
+
+الاستخدام:
+    python benchmark.py concurrency --threads 8 --submits 50 --fields 20
+    python benchmark.py submit --submits 200 --fields 40
+    python benchmark.py field_stats --answers 1000000 --fields 20
+    python benchmark.py audit --threads 8 --submits 200
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from database import ConnectionPool, DB_CONCURRENCY_PROFILES, CompiledField
+from metrics import compute_field_stats
+from audit import AUDIT_MODES, AuditWriter, make_audit_event
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS Responses
+       (response_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        survey_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        region_id INTEGER NOT NULL,
+        submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_completed BOOLEAN DEFAULT FALSE)''',
+    '''CREATE TABLE IF NOT EXISTS Response_Details
+       (detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        response_id INTEGER NOT NULL,
+        field_id INTEGER NOT NULL,
+        answer_value TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS AuditLog
+       (log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        action_type TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        record_id INTEGER,
+        old_value TEXT,
+        new_value TEXT,
+        action_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+]
+
+
+def create_database(directory: str, name: str) -> str:
+    """إنشاء قاعدة بيانات مؤقتة بالجداول المطلوبة للقياس"""
+    path = os.path.join(directory, name)
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def run_threads(worker, threads: int) -> float:
+    """تشغيل الدالة على عدة خيوط وإرجاع الزمن الكلي"""
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - start
+
+
+def bench_concurrency(args):
+    """
+    مقارنة إنتاجية الإرسال المتزامن بين السلوك القديم (اتصال جديد لكل عملية
+    مع rollback journal) وملف التزامن wal مع مجمع الاتصالات، مع وجود قراء متزامنين
+    """
+    def submit(connect, release, user_id):
+        conn = connect()
+        try:
+            cur = conn.execute(
+                "INSERT INTO Responses (survey_id, user_id, region_id, is_completed) VALUES (?, ?, ?, ?)",
+                (1, user_id, 1, True)
+            )
+            response_id = cur.lastrowid
+            conn.commit()
+        finally:
+            release(conn)
+        for field_id in range(args.fields):
+            conn = connect()
+            try:
+                conn.execute(
+                    "INSERT INTO Response_Details (response_id, field_id, answer_value) VALUES (?, ?, ?)",
+                    (response_id, field_id, f"answer {field_id}")
+                )
+                conn.commit()
+            finally:
+                release(conn)
+
+    def read(connect, release):
+        conn = connect()
+        try:
+            conn.execute('''
+                SELECT r.response_id, COUNT(rd.detail_id)
+                FROM Responses r LEFT JOIN Response_Details rd ON rd.response_id = r.response_id
+                WHERE r.survey_id = 1 GROUP BY r.response_id
+            ''').fetchall()
+        finally:
+            release(conn)
+
+    def measure(label, connect, release):
+        errors = []
+        done = threading.Event()
+        reads = [0]
+
+        def writer(i):
+            for _ in range(args.submits):
+                try:
+                    submit(connect, release, i)
+                except sqlite3.OperationalError as e:
+                    errors.append(str(e))
+
+        def reader():
+            while not done.is_set():
+                try:
+                    read(connect, release)
+                    reads[0] += 1
+                except sqlite3.OperationalError as e:
+                    errors.append(str(e))
+
+        readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+        for t in readers:
+            t.start()
+        elapsed = run_threads(writer, args.threads)
+        done.set()
+        for t in readers:
+            t.join()
+
+        total = args.threads * args.submits
+        print(f"{label:<8} {total / elapsed:10.1f} submit/s  {elapsed:7.2f}s  "
+              f"reads={reads[0]:<6} lock_errors={len(errors)}")
+        return total / elapsed
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = create_database(directory, "legacy.db")
+        legacy = measure(
+            "legacy",
+            lambda: sqlite3.connect(legacy_path),
+            lambda conn: conn.close()
+        )
+
+        wal_path = create_database(directory, "wal.db")
+        pool = ConnectionPool(wal_path, size=args.threads + args.readers,
+                              pragmas=DB_CONCURRENCY_PROFILES['wal'])
+        profile = measure("wal", pool.acquire, pool.release)
+        pool.close_all()
+
+    print(f"speedup: x{profile / legacy:.2f}")
+
+
+def bench_submit(args):
+    """
+    زمن إرسال استجابة واحدة: المسار القديم (إدخال الاستجابة ثم كل إجابة بتأكيد مستقل)
+    مقابل المسار الجديد (الاستجابة وجميع الإجابات بـ executemany في معاملة واحدة)
+    """
+    answers = {field_id: f"answer {field_id}" for field_id in range(args.fields)}
+
+    def per_answer(conn):
+        cur = conn.execute(
+            "INSERT INTO Responses (survey_id, user_id, region_id, is_completed) VALUES (?, ?, ?, ?)",
+            (1, 1, 1, True)
+        )
+        response_id = cur.lastrowid
+        conn.commit()
+        for field_id, answer in answers.items():
+            conn.execute(
+                "INSERT INTO Response_Details (response_id, field_id, answer_value) VALUES (?, ?, ?)",
+                (response_id, field_id, answer)
+            )
+            conn.commit()
+
+    def batched(conn):
+        cur = conn.execute(
+            "INSERT INTO Responses (survey_id, user_id, region_id, is_completed) VALUES (?, ?, ?, ?)",
+            (1, 1, 1, True)
+        )
+        response_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO Response_Details (response_id, field_id, answer_value) VALUES (?, ?, ?)",
+            [(response_id, field_id, answer) for field_id, answer in answers.items()]
+        )
+        conn.commit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ('legacy', 'wal'):
+            results = {}
+            for label, submit in (('per-answer', per_answer), ('batched', batched)):
+                path = create_database(directory, f"{profile}_{label}.db")
+                pool = ConnectionPool(path, size=1, pragmas=DB_CONCURRENCY_PROFILES[profile])
+                conn = pool.acquire()
+                timings = []
+                for _ in range(args.submits):
+                    start = time.perf_counter()
+                    submit(conn)
+                    timings.append((time.perf_counter() - start) * 1000)
+                pool.release(conn)
+                pool.close_all()
+                results[label] = statistics.median(timings)
+                print(f"{profile:<7} {label:<11} median {results[label]:8.3f} ms  "
+                      f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:8.3f} ms")
+            print(f"{profile:<7} speedup x{results['per-answer'] / results['batched']:.1f}")
+
+
+def bench_field_stats(args):
+    """
+    زمن حساب إحصائيات الحقول: قراءة جماعية لجميع الإجابات ثم الحساب المتجه
+    (حقول بأنواع رقم/قائمة منسدلة/مربع اختيار/تاريخ/نص بالتناوب)
+    """
+    rng = np.random.default_rng(0)
+    types = ['number', 'dropdown', 'checkbox', 'date', 'text']
+    options = tuple(f"option {i}" for i in range(6))
+    fields = [
+        CompiledField(field_id=i, label=f"field {i}", field_type=types[i % len(types)],
+                      options=options if types[i % len(types)] == 'dropdown' else (),
+                      is_required=False, field_order=i, display_label=f"field {i}")
+        for i in range(args.fields)
+    ]
+
+    field_ids = np.arange(args.answers) % args.fields
+    generators = {
+        'number': lambda n: rng.normal(50, 15, n).round(2).astype(str),
+        'dropdown': lambda n: rng.choice(options, n),
+        'checkbox': lambda n: rng.choice(["True", "False"], n),
+        'date': lambda n: (np.datetime64('2024-01-01') + rng.integers(0, 365, n)).astype(str),
+        'text': lambda n: np.char.add("answer ", rng.integers(0, 1000, n).astype(str)),
+    }
+    values = np.empty(args.answers, dtype=object)
+    for field in fields:
+        mask = field_ids == field.field_id
+        values[mask] = generators[field.field_type](int(mask.sum()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = create_database(directory, "stats.db")
+        conn = sqlite3.connect(path)
+        responses = args.answers // args.fields + 1
+        conn.executemany("INSERT INTO Responses (survey_id, user_id, region_id, is_completed) VALUES (1, 1, 1, 1)",
+                         [()] * responses)
+        conn.executemany(
+            "INSERT INTO Response_Details (response_id, field_id, answer_value) VALUES (?, ?, ?)",
+            ((i // args.fields + 1, int(f), v) for i, (f, v) in enumerate(zip(field_ids, values)))
+        )
+        conn.commit()
+
+        start = time.perf_counter()
+        rows = conn.execute('''
+            SELECT rd.field_id, rd.answer_value
+            FROM Response_Details rd
+            JOIN Responses r ON r.response_id = rd.response_id
+            WHERE r.survey_id = 1
+        ''').fetchall()
+        ids, answers = zip(*rows)
+        ids = np.fromiter(ids, dtype=np.int64, count=len(rows))
+        answers = np.array(answers, dtype=object)
+        read = time.perf_counter() - start
+        conn.close()
+
+    start = time.perf_counter()
+    stats = compute_field_stats(fields, ids, answers)
+    compute = time.perf_counter() - start
+
+    print(f"answers={len(rows)} fields={len(stats)}  read {read:6.2f}s  compute {compute:6.2f}s  "
+          f"total {read + compute:6.2f}s")
+
+
+def bench_audit(args):
+    """
+    زمن الطلب مع تسجيل إجراء في سجل التعديلات لكل وضع كتابة:
+    sync (تأكيد لكل حدث في مسار الطلب) و group و async (كتابة على دفعات من خيط خلفي)
+    مع إحصائيات الطابور والضغط العكسي
+    """
+    old = {'username': 'user', 'role': 'employee', 'assigned_region': 1}
+    new = dict(old, assigned_region=2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ('legacy', 'wal'):
+            for mode in AUDIT_MODES:
+                path = create_database(directory, f"audit_{profile}_{mode}.db")
+                pool = ConnectionPool(path, size=args.threads + 1, pragmas=DB_CONCURRENCY_PROFILES[profile])
+                writer = AuditWriter(mode=mode, connect=pool.connection)
+                timings = [[] for _ in range(args.threads)]
+
+                def request(i):
+                    for n in range(args.submits):
+                        start = time.perf_counter()
+                        writer.log(make_audit_event(i, 'UPDATE', 'Users', n, old, new))
+                        timings[i].append((time.perf_counter() - start) * 1000)
+
+                elapsed = run_threads(request, args.threads)
+                writer.close()
+                stats = writer.stats()
+                conn = pool.acquire()
+                rows = conn.execute("SELECT COUNT(*) FROM AuditLog").fetchone()[0]
+                pool.release(conn)
+                pool.close_all()
+
+                latencies = sorted(t for thread in timings for t in thread)
+                print(f"{profile:<7} {mode:<6} median {statistics.median(latencies):8.3f} ms  "
+                      f"p95 {latencies[int(len(latencies) * 0.95) - 1]:8.3f} ms  "
+                      f"{len(latencies) / elapsed:9.0f} req/s  rows={rows} batches={stats['batches']} "
+                      f"max_queue={stats['max_queue_depth']} full_waits={stats['queue_full_waits']} "
+                      f"fallbacks={stats['queue_full_fallbacks']}")
+
+
+BENCHMARKS = {
+    'concurrency': bench_concurrency,
+    'submit': bench_submit,
+    'field_stats': bench_field_stats,
+    'audit': bench_audit,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء طبقة قاعدة البيانات")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--submits', type=int, default=25)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--answers', type=int, default=1000000)
+    args = parser.parse_args()
+
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""
+فحوصات سلوك طبقة قاعدة البيانات على قاعدة بيانات مؤقتة
+
+الاستخدام:
+    python checks.py all
+    python checks.py transactions
+    python checks.py pool
+    python checks.py audit_writer
+    python checks.py audit_triggers
+    python checks.py sheets_sync
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+# قاعدة بيانات مؤقتة بدلاً من قاعدة التطبيق (يجب تحديدها قبل استيراد database)
+os.environ["SURVEY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="survey_checks_"), "checks.db")
+
+import gspread
+from gspread.utils import a1_to_rowcol
+
+import database
+import exports
+from database import (get_connection, init_db, submit_survey_response, save_response_edits,
+                      acting_user, get_response_info)
+from audit import AuditWriter, make_audit_event
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition: bool, message: str):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def count(sql: str, params=()) -> int:
+    conn = get_connection()
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def seed() -> dict:
+    """بيانات أساسية: محافظة وإدارة صحية وموظف واستبيان بحقلين"""
+    with get_connection() as conn:
+        governorate_id = conn.execute(
+            "INSERT INTO Governorates (governorate_name) VALUES ('محافظة الفحص')").lastrowid
+        admin_id = conn.execute(
+            "INSERT INTO HealthAdministrations (admin_name, governorate_id) VALUES ('إدارة الفحص', ?)",
+            (governorate_id,)).lastrowid
+        user_id = conn.execute(
+            "INSERT INTO Users (username, password_hash, role, assigned_region) VALUES ('checks', '-', 'employee', ?)",
+            (admin_id,)).lastrowid
+        survey_id = conn.execute(
+            "INSERT INTO Surveys (survey_name, created_by) VALUES ('استبيان الفحص', ?)", (user_id,)).lastrowid
+        fields = [conn.execute(
+            """INSERT INTO Survey_Fields (survey_id, field_type, field_label, is_required, field_order)
+               VALUES (?, ?, ?, 0, ?)""", (survey_id, field_type, label, order)).lastrowid
+            for order, (field_type, label) in enumerate([('text', 'نص'), ('number', 'رقم')], 1)]
+    return {'user_id': user_id, 'region_id': admin_id, 'survey_id': survey_id, 'fields': fields}
+
+
+def check_transactions(data: dict):
+    """الإرسال داخل كتلة اتصال خارجية يتبع معاملتها"""
+    def submit(is_completed=False):
+        return submit_survey_response(data['survey_id'], data['user_id'], data['region_id'],
+                                      {data['fields'][0]: 'نص', data['fields'][1]: '5'}, is_completed)
+
+    responses = count("SELECT COUNT(*) FROM Responses")
+
+    # فشل الكتلة الخارجية بعد إرسال ناجح يلغي الإرسال
+    try:
+        with get_connection():
+            expect(submit() is not None, "فشل الإرسال داخل الكتلة الخارجية")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    expect(count("SELECT COUNT(*) FROM Responses") == responses,
+           "فشل الكتلة الخارجية لم يتراجع عن الإجابة")
+    expect(count("SELECT COUNT(*) FROM Response_Details WHERE response_id NOT IN (SELECT response_id FROM Responses)") == 0,
+           "بقيت تفاصيل إجابة بدون الإجابة")
+
+    # نجاح الكتلة الخارجية يؤكد الإرسال
+    with get_connection():
+        response_id = submit()
+    expect(count("SELECT COUNT(*) FROM Response_Details WHERE response_id = ?", (response_id,)) == 2,
+           "لم تحفظ تفاصيل الإجابة بعد نجاح الكتلة الخارجية")
+
+    # فشل الإرسال المتداخل يتراجع عنه وحده ويبقي عمليات الكتلة الخارجية
+    expect(submit(True) is not None, "فشل الإرسال المكتمل الأول")
+    with get_connection() as conn:
+        conn.execute("INSERT INTO Governorates (governorate_name) VALUES ('محافظة خارجية')")
+        expect(submit(True) is None, "سمح بإكمال الاستبيان مرتين في نفس اليوم")
+    expect(count("SELECT COUNT(*) FROM Governorates WHERE governorate_name = 'محافظة خارجية'") == 1,
+           "فشل الإرسال المتداخل تراجع عن عمليات الكتلة الخارجية")
+    expect(count("SELECT COUNT(*) FROM Responses") == responses + 2,
+           "عدد الإجابات غير متوقع بعد فشل الإرسال المتداخل")
+
+
+def check_pool(data: dict):
+    """اتصال ترك بدون close بسبب خطأ يعود إلى المجمع ولا يستنفده"""
+    pool = database.ConnectionPool(database.DATABASE_PATH, size=2, timeout=0.5)
+
+    def failing_read():
+        conn = pool.connection()
+        conn.execute("SELECT * FROM missing_table")
+        conn.close()
+
+    # نفس الخيط: يعاد الاتصال عند حذف الغلاف
+    for _ in range(3):
+        try:
+            failing_read()
+        except sqlite3.OperationalError:
+            pass
+    expect(pool.stats()['in_use'] == 0, "بقي الاتصال مستعاراً بعد خطأ في نفس الخيط")
+
+    # خيوط قصيرة العمر (مثل تشغيلات Streamlit) تنتهي والاتصال معلق فيها
+    held = []
+
+    def leak(write):
+        held.append(pool.connection())
+        if write:
+            held[-1].execute("INSERT INTO Governorates (governorate_name) VALUES ('محافظة معلقة')")
+        else:
+            held[-1].execute("SELECT 1").fetchone()
+
+    for write in (True, False):
+        thread = threading.Thread(target=leak, args=(write,))
+        thread.start()
+        thread.join()
+    expect(pool.stats()['in_use'] == 2, "الخيوط لم تحتجز اتصالاتها كما هو متوقع")
+    try:
+        conn = pool.connection()
+    except sqlite3.OperationalError:
+        raise CheckFailed("لم يسترجع المجمع اتصالات الخيوط المنتهية")
+    try:
+        expect(conn.execute("SELECT COUNT(*) FROM Governorates WHERE governorate_name = 'محافظة معلقة'").fetchone()[0] == 0,
+               "لم يتراجع عن معاملة الاتصال المسترجع")
+    finally:
+        conn.close()
+    expect(pool.stats()['reclaimed'] == 2, "عدد الاتصالات المسترجعة غير متوقع")
+
+    # غلاف قديم لنفس الاتصال لا يغلق استعارة جديدة له
+    stale = pool.connection()
+    stale_conn = stale.raw
+    pool.release(stale_conn)
+    fresh = pool.connection()
+    stale.close()
+    expect(pool._local.conn is fresh.raw, "أغلق غلاف قديم استعارة جديدة")
+    fresh.close()
+    held.clear()
+    pool.close_all()
+
+
+def _audit_record_ids(table_name: str) -> list:
+    conn = get_connection()
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT record_id FROM AuditLog WHERE table_name = ? ORDER BY log_id", (table_name,))]
+    finally:
+        conn.close()
+
+
+def check_audit_writer(data: dict):
+    """كاتب سجل التعديلات يكتب الأحداث بترتيبها، ويكتب مباشرة عند امتلاء الطابور"""
+    # group و async: كل الأحداث مكتوبة بترتيب تسجيلها عبر عدة دفعات
+    for mode in ('group', 'async'):
+        table_name = f"checks_{mode}"
+        writer = AuditWriter(mode=mode, batch_size=7, flush_interval=0.05)
+        for record_id in range(1, 51):
+            writer.log(make_audit_event(data['user_id'], 'CHECK', table_name, record_id))
+        expect(writer.flush(5), f"{mode}: لم تكتمل الكتابة خلال المهلة")
+        writer.close()
+        expect(_audit_record_ids(table_name) == list(range(1, 51)),
+               f"{mode}: الأحداث غير مكتملة أو بغير ترتيبها")
+
+    # طابور ممتلئ والخيط الخلفي متوقف داخل الكتابة: الحدث الجديد يكتب من مسار الطلب
+    table_name = "checks_queue_full"
+    release, blocked = threading.Event(), threading.Event()
+
+    def connect():
+        if threading.current_thread().name == "audit-writer":
+            blocked.set()
+            release.wait(5)
+        return get_connection()
+
+    writer = AuditWriter(mode='async', connect=connect, batch_size=1,
+                         queue_size=1, enqueue_timeout=0.05)
+    try:
+        writer.log(make_audit_event(data['user_id'], 'CHECK', table_name, 1))
+        expect(blocked.wait(5), "الخيط الخلفي لم يبدأ الكتابة")
+        writer.log(make_audit_event(data['user_id'], 'CHECK', table_name, 2))  # يبقى في الطابور
+        writer.log(make_audit_event(data['user_id'], 'CHECK', table_name, 3))  # الطابور ممتلئ
+        stats = writer.stats()
+        expect(stats['queue_full_fallbacks'] == 1 and stats['sync_writes'] == 1,
+               "امتلاء الطابور لم يؤد إلى كتابة مباشرة")
+        expect(_audit_record_ids(table_name) == [3], "الكتابة المباشرة لم تحفظ الحدث فوراً")
+
+        start = time.monotonic()
+        expect(not writer.flush(0.2), "flush أبلغ بالاكتمال والطابور ممتلئ")
+        expect(time.monotonic() - start < 2, "flush تجاوز مهلته مع طابور ممتلئ")
+    finally:
+        release.set()
+    expect(writer.flush(5), "لم تكتمل الكتابة بعد تحرير الخيط الخلفي")
+    writer.close()
+    expect(sorted(_audit_record_ids(table_name)) == [1, 2, 3], "فقدت أحداث بعد امتلاء الطابور")
+
+
+def check_audit_triggers(data: dict):
+    """triggers سجل التعديلات تسجل المستخدم المنفذ ولا تمنع الكتابة من خارج التطبيق"""
+    def last_log(table_name: str):
+        conn = get_connection()
+        try:
+            return conn.execute(
+                "SELECT user_id, action_type, record_id FROM AuditLog WHERE table_name = ? ORDER BY log_id DESC LIMIT 1",
+                (table_name,)).fetchone()
+        finally:
+            conn.close()
+
+    # كتابة من التطبيق باسم مستخدم محدد
+    with acting_user(data['user_id']), get_connection() as conn:
+        survey_id = conn.execute(
+            "INSERT INTO Surveys (survey_name, created_by) VALUES ('استبيان مسجل', ?)", (data['user_id'],)).lastrowid
+    expect(tuple(last_log('Surveys')) == (data['user_id'], 'INSERT', survey_id),
+           "إضافة الاستبيان لم تسجل باسم المستخدم المنفذ")
+
+    # سياق المستخدم لا يبقى على الاتصال بعد انتهائه
+    with get_connection() as conn:
+        conn.execute("UPDATE Surveys SET survey_name = 'استبيان معدل' WHERE survey_id = ?", (survey_id,))
+    expect(tuple(last_log('Surveys')) == (0, 'UPDATE', survey_id),
+           "بقي المستخدم المنفذ السابق على الاتصال")
+
+    # حفظ تعديلات الإجابة يسجل صفاً واحداً للدفعة فقط
+    response_id = submit_survey_response(data['survey_id'], data['user_id'], data['region_id'],
+                                         {data['fields'][0]: 'قبل', data['fields'][1]: '1'})
+    logs = count("SELECT COUNT(*) FROM AuditLog")
+    conn = get_connection()
+    try:
+        detail_ids = [row[0] for row in conn.execute(
+            "SELECT detail_id FROM Response_Details WHERE response_id = ?", (response_id,))]
+    finally:
+        conn.close()
+    expect(save_response_edits(response_id, get_response_info(response_id)[6],
+                               {detail_id: 'بعد' for detail_id in detail_ids[:1]}, data['user_id']) is not None,
+           "فشل حفظ تعديلات الإجابة")
+    expect(count("SELECT COUNT(*) FROM AuditLog") == logs + 1,
+           "حفظ تعديلات الإجابة سجل أكثر من صف")
+
+    # اتصال خارج التطبيق (مثل sqlite3 أو أدوات الاستعادة) يكتب دون تسجيل
+    logs = count("SELECT COUNT(*) FROM AuditLog")
+    external = sqlite3.connect(database.DATABASE_PATH)
+    try:
+        external.execute("INSERT INTO Surveys (survey_name, created_by) VALUES ('استبيان خارجي', ?)",
+                         (data['user_id'],))
+        external.commit()
+    except sqlite3.Error as e:
+        raise CheckFailed(f"فشلت الكتابة من اتصال خارجي: {e}")
+    finally:
+        external.close()
+    expect(count("SELECT COUNT(*) FROM AuditLog") == logs, "سجلت كتابة الاتصال الخارجي")
+
+
+class FakeWorksheet:
+    """ورقة عمل في الذاكرة بواجهة gspread المستخدمة في المزامنة (القيم تعود نصوصاً كما في Sheets)"""
+
+    def __init__(self, title: str, rows: int, cols: int):
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = []
+        self.calls = []
+        self.failures = []  # استثناءات ترفع في طلبات batch_update التالية (None للنجاح)
+
+    def clear(self):
+        self.cells = []
+
+    def resize(self, rows=None, cols=None):
+        self.calls.append(('resize', rows, cols))
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+
+    def batch_update(self, batch):
+        self.calls.append(('batch_update', len(batch)))
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure is not None:
+                raise failure
+        for item in batch:
+            first, _ = a1_to_rowcol(item['range'].split(':')[0])
+            for offset, row in enumerate(item['values']):
+                index = first - 1 + offset
+                if index >= self.row_count:
+                    raise gspread.exceptions.GSpreadException("الصف خارج حدود الورقة")
+                while len(self.cells) <= index:
+                    self.cells.append([])
+                self.cells[index] = [str(value) for value in row]
+
+    def col_values(self, col: int) -> List[str]:
+        values = [row[col - 1] if len(row) >= col else "" for row in self.cells]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def delete_rows(self, start: int, end: int):
+        self.calls.append(('delete_rows', start, end))
+        del self.cells[start - 1:end]
+        self.row_count -= end - start + 1
+
+    def ids(self) -> List[int]:
+        return [int(row[0]) for row in self.cells[1:]]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.worksheets = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        if title not in self.worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> FakeWorksheet:
+        self.worksheets[title] = FakeWorksheet(title, rows, cols)
+        return self.worksheets[title]
+
+
+class FakeSheetsClient:
+    """بديل محلي لعميل gspread (open/create فقط)"""
+
+    def __init__(self):
+        self.spreadsheets = {}
+
+    def open(self, name: str) -> FakeSpreadsheet:
+        if name not in self.spreadsheets:
+            raise gspread.SpreadsheetNotFound(name)
+        return self.spreadsheets[name]
+
+    def create(self, name: str) -> FakeSpreadsheet:
+        self.spreadsheets[name] = FakeSpreadsheet()
+        return self.spreadsheets[name]
+
+
+def check_sheets_sync(data: dict):
+    """المزامنة التزايدية مع Google Sheets على عميل محلي: إضافة وتعديل وحذف وتوسيع وإعادة محاولة"""
+    with get_connection() as conn:
+        survey_id = conn.execute(
+            "INSERT INTO Surveys (survey_name, created_by) VALUES ('استبيان المزامنة', ?)",
+            (data['user_id'],)).lastrowid
+        field_id = conn.execute(
+            """INSERT INTO Survey_Fields (survey_id, field_type, field_label, is_required, field_order)
+               VALUES (?, 'text', 'ملاحظة', 0, 1)""", (survey_id,)).lastrowid
+
+    def submit(value, is_completed=False):
+        response_id = submit_survey_response(survey_id, data['user_id'], data['region_id'],
+                                             {field_id: value}, is_completed)
+        expect(response_id is not None, "فشل إرسال إجابة للمزامنة")
+        return response_id
+
+    def execute(sql, params=()):
+        with get_connection() as conn:
+            conn.execute(sql, params)
+
+    client = FakeSheetsClient()
+    no_wait = lambda seconds: None
+
+    def sync(scope=exports.ExportScope(), name="checks"):
+        return exports.sync_survey_to_google_sheet(survey_id, name, client=client, scope=scope, sleep=no_wait)
+
+    def worksheet(name="checks", title="استبيان المزامنة") -> FakeWorksheet:
+        return client.open(name).worksheet(title)
+
+    # أول مزامنة: بناء كامل للورقة
+    first = [submit(f"قيمة {i}") for i in range(3)]
+    result = sync()
+    expect(result.rebuilt and result.appended == 3, f"نتيجة البناء الكامل غير متوقعة: {result}")
+    expect(worksheet().ids() == first, "صفوف البناء الكامل غير متوقعة")
+
+    # إضافة وتعديل في المكان وحذف وتوسيع الورقة
+    added = [submit("جديدة 1"), submit("جديدة 2")]
+    execute("UPDATE Response_Details SET answer_value = 'معدلة' WHERE response_id = ?", (first[0],))
+    execute("DELETE FROM Response_Details WHERE response_id = ?", (first[1],))
+    execute("DELETE FROM Responses WHERE response_id = ?", (first[1],))
+    rows_before = worksheet().row_count
+    result = sync()
+    expect((result.rebuilt, result.appended, result.updated, result.deleted) == (False, 2, 1, 1),
+           f"نتيجة المزامنة التزايدية غير متوقعة: {result}")
+    expect(worksheet().ids() == [first[0], first[2]] + added, "ترتيب الصفوف بعد المزامنة التزايدية غير متوقع")
+    expect("معدلة" in worksheet().cells[1], "لم يعد كتابة الصف المعدل في مكانه")
+    expect(worksheet().row_count > rows_before - 1, "لم توسع الورقة للصفوف الجديدة")
+
+    # خطأ مؤقت يعاد بعده الطلب
+    retried = submit("بعد خطأ مؤقت")
+    worksheet().failures = [ConnectionError("انقطاع مؤقت")]
+    result = sync()
+    expect(result.appended == 1 and worksheet().ids()[-1] == retried, "لم يعد الطلب بعد الخطأ المؤقت")
+
+    # فشل دفعة لاحقة بعد كتابة الأولى: المزامنة التالية لا تكرر ما كتب
+    batch_rows = exports.SHEETS_BATCH_ROWS
+    exports.SHEETS_BATCH_ROWS = 1
+    try:
+        partial = [submit("دفعة 1"), submit("دفعة 2")]
+        worksheet().failures = [None] + [ConnectionError("فشل دائم")] * (exports.SHEETS_MAX_RETRIES + 1)
+        try:
+            sync()
+            raise CheckFailed("لم يظهر فشل الدفعة الثانية")
+        except ConnectionError:
+            pass
+        expect(worksheet().ids()[-1] == partial[0], "الدفعة الأولى لم تكتب قبل الفشل")
+        worksheet().failures = []
+        sync()
+    finally:
+        exports.SHEETS_BATCH_ROWS = batch_rows
+    ids = worksheet().ids()
+    expect(len(ids) == len(set(ids)), "تكررت صفوف بعد فشل جزئي")
+    expect(ids[-2:] == partial, "لم تكتمل الصفوف بعد إعادة المزامنة")
+
+    # نطاق المكتملة فقط: الإجابة التي عادت مسودة تحذف من ورقة النطاق
+    scope = exports.ExportScope(completed_only=True)
+    completed = submit("مكتملة", is_completed=True)
+    sync(scope, name="checks-scope")
+    title = " - ".join(filter(None, ["استبيان المزامنة", scope.label()]))
+    expect(worksheet("checks-scope", title).ids() == [completed], "ورقة النطاق غير متوقعة")
+    execute("UPDATE Responses SET is_completed = 0 WHERE response_id = ?", (completed,))
+    result = sync(scope, name="checks-scope")
+    expect(result.deleted == 1 and worksheet("checks-scope", title).ids() == [],
+           "بقيت الإجابة التي خرجت من النطاق في ورقته")
+
+
+CHECKS = {
+    'transactions': check_transactions,
+    'pool': check_pool,
+    'audit_writer': check_audit_writer,
+    'audit_triggers': check_audit_triggers,
+    'sheets_sync': check_sheets_sync,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="فحوصات سلوك طبقة قاعدة البيانات")
+    parser.add_argument('check', choices=sorted(CHECKS) + ['all'])
+    args = parser.parse_args()
+
+    init_db()
+    data = seed()
+    failed = 0
+    names = sorted(CHECKS) if args.check == 'all' else [args.check]
+    for name in names:
+        try:
+            CHECKS[name](data)
+            print(f"ok   {name}")
+        except CheckFailed as e:
+            failed += 1
+            print(f"FAIL {name}: {e}")
+    print(f"database: {database.DATABASE_PATH}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
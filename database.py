@@ -1,138 +1,558 @@
 import sqlite3
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import json
-from typing import Optional, List, Tuple, Dict
-from datetime import datetime
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, List, Tuple, Dict, NamedTuple, FrozenSet, Callable
+from datetime import date, datetime
 from pathlib import Path
+from migrations import (migrate, get_schema_version, LATEST_VERSION, backfill_submission_rollup,
+                        backfill_answer_documents, set_answer_document_triggers, ANSWER_DOCUMENT_TRIGGERS,
+                        AUDIT_CONTEXT_TABLE, connection_audit_statements)
 BASE_DIR = Path(__file__).parent
 DATABASE_DIR = BASE_DIR / "data"
-DATABASE_DIR.mkdir(exist_ok=True)  
-DATABASE_PATH = str(DATABASE_DIR / "survey_app.db")
+DATABASE_DIR.mkdir(exist_ok=True)
+DATABASE_PATH = os.environ.get("SURVEY_DB_PATH", str(DATABASE_DIR / "survey_app.db"))
+
+# إعدادات مجمع الاتصالات (يمكن تعديلها عبر متغيرات البيئة)
+DB_POOL_SIZE = int(os.environ.get("SURVEY_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.environ.get("SURVEY_DB_POOL_TIMEOUT", "10"))
+DB_HEALTH_CHECK_INTERVAL = float(os.environ.get("SURVEY_DB_HEALTH_CHECK_INTERVAL", "30"))
+DB_CACHED_STATEMENTS = int(os.environ.get("SURVEY_DB_CACHED_STATEMENTS", "256"))
+
+# ملفات ضبط التزامن: تطبق أوامر PRAGMA الخاصة بالملف المختار على كل اتصال جديد
+# - wal: وضع WAL مع مهلة انتظار للأقفال حتى لا يحجب القراء الكتّاب
+# - legacy: السلوك الافتراضي لـ SQLite (rollback journal) بدون أي ضبط
+DB_CONCURRENCY_PROFILES: Dict[str, Dict[str, object]] = {
+    'wal': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+    'legacy': {},
+}
+DB_CONCURRENCY_PROFILE = os.environ.get("SURVEY_DB_PROFILE", "wal")
+
+# أوامر PRAGMA التي تطبق على كل اتصال جديد
+DB_PRAGMAS: Dict[str, object] = dict(DB_CONCURRENCY_PROFILES[DB_CONCURRENCY_PROFILE])
+
+# الفترة بين عمليات checkpoint الدورية لملف WAL (بالثواني، 0 لتعطيلها)
+DB_WAL_CHECKPOINT_INTERVAL = float(os.environ.get("SURVEY_DB_WAL_CHECKPOINT_INTERVAL", "300"))
+
+# سياق التسجيل التلقائي للتعديلات لكل خيط؛ ينسخ إلى جدول AuditContext المؤقت
+# للاتصال عند استعارته (فقط إذا تغير) فتقرؤه triggers دون أي استدعاء لـ Python
+_audit_context = threading.local()
+
+
+def current_audit_user() -> Optional[int]:
+    """
+    المستخدم المنفذ للتعديلات في الخيط الحالي
+    0 للعمليات التي لا يوجد لها مستخدم (أدوات الصيانة)، None عند إيقاف التسجيل
+    """
+    if getattr(_audit_context, 'suppressed', 0):
+        return None
+    user_id = getattr(_audit_context, 'user_id', None)
+    if user_id is None and get_script_run_ctx(suppress_warning=True) is not None:
+        # خيوط الخلفية (كاتب السجل، checkpoint) ليس لها جلسة
+        user_id = st.session_state.get('user_id')
+    return int(user_id) if user_id is not None else 0
+
+
+@contextmanager
+def acting_user(user_id: int):
+    """تحديد المستخدم المنفذ للتعديلات خارج جلسة Streamlit"""
+    previous = getattr(_audit_context, 'user_id', None)
+    _audit_context.user_id = user_id
+    _apply_held_audit_context()
+    try:
+        yield
+    finally:
+        _audit_context.user_id = previous
+        _apply_held_audit_context()
+
+
+@contextmanager
+def audit_suppressed():
+    """إيقاف التسجيل التلقائي مؤقتاً (لعمليات تكتب سجلها المجمع بنفسها)"""
+    _audit_context.suppressed = getattr(_audit_context, 'suppressed', 0) + 1
+    _apply_held_audit_context()
+    try:
+        yield
+    finally:
+        _audit_context.suppressed -= 1
+        _apply_held_audit_context()
+
+
+# حالة جدول AuditContext على الاتصال: لم ينشأ بعد، أو قيمة غير مؤكدة (كتبت داخل معاملة)
+_AUDIT_NOT_INSTALLED = object()
+_AUDIT_UNKNOWN = object()
+
+
+class _Connection(sqlite3.Connection):
+    """اتصال SQLite يحمل آخر مستخدم منفذ كتب في جدول AuditContext المؤقت الخاص به"""
+    audit_user = _AUDIT_NOT_INSTALLED
+
+
+class ConnectionPool:
+    """
+    مجمع اتصالات SQLite مشترك بين جميع الخيوط
+    - يعيد استخدام الاتصالات الدافئة (مع ذاكرة العبارات المحضرة)
+    - نفس الخيط يحصل على نفس الاتصال عند الاستدعاءات المتداخلة
+    - فحص صلاحية الاتصال الخامل قبل إعادة استخدامه
+    - استرجاع الاتصالات التي بقيت مستعارة لخيوط انتهت (خطأ قبل close)
+    """
+
+    def __init__(self, database_path: str, size: int = DB_POOL_SIZE,
+                 pragmas: Optional[Dict[str, object]] = None,
+                 timeout: float = DB_POOL_TIMEOUT,
+                 health_check_interval: float = DB_HEALTH_CHECK_INTERVAL):
+        self.database_path = database_path
+        self.size = size
+        self.pragmas = dict(DB_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open_count = 0
+        self._last_used = {}
+        # id(conn) -> (الخيط المستعير، الاتصال) لاسترجاع اتصالات الخيوط المنتهية
+        self._checked_out = {}
+        self._checkout_count = 0
+        self._stats = {
+            'opened': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'nested': 0,
+            'waits': 0,
+            'health_check_failures': 0,
+            'reclaimed': 0,
+        }
+
+    def _create(self) -> sqlite3.Connection:
+        """فتح اتصال جديد وتطبيق أوامر PRAGMA عليه"""
+        conn = sqlite3.connect(
+            self.database_path,
+            check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS,
+            factory=_Connection
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._lock:
+            self._stats['opened'] += 1
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        """إغلاق اتصال نهائياً وإخراجه من المجمع"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._open_count -= 1
+            self._stats['closed'] += 1
+            self._last_used.pop(id(conn), None)
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """التحقق من صلاحية اتصال خامل لفترة طويلة"""
+        idle_for = time.monotonic() - self._last_used.get(id(conn), 0)
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        """الحصول على اتصال من المجمع (أو الاتصال الحالي لنفس الخيط)"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            with self._lock:
+                self._stats['nested'] += 1
+            return held
+
+        conn = None
+        while conn is None:
+            try:
+                conn = self._idle.get_nowait()
+                if not self._is_healthy(conn):
+                    self._discard(conn)
+                    conn = None
+                    continue
+                with self._lock:
+                    self._stats['reused'] += 1
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open_count < self.size
+                    if can_open:
+                        self._open_count += 1
+                if can_open:
+                    try:
+                        conn = self._create()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._open_count -= 1
+                        raise
+                elif self._reclaim_orphans():
+                    continue
+                else:
+                    with self._lock:
+                        self._stats['waits'] += 1
+                    try:
+                        conn = self._idle.get(timeout=self.timeout)
+                    except queue.Empty:
+                        raise sqlite3.OperationalError("انتهت مهلة انتظار اتصال متاح بقاعدة البيانات")
+                    if not self._is_healthy(conn):
+                        self._discard(conn)
+                        conn = None
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._checkout_count += 1
+            self._checked_out[id(conn)] = (threading.current_thread(), conn)
+        self._local.conn = conn
+        self._local.depth = 1
+        self._local.checkout = self._checkout_count
+        return conn
+
+    def current_checkout(self) -> Optional[int]:
+        """رقم الاستعارة الحالية لهذا الخيط (يميز الأغلفة القديمة لنفس الاتصال)"""
+        return getattr(self._local, 'checkout', None)
+
+    def release(self, conn: sqlite3.Connection, checkout: Optional[int] = None):
+        """إرجاع الاتصال إلى المجمع مع التراجع عن أي معاملة غير مؤكدة"""
+        if getattr(self._local, 'conn', None) is not conn:
+            return
+        if checkout is not None and checkout != self._local.checkout:
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._checked_out.pop(id(conn), None)
+        self._return_idle(conn)
+
+    def _return_idle(self, conn: sqlite3.Connection):
+        """التراجع عن أي معاملة مفتوحة ثم إعادة الاتصال إلى الاتصالات الخاملة"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._idle.put(conn)
+
+    def _reclaim_orphans(self) -> int:
+        """استرجاع الاتصالات المستعارة لخيوط انتهت دون إرجاعها"""
+        with self._lock:
+            orphans = [conn for thread, conn in self._checked_out.values() if not thread.is_alive()]
+            for conn in orphans:
+                del self._checked_out[id(conn)]
+            self._stats['reclaimed'] += len(orphans)
+        for conn in orphans:
+            self._return_idle(conn)
+        return len(orphans)
+
+    def connection(self) -> 'PooledConnection':
+        """الحصول على اتصال مغلف يمكن استخدامه مع with أو إغلاقه يدوياً"""
+        return PooledConnection(self, self.acquire())
+
+    def close_all(self):
+        """إغلاق جميع الاتصالات الخاملة في المجمع"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, int]:
+        """إحصائيات فتح واستعارة الاتصالات"""
+        with self._lock:
+            result = dict(self._stats)
+            result['open'] = self._open_count
+        result['idle'] = self._idle.qsize()
+        result['in_use'] = result['open'] - result['idle']
+        return result
+
+
+class PooledConnection:
+    """
+    غلاف حول اتصال من المجمع
+    - close() يعيد الاتصال إلى المجمع بدلاً من إغلاقه
+    - عند الاستخدام مع with تؤكد الكتلة الخارجية عند النجاح وتتراجع عند الخطأ،
+      والكتل المتداخلة تستخدم SAVEPOINT داخل معاملتها
+    """
+
+    def __init__(self, pool: ConnectionPool, conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+        self._checkout = pool.current_checkout()
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self) -> sqlite3.Connection:
+        return self._conn
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, self._checkout)
+
+    def __del__(self):
+        # غلاف ترك بدون close (خطأ قبل الإغلاق): يعاد الاتصال إذا حذف في نفس الخيط،
+        # وإلا يسترجعه المجمع بعد انتهاء الخيط
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        # عند التداخل مع اتصال مستعار مسبقاً في نفس الخيط نستخدم SAVEPOINT
+        # حتى يكون التراجع عند الخطأ مقتصراً على عمليات هذه الكتلة
+        self._savepoint = None
+        if self._pool._local.depth > 1:
+            self._savepoint = f"sp_{id(self)}"
+            self._conn.execute(f"SAVEPOINT {self._savepoint}")
+        elif not self._conn.in_transaction:
+            # الكتلة الخارجية تبدأ المعاملة حتى تبقى الكتل المتداخلة جزءاً منها
+            self._conn.execute("BEGIN")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._savepoint:
+                # الكتلة المتداخلة تنهي نقطة الحفظ فقط؛ التأكيد أو التراجع للكتلة الخارجية
+                if exc_type is not None:
+                    self._conn.execute(f"ROLLBACK TO {self._savepoint}")
+                self._conn.execute(f"RELEASE {self._savepoint}")
+            elif exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """الحصول على مجمع الاتصالات المشترك (ينشأ عند أول استخدام)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_PATH)
+    return _pool
+
+def get_connection() -> PooledConnection:
+    """الحصول على اتصال بقاعدة البيانات من المجمع المشترك"""
+    conn = get_pool().connection()
+    if _schema_checked:
+        _apply_audit_context(conn.raw)
+    return conn
+
+def _apply_audit_context(conn: sqlite3.Connection):
+    """
+    كتابة المستخدم المنفذ في جدول AuditContext المؤقت للاتصال عند تغيره فقط
+    (وإنشاء triggers التسجيل المؤقتة عند أول استخدام للاتصال)
+    """
+    user_id = current_audit_user()
+    applied = getattr(conn, 'audit_user', _AUDIT_NOT_INSTALLED)
+    if applied == user_id and applied is not _AUDIT_UNKNOWN:
+        return
+    started = not conn.in_transaction
+    if applied is _AUDIT_NOT_INSTALLED:
+        if not started:
+            return
+        for statement in connection_audit_statements():
+            conn.execute(statement)
+    conn.execute(f"UPDATE temp.{AUDIT_CONTEXT_TABLE} SET user_id = ?", (user_id,))
+    if started:
+        # الجدول المؤقت فقط تغير، فالتأكيد لا يلمس ملف قاعدة البيانات
+        conn.commit()
+        conn.audit_user = user_id
+    else:
+        # جزء من المعاملة الجارية وقد يتراجع معها، فيعاد كتابته عند الاستعارة التالية
+        conn.audit_user = _AUDIT_UNKNOWN
+
+def _apply_held_audit_context():
+    """تحديث سياق التسجيل على الاتصال المستعار حالياً في هذا الخيط (إن وجد)"""
+    held = getattr(_pool._local, 'conn', None) if _pool is not None else None
+    if held is not None and _schema_checked:
+        _apply_audit_context(held)
+
+def get_pool_stats() -> Dict[str, int]:
+    """إحصائيات مجمع الاتصالات"""
+    return get_pool().stats()
+
+def checkpoint_wal(mode: str = "PASSIVE") -> Optional[Tuple[int, int, int]]:
+    """
+    نقل صفحات ملف WAL إلى قاعدة البيانات الرئيسية
+    يعيد (busy, log_pages, checkpointed_pages) أو None إذا لم تكن قاعدة البيانات في وضع WAL
+    """
+    conn = get_connection()
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            return None
+        return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        conn.close()
+
+_checkpoint_thread: Optional[threading.Thread] = None
+
+def start_wal_checkpointer(interval: float = DB_WAL_CHECKPOINT_INTERVAL):
+    """تشغيل خيط خلفي يقوم بعمل checkpoint لملف WAL بشكل دوري (مرة واحدة لكل عملية)"""
+    global _checkpoint_thread
+    if interval <= 0:
+        return
+    with _pool_lock:
+        if _checkpoint_thread is not None and _checkpoint_thread.is_alive():
+            return
+
+        def _run():
+            while True:
+                time.sleep(interval)
+                try:
+                    checkpoint_wal("PASSIVE")
+                except sqlite3.Error as e:
+                    print(f"خطأ في checkpoint لملف WAL: {e}")
+
+        _checkpoint_thread = threading.Thread(target=_run, name="wal-checkpointer", daemon=True)
+        _checkpoint_thread.start()
+
+_schema_checked = False
 
 def init_db():
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    
-    # Create Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS Users
-                 (user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT UNIQUE NOT NULL,
-                  password_hash TEXT NOT NULL,
-                  role TEXT NOT NULL,
-                  assigned_region INTEGER,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  last_login TIMESTAMP,
-                  FOREIGN KEY(assigned_region) REFERENCES Regions(region_id))''')
-    
-    # Create Governorates table
-    c.execute('''CREATE TABLE IF NOT EXISTS Governorates
-                 (governorate_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  governorate_name TEXT NOT NULL UNIQUE,
-                  description TEXT)''')
-    
-    # Create Regions table (with governorate relationship)
-    c.execute('''CREATE TABLE IF NOT EXISTS HealthAdministrations
-             (admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
-              admin_name TEXT NOT NULL,
-              description TEXT,
-              governorate_id INTEGER NOT NULL,
-              FOREIGN KEY(governorate_id) REFERENCES Governorates(governorate_id),
-              UNIQUE(admin_name, governorate_id))''')
-             
-    # Create Surveys table
-    c.execute('''CREATE TABLE IF NOT EXISTS Surveys
-                 (survey_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  survey_name TEXT NOT NULL,
-                  created_by INTEGER NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  is_active BOOLEAN DEFAULT TRUE,
-                  FOREIGN KEY(created_by) REFERENCES Users(user_id))''')
-    
-    # Create Survey_Fields table
-    c.execute('''CREATE TABLE IF NOT EXISTS Survey_Fields
-                 (field_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  survey_id INTEGER NOT NULL,
-                  field_type TEXT NOT NULL,
-                  field_label TEXT NOT NULL,
-                  field_options TEXT,
-                  is_required BOOLEAN DEFAULT FALSE,
-                  field_order INTEGER NOT NULL,
-                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id))''')
-    
-    # Create Responses table
-    c.execute('''CREATE TABLE IF NOT EXISTS Responses
-                 (response_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  survey_id INTEGER NOT NULL,
-                  user_id INTEGER NOT NULL,
-                  region_id INTEGER NOT NULL,
-                  submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  is_completed BOOLEAN DEFAULT FALSE,
-                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
-                  FOREIGN KEY(user_id) REFERENCES Users(user_id),
-                  FOREIGN KEY(region_id) REFERENCES Regions(region_id))''')
-    
-    # Create Response_Details table
-    c.execute('''CREATE TABLE IF NOT EXISTS Response_Details
-                 (detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  response_id INTEGER NOT NULL,
-                  field_id INTEGER NOT NULL,
-                  answer_value TEXT,
-                  FOREIGN KEY(response_id) REFERENCES Responses(response_id),
-                  FOREIGN KEY(field_id) REFERENCES Survey_Fields(field_id))''')
-                 
-    c.execute('''CREATE TABLE IF NOT EXISTS GovernorateAdmins
-             (admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_id INTEGER NOT NULL,
-              governorate_id INTEGER NOT NULL,
-              FOREIGN KEY(user_id) REFERENCES Users(user_id),
-              FOREIGN KEY(governorate_id) REFERENCES Governorates(governorate_id),
-              UNIQUE(user_id, governorate_id))''')
-             
-             
-    c.execute('''CREATE TABLE IF NOT EXISTS UserSurveys
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_id INTEGER NOT NULL,
-              survey_id INTEGER NOT NULL,
-              FOREIGN KEY(user_id) REFERENCES Users(user_id),
-              FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
-              UNIQUE(user_id, survey_id))''')        
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS SurveyGovernorate
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  survey_id INTEGER NOT NULL,
-                  governorate_id INTEGER NOT NULL,
-                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
-                  FOREIGN KEY(governorate_id) REFERENCES Governorates(governorate_id),
-                  UNIQUE(survey_id, governorate_id))''')    
-                 
-                 
-    c.execute('''CREATE TABLE IF NOT EXISTS AuditLog
-             (log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_id INTEGER NOT NULL,
-              action_type TEXT NOT NULL,
-              table_name TEXT NOT NULL,
-              record_id INTEGER,
-              old_value TEXT,
-              new_value TEXT,
-              action_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-              FOREIGN KEY(user_id) REFERENCES Users(user_id))''')             
-    # Add default admin user if none exists
-    c.execute("SELECT COUNT(*) FROM Users WHERE role='admin'")
-    if c.fetchone()[0] == 0:
-        from auth import hash_password
-        admin_password = hash_password("admin123")
-        c.execute("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, ?)",
-                  ("admin", admin_password, "admin"))
-    
-    conn.commit()
-    conn.close()
+    """التأكد من أن مخطط قاعدة البيانات محدث (يطبق الترحيلات عند الحاجة فقط)"""
+    global _schema_checked
+    if _schema_checked:
+        return
+    conn = get_connection()
+    try:
+        if get_schema_version(conn) < LATEST_VERSION:
+            migrate(conn.raw)
+    finally:
+        conn.close()
+    _schema_checked = True
+    start_wal_checkpointer()
+
+def rebuild_submission_rollup() -> int:
+    """إعادة بناء جدول التجميع SubmissionRollup من Responses، ويعيد عدد صفوفه"""
+    with get_connection() as conn:
+        backfill_submission_rollup(conn.cursor())
+        return conn.execute("SELECT COUNT(*) FROM SubmissionRollup").fetchone()[0]
+
+
+# ==================== مستندات الإجابات ====================
+
+def answer_documents_enabled(conn=None) -> bool:
+    """هل وضع المستندات مفعل (triggers المزامنة موجودة)"""
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+            (next(iter(ANSWER_DOCUMENT_TRIGGERS)),)
+        ).fetchone()[0] > 0
+    finally:
+        if own:
+            conn.close()
+
+
+def set_answer_documents(enabled: bool) -> int:
+    """
+    تفعيل أو إيقاف حفظ مستند JSON مضغوط لكل إجابة بجانب Response_Details
+    عند التفعيل تبنى المستندات للإجابات الموجودة؛ يعيد عدد المستندات
+    """
+    with get_connection() as conn:
+        set_answer_document_triggers(conn.cursor(), enabled)
+        return conn.execute("SELECT COUNT(*) FROM ResponseDocuments").fetchone()[0]
+
+
+def get_response_answers(response_id: int) -> Dict[int, Optional[str]]:
+    """
+    إجابات استجابة واحدة {field_id: answer_value}
+    قراءة صف واحد من ResponseDocuments عند تفعيل وضع المستندات، وإلا من Response_Details
+    """
+    conn = get_connection()
+    try:
+        if answer_documents_enabled(conn):
+            row = conn.execute(
+                "SELECT answers FROM ResponseDocuments WHERE response_id = ?",
+                (response_id,)
+            ).fetchone()
+            return {int(k): v for k, v in json.loads(row[0]).items()} if row else {}
+        return dict(conn.execute(
+            "SELECT field_id, answer_value FROM Response_Details WHERE response_id = ? ORDER BY detail_id",
+            (response_id,)
+        ).fetchall())
+    finally:
+        conn.close()
+
+
+def check_answer_documents(repair: bool = False) -> List[int]:
+    """
+    مقارنة مستندات الإجابات مع Response_Details
+    يعيد أرقام الإجابات غير المتطابقة، ومع repair يعاد بناء مستنداتها
+    (قائمة فارغة إذا كان وضع المستندات غير مفعل)
+    """
+    with get_connection() as conn:
+        if not answer_documents_enabled(conn):
+            return []
+        mismatched = [row[0] for row in conn.execute('''
+            WITH eav AS (
+                SELECT rd.response_id, rd.field_id, rd.answer_value
+                FROM Response_Details rd
+            ), docs AS (
+                SELECT d.response_id, CAST(j.key AS INTEGER) AS field_id, j.value AS answer_value
+                FROM ResponseDocuments d, json_each(d.answers) j
+            )
+            SELECT response_id FROM (SELECT * FROM eav EXCEPT SELECT * FROM docs)
+            UNION
+            SELECT response_id FROM (SELECT * FROM docs EXCEPT SELECT * FROM eav)
+            UNION
+            SELECT d.response_id FROM ResponseDocuments d
+            WHERE NOT EXISTS (SELECT 1 FROM Responses r WHERE r.response_id = d.response_id)
+            ORDER BY 1
+        ''')]
+        if repair and mismatched:
+            backfill_answer_documents(conn.cursor(), mismatched)
+            conn.execute('''
+                DELETE FROM ResponseDocuments
+                WHERE NOT EXISTS (SELECT 1 FROM Responses r
+                                  WHERE r.response_id = ResponseDocuments.response_id)
+            ''')
+    return mismatched
 
 def get_user_by_username(username):
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM Users WHERE username=?", (username,))
-    user = c.fetchone()
-    conn.close()
+    conn = get_connection()
+    try:
+        user = conn.execute("SELECT * FROM Users WHERE username=?", (username,)).fetchone()
+    finally:
+        conn.close()
     
     if user:
         return {
@@ -147,89 +567,240 @@ def get_user_by_username(username):
     return None
 
 def get_user_role(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    c.execute("SELECT role FROM Users WHERE user_id=?", (user_id,))
-    role = c.fetchone()
-    conn.close()
+    conn = get_connection()
+    try:
+        role = conn.execute("SELECT role FROM Users WHERE user_id=?", (user_id,)).fetchone()
+    finally:
+        conn.close()
     return role[0] if role else None
 
 
 
+class ReferenceData:
+    """لقطة من البيانات المرجعية (المحافظات، الإدارات الصحية، الاستبيانات) مع فهارس حسب المعرف"""
+
+    def __init__(self, version: int, governorates: List[Tuple], health_admins: List[Tuple],
+                 surveys: List[Tuple]):
+        self.version = version
+        # (governorate_id, governorate_name, description)
+        self.governorates = governorates
+        # (admin_id, admin_name, description, governorate_id)
+        self.health_admins = health_admins
+        # (survey_id, survey_name, created_at, is_active)
+        self.surveys = surveys
+
+        self.governorate_names = {g[0]: g[1] for g in governorates}
+        self.health_admin_names = {a[0]: a[1] for a in health_admins}
+        self.health_admins_by_id = {a[0]: a for a in health_admins}
+        self.survey_names = {s[0]: s[1] for s in surveys}
+        self.surveys_by_id = {s[0]: s for s in surveys}
+        self.surveys_by_name = sorted(surveys, key=lambda s: s[1])
+        self.health_admins_by_governorate: Dict[int, List[Tuple[int, str]]] = {}
+        for admin in health_admins:
+            self.health_admins_by_governorate.setdefault(admin[3], []).append((admin[0], admin[1]))
+
+
+_reference_version = 0
+_reference_data: Optional[ReferenceData] = None
+_reference_lock = threading.Lock()
+
+def bump_reference_data_version():
+    """إبطال ذاكرة البيانات المرجعية بعد أي تعديل على المحافظات أو الإدارات الصحية أو الاستبيانات"""
+    global _reference_version
+    with _reference_lock:
+        _reference_version += 1
+
+def get_reference_data() -> ReferenceData:
+    """الحصول على البيانات المرجعية من الذاكرة (تحمل من قاعدة البيانات عند تغير الإصدار فقط)"""
+    global _reference_data
+    data = _reference_data
+    if data is not None and data.version == _reference_version:
+        return data
+    with _reference_lock:
+        version = _reference_version
+        if _reference_data is not None and _reference_data.version == version:
+            return _reference_data
+        conn = get_connection()
+        try:
+            governorates = conn.execute(
+                "SELECT governorate_id, governorate_name, description FROM Governorates"
+            ).fetchall()
+            health_admins = conn.execute(
+                "SELECT admin_id, admin_name, description, governorate_id FROM HealthAdministrations"
+            ).fetchall()
+            surveys = conn.execute(
+                "SELECT survey_id, survey_name, created_at, is_active FROM Surveys"
+            ).fetchall()
+        finally:
+            conn.close()
+        _reference_data = ReferenceData(version, governorates, health_admins, surveys)
+        return _reference_data
+
 def get_health_admins():
     """استرجاع جميع الإدارات الصحية من قاعدة البيانات"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    c.execute("SELECT admin_id, admin_name FROM HealthAdministrations")
-    admins = c.fetchall()
-    conn.close()
-    return admins
+    return [(a[0], a[1]) for a in get_reference_data().health_admins]
+
+def get_health_admins_by_governorate(governorate_id: int) -> List[Tuple[int, str]]:
+    """استرجاع الإدارات الصحية التابعة لمحافظة معينة"""
+    return get_reference_data().health_admins_by_governorate.get(governorate_id, [])
 
 def get_health_admin_name(admin_id):
     """استرجاع اسم الإدارة الصحية بناءً على المعرف"""
     if admin_id is None:
         return "غير معين"
     
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
     try:
-        c.execute("SELECT admin_name FROM HealthAdministrations WHERE admin_id=?", (admin_id,))
-        result = c.fetchone()
-        return result[0] if result else "غير معروف"
+        return get_reference_data().health_admin_names.get(admin_id, "غير معروف")
     except sqlite3.Error as e:
         print(f"خطأ في جلب اسم الإدارة الصحية: {e}")
         return "خطأ في النظام"
-    finally:
-        conn.close()        
         
-def save_response(survey_id, user_id, region_id, is_completed=False):
-    """حفظ استجابة جديدة في قاعدة البيانات"""
-    conn = None
+class Principal(NamedTuple):
+    """بيانات المستخدم المسجل التي تحمل مرة واحدة عند الدخول وتبقى في الجلسة"""
+    user_id: int
+    username: str
+    role: str
+    region_id: Optional[int]
+    region_name: Optional[str]
+    governorate_id: Optional[int]
+    governorate_name: Optional[str]
+    governorate_description: Optional[str]
+    last_login: Optional[str]
+    allowed_surveys: Tuple[Tuple[int, str], ...]
+    allowed_survey_ids: FrozenSet[int]
+    version: Tuple[int, int]
+
+
+_user_versions: Dict[int, int] = {}
+_user_versions_lock = threading.Lock()
+
+def bump_user_version(user_id: int):
+    """إبلاغ الجلسات المفتوحة للمستخدم بأن بياناته أو صلاحياته تغيرت"""
+    with _user_versions_lock:
+        _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+
+def get_principal_version(user_id: int) -> Tuple[int, int]:
+    """إصدار بيانات المستخدم: (إصدار المستخدم، إصدار البيانات المرجعية)"""
+    return (_user_versions.get(user_id, 0), _reference_version)
+
+def load_principal(user_id: int) -> Optional[Principal]:
+    """تحميل بيانات المستخدم ومنطقته ومحافظته والاستبيانات المسموح بها باتصال واحد"""
+    version = get_principal_version(user_id)
+    conn = get_connection()
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        c = conn.cursor()
-        
-        c.execute(
-            '''INSERT INTO Responses 
-               (survey_id, user_id, region_id, is_completed) 
-               VALUES (?, ?, ?, ?)''',
-            (survey_id, user_id, region_id, is_completed)
-        )
-        response_id = c.lastrowid
-        conn.commit()
-        return response_id
-    except sqlite3.Error as e:
-        st.error(f"حدث خطأ في حفظ الاستجابة: {str(e)}")
-        return None
+        user = conn.execute('''
+            SELECT u.username, u.role, u.last_login,
+                   h.admin_id, h.admin_name, g.governorate_id, g.governorate_name, g.description
+            FROM Users u
+            LEFT JOIN HealthAdministrations h ON u.assigned_region = h.admin_id
+            LEFT JOIN Governorates g ON h.governorate_id = g.governorate_id
+            WHERE u.user_id = ?
+        ''', (user_id,)).fetchone()
+        if not user:
+            return None
+        username, role, last_login, region_id, region_name, gov_id, gov_name, gov_desc = user
+
+        if role == 'governorate_admin':
+            gov = conn.execute('''
+                SELECT g.governorate_id, g.governorate_name, g.description
+                FROM GovernorateAdmins ga
+                JOIN Governorates g ON ga.governorate_id = g.governorate_id
+                WHERE ga.user_id = ?
+            ''', (user_id,)).fetchone()
+            gov_id, gov_name, gov_desc = gov if gov else (None, None, None)
+
+        allowed_surveys = tuple(conn.execute('''
+            SELECT s.survey_id, s.survey_name
+            FROM Surveys s
+            JOIN UserSurveys us ON s.survey_id = us.survey_id
+            WHERE us.user_id = ?
+            ORDER BY s.survey_name
+        ''', (user_id,)).fetchall())
     finally:
-        if conn:
-            conn.close()
+        conn.close()
 
-def save_response_detail(response_id, field_id, answer_value):
-    """حفظ تفاصيل الإجابة"""
-    conn = None
+    return Principal(
+        user_id=user_id,
+        username=username,
+        role=role,
+        region_id=region_id,
+        region_name=region_name,
+        governorate_id=gov_id,
+        governorate_name=gov_name,
+        governorate_description=gov_desc,
+        last_login=last_login,
+        allowed_surveys=allowed_surveys,
+        allowed_survey_ids=frozenset(s[0] for s in allowed_surveys),
+        version=version
+    )
+
+_NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?", re.ASCII)
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}", re.ASCII)
+_BOOL_VALUES = {'true': 1, '1': 1, 'false': 0, '0': 0}
+
+def typed_answer_values(value: str, field_type: str) -> Tuple[Optional[float], Optional[str], Optional[int]]:
+    """
+    قيم الأعمدة المكتوبة (answer_number, answer_date, answer_bool) لإجابة نصية
+    بنفس قواعد triggers الترحيل: الصيغة الكاملة فقط، وغير الصالح يبقى None
+    """
+    text = value.strip(" ")
+    if field_type == 'number':
+        return (float(text) if _NUMBER_PATTERN.fullmatch(text) else None), None, None
+    if field_type == 'date' and _DATE_PATTERN.fullmatch(text):
+        try:
+            return None, date.fromisoformat(text).isoformat(), None
+        except ValueError:
+            return None, None, None
+    if field_type == 'checkbox':
+        return None, None, _BOOL_VALUES.get(text.lower())
+    return None, None, None
+
+def submit_survey_response(survey_id: int, user_id: int, region_id: int,
+                           answers: Dict[int, object], is_completed: bool = False) -> Optional[int]:
+    """
+    حفظ الاستجابة وجميع تفاصيلها في معاملة واحدة
+    يعيد رقم الاستجابة الجديدة أو None في حالة الخطأ (بدون حفظ أي جزء منها)
+    """
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        c = conn.cursor()
-        
-        c.execute(
-            "INSERT INTO Response_Details (response_id, field_id, answer_value) VALUES (?, ?, ?)",
-            (response_id, field_id, str(answer_value) if answer_value is not None else "")
-        )
-        conn.commit()
-        return True
+        # الأعمدة المكتوبة تحسب هنا مع الإدخال بدلاً من تحديث كل صف عبر trigger
+        fields = get_compiled_survey(survey_id).fields_by_id
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                '''INSERT INTO Responses
+                   (survey_id, user_id, region_id, is_completed)
+                   VALUES (?, ?, ?, ?)''',
+                (survey_id, user_id, region_id, is_completed)
+            )
+            response_id = c.lastrowid
+            rows = []
+            for field_id, answer in answers.items():
+                if answer is None:
+                    continue
+                field = fields.get(field_id)
+                value = str(answer)
+                rows.append((response_id, field_id, value) +
+                            typed_answer_values(value, field.field_type if field else ''))
+            c.executemany(
+                """INSERT INTO Response_Details
+                   (response_id, field_id, answer_value, answer_number, answer_date, answer_bool)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+        return response_id
     except sqlite3.Error as e:
-        st.error(f"حدث خطأ في حفظ تفاصيل الإجابة: {str(e)}")
-        return False
-    finally:
-        if conn:
-            conn.close()
-            
+        if isinstance(e, sqlite3.IntegrityError) and "DailyCompletions" in str(e):
+            # قيد السجل اليومي يمنع إكمال نفس الاستبيان مرتين في نفس اليوم
+            st.error("لقد قمت بإكمال هذا الاستبيان اليوم بالفعل. يمكنك إكماله مرة أخرى غدًا.")
+        else:
+            st.error(f"حدث خطأ في حفظ الاستجابة: {str(e)}")
+        return None
+
 def save_survey(survey_name, fields, governorate_ids=None):
     """حفظ استبيان جديد مع حقوله في قاعدة البيانات"""
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         # 1. حفظ الاستبيان الأساسي
@@ -264,6 +835,8 @@ def save_survey(survey_name, fields, governorate_ids=None):
             )
         
         conn.commit()
+        bump_reference_data_version()
+        bump_survey_definition_version(survey_id)
         return True
         
     except sqlite3.Error as e:
@@ -273,23 +846,19 @@ def save_survey(survey_name, fields, governorate_ids=None):
         if conn:
             conn.close()
 def update_last_login(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE Users SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()            
+    with get_connection() as conn:
+        conn.execute("UPDATE Users SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
+    # تسجيل الدخول لا يغير أعمدة مسجلة، فيسجل كحدث من التطبيق
+    log_audit_action(user_id, 'LOGIN', 'Users', user_id)
 def update_user_activity(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE Users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute("UPDATE Users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
 
 def delete_survey(survey_id):
     """حذف استبيان وجميع بياناته المرتبطة"""
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         # حذف تفاصيل الإجابات المرتبطة
@@ -310,6 +879,8 @@ def delete_survey(survey_id):
         c.execute("DELETE FROM Surveys WHERE survey_id = ?", (survey_id,))
         
         conn.commit()
+        bump_reference_data_version()
+        bump_survey_definition_version(survey_id)
         st.success("تم حذف الاستبيان بنجاح")
         return True
     except sqlite3.Error as e:
@@ -323,7 +894,7 @@ def add_health_admin(admin_name, description, governorate_id):
     """إضافة إدارة صحية جديدة إلى قاعدة البيانات مع التحقق من التكرار"""
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         # التحقق من وجود الإدارة مسبقاً في نفس المحافظة
@@ -339,6 +910,7 @@ def add_health_admin(admin_name, description, governorate_id):
             (admin_name, description, governorate_id)
         )
         conn.commit()
+        bump_reference_data_version()
         st.success(f"تمت إضافة الإدارة الصحية '{admin_name}' بنجاح")
         return True
         
@@ -350,17 +922,17 @@ def add_health_admin(admin_name, description, governorate_id):
             conn.close()     
 def get_governorates_list():
     """استرجاع قائمة المحافظات للاستخدام في القوائم المنسدلة"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    c = conn.cursor()
-    c.execute("SELECT governorate_id, governorate_name FROM Governorates")
-    governorates = c.fetchall()
-    conn.close()
-    return governorates      
+    return [(g[0], g[1]) for g in get_reference_data().governorates]
+
+def get_surveys_list() -> List[Tuple[int, str]]:
+    """استرجاع قائمة الاستبيانات للاستخدام في القوائم المنسدلة"""
+    return [(s[0], s[1]) for s in get_reference_data().surveys]
+
 def update_survey(survey_id, survey_name, is_active, fields):
     """تحديث بيانات الاستبيان وحقوله"""
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         # 1. تحديث بيانات الاستبيان الأساسية
@@ -401,6 +973,8 @@ def update_survey(survey_id, survey_name, is_active, fields):
                 )
         
         conn.commit()
+        bump_reference_data_version()
+        bump_survey_definition_version(survey_id)
         st.success("تم تحديث الاستبيان بنجاح")
         return True
         
@@ -414,13 +988,9 @@ def update_user(user_id, username, role, region_id=None):
     """تحديث بيانات المستخدم"""
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
-        # الحصول على القيم القديمة أولاً
-        c.execute("SELECT username, role, assigned_region FROM Users WHERE user_id=?", (user_id,))
-        old_data = c.fetchone()
-        
         c.execute("SELECT 1 FROM Users WHERE username=? AND user_id!=?", (username, user_id))
         if c.fetchone():
             st.error("اسم المستخدم موجود بالفعل!")
@@ -435,22 +1005,7 @@ def update_user(user_id, username, role, region_id=None):
             c.execute("DELETE FROM GovernorateAdmins WHERE user_id=?", (user_id,))
             
         conn.commit()
-        
-        # تسجيل التعديل في سجل التعديلات
-        new_data = (username, role, region_id)
-        changes = {
-            'username': {'old': old_data[0], 'new': new_data[0]},
-            'role': {'old': old_data[1], 'new': new_data[1]},
-            'assigned_region': {'old': old_data[2], 'new': new_data[2]}
-        }
-        log_audit_action(
-            st.session_state.user_id, 
-            'UPDATE', 
-            'Users', 
-            user_id,
-            old_data,
-            new_data
-        )
+        bump_user_version(user_id)
         
         st.success("تم تحديث بيانات المستخدم بنجاح")
         return True
@@ -467,7 +1022,7 @@ def add_user(username, password, role, region_id=None):
     
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_connection()
         c = conn.cursor()
         
         c.execute("SELECT 1 FROM Users WHERE username=?", (username,))
@@ -491,7 +1046,7 @@ def add_user(username, password, role, region_id=None):
             
 
 def get_governorate_admin(user_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         c = conn.cursor()
         c.execute('''
@@ -509,13 +1064,14 @@ def add_governorate_admin(user_id: int, governorate_id: int) -> bool:
     """
     إضافة مسؤول محافظة جديد
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         conn.execute(
             "INSERT INTO GovernorateAdmins (user_id, governorate_id) VALUES (?, ?)",
             (user_id, governorate_id)
         )
         conn.commit()
+        bump_user_version(user_id)
         return True
     except sqlite3.Error as e:
         st.error(f"خطأ في إضافة مسؤول المحافظة: {str(e)}")
@@ -527,7 +1083,7 @@ def get_governorate_admin_data(user_id: int) -> tuple:
     """
     الحصول على بيانات مسؤول المحافظة
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -547,7 +1103,7 @@ def get_governorate_surveys(governorate_id: int) -> list:
     """
     الحصول على الاستبيانات الخاصة بمحافظة معينة
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -565,7 +1121,7 @@ def get_governorate_employees(governorate_id: int) -> list:
     """
     الحصول على الموظفين التابعين لمحافظة معينة
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -581,7 +1137,7 @@ def get_governorate_employees(governorate_id: int) -> list:
         
 def get_allowed_surveys(user_id: int) -> List[Tuple[int, str]]:
     """الحصول على الاستبيانات المسموح بها للموظف"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         
@@ -615,7 +1171,7 @@ def get_allowed_surveys(user_id: int) -> List[Tuple[int, str]]:
         
 def get_survey_fields(survey_id: int) -> List[Tuple]:
     """الحصول على حقول استبيان معين"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -637,9 +1193,101 @@ def get_survey_fields(survey_id: int) -> List[Tuple]:
     finally:
         conn.close()
         
+class CompiledField(NamedTuple):
+    """حقل استبيان جاهز للعرض (الخيارات مفكوكة مسبقاً من JSON)"""
+    field_id: int
+    label: str
+    field_type: str
+    options: Tuple[str, ...]
+    is_required: bool
+    field_order: int
+    display_label: str
+
+
+def _build_field_validator(field: CompiledField) -> Callable[[object], Optional[str]]:
+    """إنشاء دالة تحقق للحقل حسب نوعه، تعيد رسالة الخطأ أو None"""
+    if field.field_type == 'dropdown':
+        options = frozenset(field.options)
+        return lambda value: None if value is None or value in options else f"{field.label}: قيمة غير مسموح بها"
+    if field.field_type == 'number':
+        return lambda value: None if value is None or isinstance(value, (int, float)) else f"{field.label}: يجب إدخال رقم"
+    return lambda value: None
+
+
+class CompiledSurvey:
+    """تعريف استبيان مترجم مرة واحدة لكل إصدار: الحقول والحقول المطلوبة ودوال التحقق"""
+
+    def __init__(self, survey_id: int, version: int, rows: List[Tuple]):
+        self.survey_id = survey_id
+        self.version = version
+        fields = []
+        for field_id, label, field_type, options, is_required, field_order in rows:
+            fields.append(CompiledField(
+                field_id=field_id,
+                label=label,
+                field_type=field_type,
+                options=tuple(json.loads(options)) if options else (),
+                is_required=bool(is_required),
+                field_order=field_order,
+                display_label=label + (" *" if is_required else "")
+            ))
+        self.fields: Tuple[CompiledField, ...] = tuple(fields)
+        self.fields_by_id: Dict[int, CompiledField] = {f.field_id: f for f in fields}
+        self.required_field_ids: FrozenSet[int] = frozenset(f.field_id for f in fields if f.is_required)
+        self.validators = {f.field_id: _build_field_validator(f) for f in fields}
+
+    def missing_required(self, answers: Dict[int, object]) -> List[str]:
+        """أسماء الحقول المطلوبة التي لم يتم إدخالها"""
+        return [f.label for f in self.fields if f.field_id in self.required_field_ids and not answers.get(f.field_id)]
+
+    def validate(self, answers: Dict[int, object]) -> List[str]:
+        """رسائل أخطاء القيم غير الصالحة"""
+        errors = []
+        for field_id, value in answers.items():
+            validator = self.validators.get(field_id)
+            error = validator(value) if validator else None
+            if error:
+                errors.append(error)
+        return errors
+
+
+_survey_definition_versions: Dict[int, int] = {}
+_compiled_surveys: Dict[int, CompiledSurvey] = {}
+_survey_definitions_lock = threading.Lock()
+
+def bump_survey_definition_version(survey_id: int):
+    """إبطال التعريف المترجم لاستبيان بعد تعديل حقوله"""
+    with _survey_definitions_lock:
+        _survey_definition_versions[survey_id] = _survey_definition_versions.get(survey_id, 0) + 1
+        _compiled_surveys.pop(survey_id, None)
+
+def get_compiled_survey(survey_id: int) -> CompiledSurvey:
+    """الحصول على التعريف المترجم للاستبيان (يحمل من قاعدة البيانات مرة واحدة لكل إصدار)"""
+    version = _survey_definition_versions.get(survey_id, 0)
+    compiled = _compiled_surveys.get(survey_id)
+    if compiled is not None and compiled.version == version:
+        return compiled
+
+    conn = get_connection()
+    try:
+        rows = conn.execute('''
+            SELECT field_id, field_label, field_type, field_options, is_required, field_order
+            FROM Survey_Fields
+            WHERE survey_id = ?
+            ORDER BY field_order
+        ''', (survey_id,)).fetchall()
+    finally:
+        conn.close()
+
+    compiled = CompiledSurvey(survey_id, version, rows)
+    with _survey_definitions_lock:
+        if _survey_definition_versions.get(survey_id, 0) == version:
+            _compiled_surveys[survey_id] = compiled
+    return compiled
+
 def get_user_allowed_surveys(user_id: int) -> List[Tuple[int, str]]:
     """الحصول على الاستبيانات المسموح بها للمستخدم"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -657,54 +1305,108 @@ def get_user_allowed_surveys(user_id: int) -> List[Tuple[int, str]]:
         conn.close()
 
 def update_user_allowed_surveys(user_id: int, survey_ids: List[int]) -> bool:
-    """تحديث الاستبيانات المسموح بها للمستخدم"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """
+    تحديث الاستبيانات المسموح بها للمستخدم
+    الاستبيانات غير المتاحة لمحافظة المستخدم تستبعد داخل نفس استعلام الإدخال
+    """
     try:
-        cursor = conn.cursor()
-        
-        # الحصول على محافظة المستخدم
-        cursor.execute('''
-            SELECT ha.governorate_id 
-            FROM Users u
-            JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
-            WHERE u.user_id = ?
-        ''', (user_id,))
-        governorate_id = cursor.fetchone()
-        
-        if not governorate_id:
-            st.error("المستخدم غير مرتبط بمحافظة")
-            return False
-        
-        # التحقق من أن الاستبيانات مسموحة للمحافظة
-        valid_surveys = []
-        for survey_id in survey_ids:
-            cursor.execute('''
-                SELECT 1 FROM SurveyGovernorate 
-                WHERE survey_id = ? AND governorate_id = ?
-            ''', (survey_id, governorate_id[0]))
-            if cursor.fetchone():
-                valid_surveys.append(survey_id)
-        
-        # حذف جميع التصاريح الحالية
-        cursor.execute("DELETE FROM UserSurveys WHERE user_id=?", (user_id,))
-        
-        # إضافة التصاريح الجديدة
-        for survey_id in valid_surveys:
-            cursor.execute(
-                "INSERT INTO UserSurveys (user_id, survey_id) VALUES (?, ?)",
-                (user_id, survey_id))
-        
-        conn.commit()
+        with get_connection() as conn:
+            # الحصول على محافظة المستخدم
+            governorate_id = conn.execute('''
+                SELECT ha.governorate_id
+                FROM Users u
+                JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+                WHERE u.user_id = ?
+            ''', (user_id,)).fetchone()
+
+            if not governorate_id:
+                st.error("المستخدم غير مرتبط بمحافظة")
+                return False
+
+            ids = json.dumps([int(survey_id) for survey_id in survey_ids])
+            # حذف التصاريح التي لم تعد مختارة أو لم تعد متاحة للمحافظة
+            conn.execute('''
+                DELETE FROM UserSurveys
+                WHERE user_id = ?
+                  AND survey_id NOT IN (
+                      SELECT sg.survey_id FROM SurveyGovernorate sg
+                      WHERE sg.governorate_id = ?
+                        AND sg.survey_id IN (SELECT value FROM json_each(?)))
+            ''', (user_id, governorate_id[0], ids))
+            # إضافة التصاريح الجديدة الصالحة للمحافظة فقط
+            conn.execute('''
+                INSERT OR IGNORE INTO UserSurveys (user_id, survey_id)
+                SELECT ?, sg.survey_id
+                FROM SurveyGovernorate sg
+                WHERE sg.governorate_id = ?
+                  AND sg.survey_id IN (SELECT value FROM json_each(?))
+            ''', (user_id, governorate_id[0], ids))
+
+        bump_user_version(user_id)
         return True
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في تحديث الاستبيانات المسموح بها: {str(e)}")
         return False
-    finally:
-        conn.close()
-        
+
+
+def assign_survey_to_employees(survey_id: int, governorate_id: Optional[int] = None,
+                               admin_id: Optional[int] = None, revoke: bool = False) -> Optional[int]:
+    """
+    منح (أو سحب) استبيان لجميع موظفي محافظة أو إدارة صحية باستعلام واحد
+    المنح يقتصر على الموظفين الذين يتاح الاستبيان لمحافظتهم في SurveyGovernorate
+    يعيد عدد التصاريح التي أضيفت أو حذفت، أو None في حالة الخطأ
+    """
+    if governorate_id is None and admin_id is None:
+        st.error("يجب تحديد المحافظة أو الإدارة الصحية")
+        return None
+
+    conditions, params = ["u.role = 'employee'"], []
+    if governorate_id is not None:
+        conditions.append("ha.governorate_id = ?")
+        params.append(governorate_id)
+    if admin_id is not None:
+        conditions.append("ha.admin_id = ?")
+        params.append(admin_id)
+    where = " AND ".join(conditions)
+
+    try:
+        with get_connection() as conn:
+            user_ids = [row[0] for row in conn.execute(f'''
+                SELECT u.user_id
+                FROM Users u
+                JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+                WHERE {where}
+            ''', params)]
+            if revoke:
+                changed = conn.execute(f'''
+                    DELETE FROM UserSurveys
+                    WHERE survey_id = ?
+                      AND user_id IN (SELECT u.user_id
+                                      FROM Users u
+                                      JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+                                      WHERE {where})
+                ''', [survey_id] + params).rowcount
+            else:
+                changed = conn.execute(f'''
+                    INSERT OR IGNORE INTO UserSurveys (user_id, survey_id)
+                    SELECT u.user_id, sg.survey_id
+                    FROM Users u
+                    JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+                    JOIN SurveyGovernorate sg
+                         ON sg.governorate_id = ha.governorate_id AND sg.survey_id = ?
+                    WHERE {where}
+                ''', [survey_id] + params).rowcount
+    except sqlite3.Error as e:
+        st.error(f"حدث خطأ في تعيين الاستبيان للموظفين: {str(e)}")
+        return None
+
+    for user_id in user_ids:
+        bump_user_version(user_id)
+    return changed
+
 def get_response_details(response_id: int) -> List[Tuple]:
     """الحصول على تفاصيل إجابة محددة"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -724,13 +1426,18 @@ def get_response_details(response_id: int) -> List[Tuple]:
 
 def update_response_detail(detail_id: int, new_value: str) -> bool:
     """تحديث قيمة إجابة محددة"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE Response_Details SET answer_value = ? WHERE detail_id = ?",
             (new_value, detail_id)
         )
+        cursor.execute(
+            """UPDATE Responses SET version = version + 1
+               WHERE response_id = (SELECT response_id FROM Response_Details WHERE detail_id = ?)""",
+            (detail_id,)
+        )
         conn.commit()
         return True
     except sqlite3.Error as e:
@@ -739,14 +1446,60 @@ def update_response_detail(detail_id: int, new_value: str) -> bool:
     finally:
         conn.close()
 
+def save_response_edits(response_id: int, expected_version: int,
+                        updates: Dict[int, str], user_id: int) -> Optional[int]:
+    """
+    حفظ جميع تعديلات إجابة واحدة في معاملة واحدة مع سجل تعديل واحد يغطي الدفعة
+    (بدلاً من سجل لكل حقل من triggers التسجيل التلقائي)
+    updates: {detail_id: القيمة الجديدة}
+    expected_version: إصدار الإجابة عند فتح نموذج التعديل؛ إذا عدلها مستخدم آخر
+    بعد ذلك يرفض الحفظ بالكامل بدلاً من الكتابة فوق تعديلاته
+    يعيد الإصدار الجديد أو None في حالة التعارض أو الخطأ
+    """
+    try:
+        with audit_suppressed(), get_connection() as conn:
+            # حجز الإصدار التالي (يأخذ قفل الكتابة فلا يتداخل حفظان)
+            if conn.execute(
+                "UPDATE Responses SET version = version + 1 WHERE response_id = ? AND version = ?",
+                (response_id, expected_version)
+            ).rowcount == 0:
+                st.error("تم تعديل هذه الإجابة من مستخدم آخر بعد فتحها. تم تحميل القيم الحالية، يرجى إعادة التعديل.")
+                return None
+
+            ids = json.dumps([int(detail_id) for detail_id in updates])
+            old = conn.execute('''
+                SELECT detail_id, field_id, answer_value
+                FROM Response_Details
+                WHERE response_id = ? AND detail_id IN (SELECT value FROM json_each(?))
+            ''', (response_id, ids)).fetchall()
+            if len(old) != len(updates):
+                raise sqlite3.IntegrityError("بعض الحقول المعدلة لا تنتمي لهذه الإجابة")
+
+            conn.executemany(
+                "UPDATE Response_Details SET answer_value = ? WHERE detail_id = ?",
+                [(updates[detail_id], detail_id) for detail_id, _, _ in old]
+            )
+            conn.execute(
+                """INSERT INTO AuditLog
+                   (user_id, action_type, table_name, record_id, old_value, new_value)
+                   VALUES (?, 'UPDATE', 'Response_Details', ?, ?, ?)""",
+                (user_id, response_id,
+                 json.dumps({field_id: value for _, field_id, value in old}),
+                 json.dumps({field_id: updates[detail_id] for detail_id, field_id, _ in old}))
+            )
+        return expected_version + 1
+    except sqlite3.Error as e:
+        st.error(f"حدث خطأ في حفظ تعديلات الإجابة: {str(e)}")
+        return None
+
 def get_response_info(response_id: int) -> Optional[Tuple]:
     """الحصول على معلومات أساسية عن الإجابة"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT r.response_id, s.survey_name, u.username, 
-                   ha.admin_name, g.governorate_name, r.submission_date
+                   ha.admin_name, g.governorate_name, r.submission_date, r.version
             FROM Responses r
             JOIN Surveys s ON r.survey_id = s.survey_id
             JOIN Users u ON r.user_id = u.user_id
@@ -764,24 +1517,19 @@ def get_response_info(response_id: int) -> Optional[Tuple]:
 def log_audit_action(user_id: int, action_type: str, table_name: str, 
                     record_id: int = None, old_value: str = None, 
                     new_value: str = None) -> bool:
-    """تسجيل إجراء في سجل التعديلات"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """
+    تسجيل إجراء من التطبيق في سجل التعديلات (فوراً أو على دفعات في الخلفية حسب AUDIT_MODE)
+    تعديلات الجداول المسجلة تسجلها triggers تلقائياً؛ هذه للأحداث الأخرى مثل تسجيل الدخول
+    """
+    from audit import get_audit_writer, make_audit_event
     try:
-        conn.execute(
-            """INSERT INTO AuditLog 
-               (user_id, action_type, table_name, record_id, old_value, new_value)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (user_id, action_type, table_name, record_id, 
-             json.dumps(old_value) if old_value else None,
-             json.dumps(new_value) if new_value else None)
+        get_audit_writer().log(
+            make_audit_event(user_id, action_type, table_name, record_id, old_value, new_value)
         )
-        conn.commit()
         return True
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في تسجيل الإجراء: {str(e)}")
         return False
-    finally:
-        conn.close()
 
 def get_audit_logs(
     table_name: str = None, 
@@ -790,178 +1538,39 @@ def get_audit_logs(
     date_range: tuple = None,
     search_query: str = None
 ) -> List[Tuple]:
-    """الحصول على سجل التعديلات مع فلاتر متقدمة"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """
+    الحصول على سجل التعديلات مع فلاتر متقدمة (جميع الصفوف المطابقة)
+    للسجلات الكبيرة استخدم audit.fetch_audit_log_page أو audit.iter_audit_logs
+    """
+    from audit import AuditLogFilter, iter_audit_logs
+    date_from = date_to = None
+    if date_range and len(date_range) == 2:
+        date_from, date_to = (date.fromisoformat(str(d)[:10]) for d in date_range)
     try:
-        cursor = conn.cursor()
-        query = '''
-            SELECT a.log_id, u.username, a.action_type, a.table_name, 
-                   a.record_id, a.old_value, a.new_value, a.action_timestamp
-            FROM AuditLog a
-            JOIN Users u ON a.user_id = u.user_id
-        '''
-        params = []
-        conditions = []
-        
-        # تطبيق الفلاتر
-        if table_name:
-            conditions.append("a.table_name = ?")
-            params.append(table_name)
-        if action_type:
-            conditions.append("a.action_type = ?")
-            params.append(action_type)
-        if username:
-            conditions.append("u.username LIKE ?")
-            params.append(f"%{username}%")
-        if date_range and len(date_range) == 2:
-            start_date, end_date = date_range
-            conditions.append("DATE(a.action_timestamp) BETWEEN ? AND ?")
-            params.extend([start_date, end_date])
-        if search_query:
-            conditions.append("""
-                (a.old_value LIKE ? OR 
-                 a.new_value LIKE ? OR 
-                 u.username LIKE ? OR 
-                 a.table_name LIKE ? OR
-                 a.action_type LIKE ?)
-            """)
-            search_term = f"%{search_query}%"
-            params.extend([search_term, search_term, search_term, search_term, search_term])
-        
-        if conditions:
-            query += ' WHERE ' + ' AND '.join(conditions)
-            
-        query += ' ORDER BY a.action_timestamp DESC'
-        
-        cursor.execute(query, params)
-        return cursor.fetchall()
+        return list(iter_audit_logs(AuditLogFilter(
+            table_name=table_name,
+            action_type=action_type,
+            username=username,
+            date_from=date_from,
+            date_to=date_to,
+            search=search_query
+        )))
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في جلب سجل التعديلات: {str(e)}")
         return []
-    finally:
-        conn.close()
         
 def has_completed_survey_today(user_id: int, survey_id: int) -> bool:
     """التحقق مما إذا كان المستخدم قد أكمل الاستبيان اليوم"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT 1 FROM Responses 
-            WHERE user_id = ? AND survey_id = ? AND is_completed = TRUE
-            AND DATE(submission_date) = DATE('now')
-            LIMIT 1
+            SELECT 1 FROM DailyCompletions
+            WHERE user_id = ? AND survey_id = ? AND completion_day = DATE('now')
         ''', (user_id, survey_id))
-
-
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import pandas as pd
-
-def connect_to_google_sheets():
-    """الاتصال بـ Google Sheets باستخدام مصادقة مبسطة"""
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", 
-                "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name("gsheets_credentials.json", scope)
-        client = gspread.authorize(creds)
-        return client
-    except Exception as e:
-        st.error(f"خطأ في الاتصال بجوجل شيتس: {str(e)}")
-        return None
-
-def export_to_google_sheet(survey_id: int, sheet_name: str):
-    """تصدير بيانات استبيان إلى Google Sheet"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    try:
-        # الحصول على بيانات الاستبيان
-        survey_name = conn.execute(
-            "SELECT survey_name FROM Surveys WHERE survey_id=?", 
-            (survey_id,)
-        ).fetchone()[0]
-        
-        # الحصول على جميع الإجابات
-        responses = conn.execute('''
-            SELECT r.response_id, u.username, ha.admin_name, g.governorate_name,
-                   r.submission_date, r.is_completed
-            FROM Responses r
-            JOIN Users u ON r.user_id = u.user_id
-            JOIN HealthAdministrations ha ON r.region_id = ha.admin_id
-            JOIN Governorates g ON ha.governorate_id = g.governorate_id
-            WHERE r.survey_id = ?
-            ORDER BY r.submission_date DESC
-        ''', (survey_id,)).fetchall()
-        
-        if not responses:
-            st.warning("لا توجد بيانات للتصدير")
-            return False
-            
-        # تحضير البيانات للتصدير
-        data = []
-        for response in responses:
-            # الحصول على تفاصيل الإجابة
-            details = conn.execute('''
-                SELECT sf.field_label, rd.answer_value
-                FROM Response_Details rd
-                JOIN Survey_Fields sf ON rd.field_id = sf.field_id
-                WHERE rd.response_id = ?
-                ORDER BY sf.field_order
-            ''', (response[0],)).fetchall()
-            
-            # إنشاء سجل واحد لكل إجابة
-            record = {
-                "ID": response[0],
-                "المستخدم": response[1],
-                "الإدارة الصحية": response[2],
-                "المحافظة": response[3],
-                "تاريخ التقديم": response[4],
-                "الحالة": "مكتملة" if response[5] else "مسودة"
-            }
-            
-            # إضافة حقول الاستبيان
-            for field in details:
-                record[field[0]] = field[1]
-            
-            data.append(record)
-        
-        # تحويل إلى DataFrame
-        df = pd.DataFrame(data)
-        
-        # الاتصال بجوجل شيتس
-        client = connect_to_google_sheets()
-        if not client:
-            return False
-            
-        try:
-            # إنشاء أو فتح ملف الجداول
-            sheet = client.open(sheet_name)
-        except gspread.SpreadsheetNotFound:
-            # إذا لم يوجد الملف، يتم إنشاؤه
-            sheet = client.create(sheet_name)
-            
-        # إنشاء أو تحديث ورقة العمل
-        try:
-            worksheet = sheet.worksheet(survey_name)
-        except gspread.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title=survey_name, rows=100, cols=20)
-        
-        # تحديث البيانات
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
-        
-        return True
-        
-    except Exception as e:
-        st.error(f"حدث خطأ أثناء التصدير: {str(e)}")
-        return False
-    finally:
-        conn.close()
-
-
-        
         return cursor.fetchone() is not None
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في التحقق من إكمال الاستبيان: {str(e)}")
         return False
     finally:
-        conn.close()        
+        conn.close()
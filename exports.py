@@ -0,0 +1,627 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import time
+from datetime import date, datetime, timedelta
+from typing import BinaryIO, Callable, List, NamedTuple, Optional, Tuple
+
+import gspread
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+from gspread.utils import rowcol_to_a1
+from oauth2client.service_account import ServiceAccountCredentials
+from openpyxl import Workbook
+
+from database import get_connection, get_reference_data, answer_documents_enabled
+
+RESPONSE_COLUMNS = ["ID", "المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
+FIELD_COLUMNS = ["اسم الحقل", "نوع الحقل", "الخيارات", "مطلوب"]
+
+
+class ExportScope(NamedTuple):
+    """نطاق التصدير، يطبق داخل استعلام SQL فلا يقرأ أو يرسل إلا الشريحة المطلوبة"""
+    governorate_id: Optional[int] = None
+    admin_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    completed_only: bool = False
+
+    def conditions(self) -> Tuple[List[str], list]:
+        """شروط WHERE ومعاملاتها (الأسماء المستعارة: r للإجابات و h للإدارات الصحية)"""
+        conditions, params = [], []
+        if self.governorate_id is not None:
+            conditions.append("h.governorate_id = ?")
+            params.append(self.governorate_id)
+        if self.admin_id is not None:
+            conditions.append("r.region_id = ?")
+            params.append(self.admin_id)
+        # مقارنة مباشرة على العمود لتستفيد من فهرس (survey_id, submission_date)
+        if self.date_from is not None:
+            conditions.append("r.submission_date >= ?")
+            params.append(self.date_from.isoformat())
+        if self.date_to is not None:
+            conditions.append("r.submission_date < ?")
+            params.append((self.date_to + timedelta(days=1)).isoformat())
+        if self.completed_only:
+            conditions.append("r.is_completed")
+        return conditions, params
+
+    def key(self) -> str:
+        """مفتاح ثابت للنطاق (فارغ للتصدير الكامل) يستخدم في حالة المزامنة"""
+        if self == ExportScope():
+            return ""
+        values = self._asdict()
+        for name in ("date_from", "date_to"):
+            if values[name] is not None:
+                values[name] = values[name].isoformat()
+        return json.dumps(values, sort_keys=True)
+
+    def label(self) -> str:
+        """وصف مختصر للنطاق (فارغ للتصدير الكامل)"""
+        ref = get_reference_data()
+        parts = []
+        if self.governorate_id is not None:
+            parts.append(ref.governorate_names.get(self.governorate_id, str(self.governorate_id)))
+        if self.admin_id is not None:
+            parts.append(ref.health_admin_names.get(self.admin_id, str(self.admin_id)))
+        if self.date_from is not None or self.date_to is not None:
+            parts.append(f"{self.date_from or ''}~{self.date_to or ''}")
+        if self.completed_only:
+            parts.append("مكتملة")
+        return " - ".join(parts)
+
+
+class SurveyExport(NamedTuple):
+    """بيانات استبيان جاهزة للتصدير: صف لكل إجابة وعمود لكل حقل"""
+    survey_id: int
+    survey_name: str
+    fields: List[Tuple]          # (field_id, field_label, field_type, field_options, is_required)
+    columns: List[str]           # أسماء أعمدة الحقول بترتيب field_order
+    responses: pd.DataFrame      # بيانات الإجابات بأعمدة RESPONSE_COLUMNS
+    answers: np.ndarray          # مصفوفة القيم (عدد الإجابات × عدد الحقول)
+
+    def wide_rows(self):
+        """صفوف الإجابات بالشكل العريض (بيانات الإجابة ثم قيم الحقول)"""
+        for meta, values in zip(self.responses.itertuples(index=False, name=None), self.answers):
+            yield list(meta) + list(values)
+
+    def to_frame(self) -> pd.DataFrame:
+        """الشكل العريض كـ DataFrame"""
+        answers = pd.DataFrame(self.answers, columns=self.columns, dtype=object)
+        return pd.concat([self.responses.reset_index(drop=True), answers], axis=1)
+
+
+def _field_columns(fields: List[Tuple]) -> List[str]:
+    """أسماء أعمدة الحقول مع تمييز العناوين المكررة برقم الحقل"""
+    columns, seen = [], set()
+    for field_id, label, *_ in fields:
+        column = label if label not in seen else f"{label} ({field_id})"
+        seen.add(label)
+        columns.append(column)
+    return columns
+
+
+def _answers_from_details(rows: List[Tuple], fields: List[Tuple]) -> Tuple[pd.DataFrame, np.ndarray]:
+    """تحويل صفوف (بيانات الإجابة، field_id، answer_value) إلى جدول الإجابات ومصفوفة القيم"""
+    frame = pd.DataFrame(
+        rows,
+        columns=RESPONSE_COLUMNS + ["field_id", "answer_value"],
+        dtype=object
+    )
+    responses = frame.drop_duplicates("ID")[RESPONSE_COLUMNS].reset_index(drop=True)
+
+    # وضع كل قيمة في موقعها (صف الإجابة، عمود الحقل) دفعة واحدة
+    details = frame[frame["field_id"].notna()]
+    row_pos = pd.Index(responses["ID"]).get_indexer(details["ID"])
+    col_pos = pd.Index([f[0] for f in fields]).get_indexer(details["field_id"])
+    known = col_pos >= 0  # تجاهل إجابات الحقول المحذوفة
+
+    answers = np.full((len(responses), len(fields)), None, dtype=object)
+    answers[row_pos[known], col_pos[known]] = details["answer_value"].to_numpy(dtype=object)[known]
+    return responses, answers
+
+
+def _answers_from_documents(rows: List[Tuple], fields: List[Tuple]) -> Tuple[pd.DataFrame, np.ndarray]:
+    """تحويل صفوف (بيانات الإجابة، مستند JSON) إلى جدول الإجابات ومصفوفة القيم"""
+    responses = pd.DataFrame([row[:-1] for row in rows], columns=RESPONSE_COLUMNS, dtype=object)
+    col_index = {str(f[0]): i for i, f in enumerate(fields)}
+
+    answers = np.full((len(rows), len(fields)), None, dtype=object)
+    for row_pos, row in enumerate(rows):
+        if row[-1]:
+            for field_id, value in json.loads(row[-1]).items():
+                col = col_index.get(field_id)
+                if col is not None:  # تجاهل إجابات الحقول المحذوفة
+                    answers[row_pos, col] = value
+    return responses, answers
+
+
+def load_survey_export(survey_id: int,
+                       scope: ExportScope = ExportScope(),
+                       after_response_id: Optional[int] = None,
+                       response_ids: Optional[List[int]] = None,
+                       order_by_id: bool = False) -> Optional[SurveyExport]:
+    """
+    تحميل جميع إجابات الاستبيان باستعلام واحد مرتب ثم تحويلها إلى الشكل العريض
+    (صف لكل إجابة وعمود لكل حقل) دون استعلام منفصل لكل إجابة
+    - scope: نطاق الإجابات (محافظة، إدارة صحية، فترة، المكتملة فقط)
+    - after_response_id: الإجابات الأحدث من هذا الرقم فقط
+    - response_ids: إجابات محددة فقط
+    - order_by_id: ترتيب تصاعدي حسب response_id بدلاً من الأحدث أولاً
+    """
+    conditions, params = scope.conditions()
+    conditions.insert(0, "r.survey_id = ?")
+    params.insert(0, survey_id)
+    if after_response_id is not None:
+        conditions.append("r.response_id > ?")
+        params.append(after_response_id)
+    if response_ids is not None:
+        conditions.append("r.response_id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(response_ids)))
+    order = "r.response_id" if order_by_id else "r.submission_date DESC, r.response_id DESC"
+
+    conn = get_connection()
+    try:
+        survey = conn.execute(
+            "SELECT survey_name FROM Surveys WHERE survey_id = ?",
+            (survey_id,)
+        ).fetchone()
+        if not survey:
+            return None
+
+        fields = conn.execute('''
+            SELECT field_id, field_label, field_type, field_options, is_required
+            FROM Survey_Fields
+            WHERE survey_id = ?
+            ORDER BY field_order
+        ''', (survey_id,)).fetchall()
+
+        # وضع المستندات: صف واحد لكل إجابة بدلاً من صف لكل حقل
+        use_documents = answer_documents_enabled(conn)
+        answers_sql = ("doc.answers" if use_documents else "rd.field_id, rd.answer_value")
+        answers_join = ("LEFT JOIN ResponseDocuments doc ON doc.response_id = r.response_id"
+                        if use_documents else
+                        "LEFT JOIN Response_Details rd ON rd.response_id = r.response_id")
+        rows = conn.execute(f'''
+            SELECT r.response_id, u.username, h.admin_name, g.governorate_name,
+                   r.submission_date, r.is_completed, {answers_sql}
+            FROM Responses r
+            JOIN Users u ON r.user_id = u.user_id
+            JOIN HealthAdministrations h ON r.region_id = h.admin_id
+            JOIN Governorates g ON h.governorate_id = g.governorate_id
+            {answers_join}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {order}
+        ''', params).fetchall()
+    finally:
+        conn.close()
+
+    if use_documents:
+        responses, answers = _answers_from_documents(rows, fields)
+    else:
+        responses, answers = _answers_from_details(rows, fields)
+    responses["الحالة"] = np.where(responses["الحالة"].astype(bool), "مكتملة", "مسودة")
+
+    return SurveyExport(
+        survey_id=survey_id,
+        survey_name=survey[0],
+        fields=fields,
+        columns=_field_columns(fields),
+        responses=responses,
+        answers=answers
+    )
+
+
+def write_survey_workbook(export: SurveyExport, output: BinaryIO):
+    """كتابة ملف Excel بأربع أوراق بنمط الكتابة المتدفقة (write-only) في openpyxl"""
+    workbook = Workbook(write_only=True)
+
+    # 1. ورقة ملخص الإجابات
+    sheet = workbook.create_sheet('ملخص_الإجابات')
+    sheet.append(RESPONSE_COLUMNS)
+    for row in export.responses.itertuples(index=False, name=None):
+        sheet.append(row)
+
+    # 2. ورقة تفاصيل جميع الإجابات (صف لكل إجابة وعمود لكل حقل)
+    sheet = workbook.create_sheet('تفاصيل_الإجابات')
+    sheet.append(RESPONSE_COLUMNS + export.columns)
+    for row in export.wide_rows():
+        sheet.append(row)
+
+    # 3. ورقة حقول الاستبيان
+    sheet = workbook.create_sheet('حقول_الاستبيان')
+    sheet.append(FIELD_COLUMNS)
+    for _, label, field_type, options, is_required in export.fields:
+        sheet.append([
+            label,
+            field_type,
+            "، ".join(json.loads(options)) if options else None,
+            "نعم" if is_required else "لا"
+        ])
+
+    # 4. ورقة المستخدمين الذين أدخلوا بيانات
+    sheet = workbook.create_sheet('المستخدمين')
+    sheet.append(RESPONSE_COLUMNS[1:])
+    for row in export.responses[RESPONSE_COLUMNS[1:]].drop_duplicates().itertuples(index=False, name=None):
+        sheet.append(row)
+
+    workbook.save(output)
+
+
+def build_survey_workbook(export: SurveyExport) -> bytes:
+    """محتوى ملف Excel (st.download_button يحتفظ بالملف في الذاكرة على أي حال)"""
+    buffer = io.BytesIO()
+    write_survey_workbook(export, buffer)
+    return buffer.getvalue()
+
+
+def write_survey_csv(export: SurveyExport, output):
+    """كتابة ملف CSV بالشكل العريض (صف لكل إجابة وعمود لكل حقل) بترميز utf-8-sig صفاً بصف"""
+    text = io.TextIOWrapper(output, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(RESPONSE_COLUMNS + export.columns)
+    writer.writerows(export.wide_rows())
+    text.flush()
+    text.detach()
+
+
+def build_survey_csv(export: SurveyExport) -> bytes:
+    """محتوى ملف CSV مكتوب صفاً بصف مباشرة بترميزه النهائي (بدون نسخة نصية وسيطة)"""
+    buffer = io.BytesIO()
+    write_survey_csv(export, buffer)
+    return buffer.getvalue()
+
+
+# ==================== Google Sheets ====================
+
+# عدد الصفوف في كل طلب batch_update
+SHEETS_BATCH_ROWS = int(os.environ.get("SURVEY_SHEETS_BATCH_ROWS", "500"))
+SHEETS_MAX_RETRIES = int(os.environ.get("SURVEY_SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE = float(os.environ.get("SURVEY_SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = 32.0
+SHEETS_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class SheetSyncResult(NamedTuple):
+    """نتيجة مزامنة استبيان مع Google Sheets"""
+    appended: int
+    updated: int
+    rebuilt: bool
+    deleted: int = 0
+
+
+def connect_to_google_sheets():
+    """الاتصال بـ Google Sheets باستخدام مصادقة مبسطة"""
+    try:
+        scope = ["https://spreadsheets.google.com/feeds", 
+                "https://www.googleapis.com/auth/drive"]
+        creds = ServiceAccountCredentials.from_json_keyfile_name("gsheets_credentials.json", scope)
+        client = gspread.authorize(creds)
+        return client
+    except Exception as e:
+        st.error(f"خطأ في الاتصال بجوجل شيتس: {str(e)}")
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """أخطاء مؤقتة تستحق إعادة المحاولة (تجاوز الحصة، أخطاء الخادم، انقطاع الشبكة)"""
+    if isinstance(error, (ConnectionError, TimeoutError,
+                          requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status in SHEETS_RETRYABLE_STATUS
+
+
+def _with_retry(call: Callable, *args, sleep: Callable[[float], None] = time.sleep, **kwargs):
+    """تنفيذ طلب مع إعادة المحاولة بتأخير أسي عشوائي عند الأخطاء المؤقتة"""
+    for attempt in range(SHEETS_MAX_RETRIES + 1):
+        try:
+            return call(*args, **kwargs)
+        except Exception as e:
+            if attempt == SHEETS_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt)
+            sleep(delay + random.uniform(0, delay / 2))
+
+
+def _sheet_rows(export: SurveyExport) -> List[list]:
+    """صفوف الإجابات بقيم قابلة للإرسال (None تصبح خلية فارغة)"""
+    return [["" if value is None else value for value in row] for row in export.wide_rows()]
+
+
+def _write_blocks(worksheet, blocks: List[Tuple[int, List[list]]], width: int, call: Callable):
+    """
+    كتابة كتل صفوف (رقم الصف الأول، الصفوف) عبر batch_update
+    بحيث لا يتجاوز كل طلب SHEETS_BATCH_ROWS صفاً
+    """
+    batch, batch_rows = [], 0
+    for start, rows in blocks:
+        for offset in range(0, len(rows), SHEETS_BATCH_ROWS):
+            chunk = rows[offset:offset + SHEETS_BATCH_ROWS]
+            first = start + offset
+            batch.append({
+                "range": f"{rowcol_to_a1(first, 1)}:{rowcol_to_a1(first + len(chunk) - 1, width)}",
+                "values": chunk
+            })
+            batch_rows += len(chunk)
+            if batch_rows >= SHEETS_BATCH_ROWS:
+                call(worksheet.batch_update, batch)
+                batch, batch_rows = [], 0
+    if batch:
+        call(worksheet.batch_update, batch)
+
+
+def _delete_sheet_rows(worksheet, existing: List[str], response_ids: List[int],
+                       call: Callable) -> Tuple[List[str], int]:
+    """
+    حذف صفوف الإجابات المحذوفة من الورقة (من الأسفل للأعلى في مجموعات متتالية)
+    يعيد عمود ID بعد الحذف وعدد الصفوف المحذوفة
+    """
+    targets = {str(response_id) for response_id in response_ids}
+    rows = [index + 1 for index, value in enumerate(existing) if index > 0 and str(value) in targets]
+    if not rows:
+        return existing, 0
+    end = rows[-1]
+    start = end
+    for row in reversed(rows[:-1]):
+        if row == start - 1:
+            start = row
+            continue
+        call(worksheet.delete_rows, start, end)
+        start = end = row
+    call(worksheet.delete_rows, start, end)
+    removed = set(rows)
+    return [value for index, value in enumerate(existing) if index + 1 not in removed], len(rows)
+
+
+def sync_survey_to_google_sheet(survey_id: int, spreadsheet_name: str, client=None,
+                                scope: ExportScope = ExportScope(),
+                                full: bool = False,
+                                sleep: Callable[[float], None] = time.sleep) -> Optional[SheetSyncResult]:
+    """
+    مزامنة إجابات الاستبيان مع ورقة عمل باسم الاستبيان في ملف Google Sheets
+    - تزايدية: إضافة الإجابات الأحدث من آخر response_id تم تصديره، وإعادة كتابة
+      صفوف الإجابات التي عدلت منذ آخر مزامنة (حسب ResponseChanges) في مكانها،
+      وحذف صفوف الإجابات المحذوفة أو التي خرجت من النطاق
+    - كاملة: عند أول مزامنة أو تغير حقول الاستبيان أو full=True
+    scope: نطاق الإجابات؛ لكل نطاق ورقة عمل وحالة مزامنة مستقلة
+    client: عميل gspread (أو بديل محلي بنفس الواجهة)، الافتراضي connect_to_google_sheets()
+    """
+    def call(fn, *args, **kwargs):
+        return _with_retry(fn, *args, sleep=sleep, **kwargs)
+
+    conn = get_connection()
+    try:
+        # لقطة لآخر تغيير قبل قراءة البيانات؛ التغييرات اللاحقة تصدر في المزامنة التالية
+        # (من sqlite_sequence لأن السجل قد يكون فارغاً بعد حذف ما صدر منه)
+        change_mark = conn.execute(
+            "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'ResponseChanges'), 0)"
+        ).fetchone()[0]
+        state = conn.execute('''
+            SELECT header_hash, last_response_id, last_change_id
+            FROM GoogleSheetSync
+            WHERE survey_id = ? AND spreadsheet_name = ? AND scope_key = ?
+        ''', (survey_id, spreadsheet_name, scope.key())).fetchone()
+        edited_ids, deleted_ids = [], []
+        if state and not full:
+            edited_ids = [row[0] for row in conn.execute('''
+                SELECT DISTINCT c.response_id
+                FROM ResponseChanges c
+                JOIN Responses r ON r.response_id = c.response_id
+                WHERE c.change_id > ? AND c.change_id <= ?
+                  AND r.survey_id = ? AND r.response_id <= ?
+            ''', (state[2], change_mark, survey_id, state[1]))]
+            # أرقام الإجابات فريدة في جميع الاستبيانات، فما لا يوجد في الورقة يتجاهل
+            deleted_ids = [row[0] for row in conn.execute('''
+                SELECT DISTINCT c.response_id
+                FROM ResponseChanges c
+                WHERE c.change_id > ? AND c.change_id <= ? AND c.response_id <= ?
+                  AND NOT EXISTS (SELECT 1 FROM Responses r WHERE r.response_id = c.response_id)
+            ''', (state[2], change_mark, state[1]))]
+    finally:
+        conn.close()
+
+    definition = load_survey_export(survey_id, scope, response_ids=[])
+    if definition is None:
+        return None
+    header = RESPONSE_COLUMNS + definition.columns
+    header_hash = hashlib.sha1(json.dumps(header, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    client = client or connect_to_google_sheets()
+    if client is None:
+        return None
+
+    try:
+        spreadsheet = call(client.open, spreadsheet_name)
+    except gspread.SpreadsheetNotFound:
+        spreadsheet = call(client.create, spreadsheet_name)
+
+    title = " - ".join(filter(None, [definition.survey_name, scope.label()]))
+    created = False
+    try:
+        worksheet = call(spreadsheet.worksheet, title)
+    except gspread.WorksheetNotFound:
+        worksheet = call(spreadsheet.add_worksheet, title=title, rows=1, cols=len(header))
+        created = True
+
+    rebuilt = full or created or state is None or state[0] != header_hash
+    if rebuilt:
+        export = load_survey_export(survey_id, scope, order_by_id=True)
+        rows = _sheet_rows(export)
+        call(worksheet.clear)
+        call(worksheet.resize, rows=len(rows) + 1, cols=len(header))
+        _write_blocks(worksheet, [(1, [header] + rows)], len(header), call)
+        appended, updated, deleted = len(rows), 0, 0
+        last_response_id = int(export.responses["ID"].max()) if rows else 0
+    else:
+        last_response_id = state[1]
+        new = load_survey_export(survey_id, scope, after_response_id=last_response_id, order_by_id=True)
+        edited = load_survey_export(survey_id, scope, response_ids=edited_ids, order_by_id=True)
+        # الإجابات المعدلة التي خرجت من النطاق (نقل الإدارة، أو عادت مسودة) تحذف من الورقة
+        in_scope = {int(response_id) for response_id in edited.responses["ID"]}
+        deleted_ids = deleted_ids + [response_id for response_id in edited_ids if response_id not in in_scope]
+
+        # مواقع الإجابات الموجودة في الورقة من عمود ID
+        existing = call(worksheet.col_values, 1)
+        existing, deleted = _delete_sheet_rows(worksheet, existing, deleted_ids, call)
+        row_numbers = {str(value): index + 1 for index, value in enumerate(existing)}
+
+        # الإجابات الجديدة أيضاً تكتب حسب ID: ما كتب منها قبل فشل مزامنة سابقة
+        # (قبل حفظ حالتها) يعاد كتابته في مكانه بدلاً من تكراره
+        blocks, appended_rows, updated = [], [], 0
+        for row in _sheet_rows(edited) + _sheet_rows(new):
+            row_number = row_numbers.get(str(row[0]))
+            if row_number:
+                blocks.append((row_number, [row]))
+                updated += 1
+            else:
+                appended_rows.append(row)
+
+        if appended_rows:
+            next_row = len(existing) + 1
+            blocks.append((next_row, appended_rows))
+            needed = next_row + len(appended_rows) - 1
+            if needed > worksheet.row_count or len(header) > worksheet.col_count:
+                call(worksheet.resize,
+                     rows=max(needed, worksheet.row_count),
+                     cols=max(len(header), worksheet.col_count))
+
+        _write_blocks(worksheet, blocks, len(header), call)
+        appended = len(appended_rows)
+        if len(new.responses):
+            last_response_id = max(last_response_id, int(new.responses["ID"].max()))
+
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute('''
+                INSERT INTO GoogleSheetSync
+                    (survey_id, spreadsheet_name, scope_key, worksheet_title, header_hash,
+                     last_response_id, last_change_id, last_synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(survey_id, spreadsheet_name, scope_key) DO UPDATE SET
+                    worksheet_title = excluded.worksheet_title,
+                    header_hash = excluded.header_hash,
+                    last_response_id = excluded.last_response_id,
+                    last_change_id = excluded.last_change_id,
+                    last_synced_at = excluded.last_synced_at
+            ''', (survey_id, spreadsheet_name, scope.key(), title, header_hash, last_response_id, change_mark))
+            # حذف التغييرات التي صدرت إلى جميع الملفات
+            conn.execute('''
+                DELETE FROM ResponseChanges
+                WHERE change_id <= (SELECT MIN(last_change_id) FROM GoogleSheetSync)
+            ''')
+    finally:
+        conn.close()
+
+    return SheetSyncResult(appended=appended, updated=updated, rebuilt=rebuilt, deleted=deleted)
+
+
+def export_to_google_sheet(survey_id: int, sheet_name: str, full: bool = False,
+                           scope: ExportScope = ExportScope()) -> Optional[SheetSyncResult]:
+    """تصدير بيانات استبيان إلى Google Sheet (مزامنة تزايدية افتراضياً)"""
+    try:
+        return sync_survey_to_google_sheet(survey_id, sheet_name, scope=scope, full=full)
+    except Exception as e:
+        st.error(f"حدث خطأ أثناء التصدير: {str(e)}")
+        return None
+
+
+# ==================== واجهة التصدير ====================
+
+def render_export_scope(key: str, governorate_id: Optional[int] = None) -> ExportScope:
+    """
+    عناصر اختيار نطاق التصدير
+    governorate_id: محافظة مفروضة (مسؤول المحافظة) فلا يظهر اختيار المحافظة
+    """
+    ref = get_reference_data()
+    col1, col2 = st.columns(2)
+    with col1:
+        if governorate_id is None:
+            governorate_id = st.selectbox(
+                "المحافظة",
+                [None] + [g[0] for g in ref.governorates],
+                format_func=lambda x: "الكل" if x is None else ref.governorate_names[x],
+                key=f"{key}_governorate"
+            )
+        if governorate_id is None:
+            admins = [(a[0], a[1]) for a in ref.health_admins]
+        else:
+            admins = ref.health_admins_by_governorate.get(governorate_id, [])
+        admin_id = st.selectbox(
+            "الإدارة الصحية",
+            [None] + [a[0] for a in admins],
+            format_func=lambda x: "الكل" if x is None else ref.health_admin_names[x],
+            key=f"{key}_admin"
+        )
+    with col2:
+        date_from = st.date_input("من تاريخ", value=None, key=f"{key}_date_from")
+        date_to = st.date_input("إلى تاريخ", value=None, key=f"{key}_date_to")
+    completed_only = st.checkbox("الإجابات المكتملة فقط", key=f"{key}_completed")
+    return ExportScope(governorate_id, admin_id, date_from, date_to, completed_only)
+
+
+def show_export_panel(survey_id: int, survey_name: str, governorate_id: Optional[int] = None):
+    """
+    لوحة تصدير إجابات الاستبيان (Google Sheets و Excel و CSV) حسب النطاق المختار
+    governorate_id: يقصر التصدير على محافظة واحدة (لوحة مسؤول المحافظة)
+    """
+    with st.expander("📤 تصدير البيانات"):
+        scope = render_export_scope(f"export_scope_{survey_id}", governorate_id)
+        filename = (re.sub(r'[^\w\-_]', '_', " ".join(filter(None, [survey_name, scope.label()])))
+                    + "_كامل_" + datetime.now().strftime("%Y%m%d_%H%M"))
+
+        st.markdown("**📊 Google Sheets**")
+        sheet_name = st.text_input("أدخل اسم ملف Google Sheets", 
+                                 value=f"استبيانات_{survey_name}",
+                                 key=f"gsheet_name_{survey_id}")
+        col1, col2 = st.columns(2)
+        with col1:
+            sync_clicked = st.button("🔄 مزامنة الإجابات الجديدة والمعدلة", key=f"gsheet_sync_{survey_id}")
+        with col2:
+            full_clicked = st.button("♻️ إعادة تصدير كامل", key=f"gsheet_full_{survey_id}")
+        if sheet_name and (sync_clicked or full_clicked):
+            with st.spinner("جاري التصدير..."):
+                result = export_to_google_sheet(survey_id, sheet_name, full=full_clicked, scope=scope)
+            if result:
+                st.success(f"تم تصدير البيانات بنجاح إلى ملف Google Sheets: {sheet_name} "
+                           f"(إضافة {result.appended} وتحديث {result.updated} وحذف {result.deleted} صف)")
+            else:
+                st.error("فشل في تصدير البيانات")
+
+        st.markdown("**📁 Excel / CSV**")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("تصدير شامل لجميع البيانات إلى Excel", key=f"export_excel_{survey_id}"):
+                export = load_survey_export(survey_id, scope)
+                if export is None:
+                    st.error("الاستبيان المحدد غير موجود")
+                else:
+                    st.download_button(
+                        label="تنزيل ملف Excel الكامل",
+                        data=build_survey_workbook(export),
+                        file_name=filename + ".xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key=f"download_excel_{survey_id}"
+                    )
+                    st.success(f"تم إنشاء ملف Excel الشامل بنجاح ({len(export.responses)} إجابة)")
+        with col2:
+            if st.button("تصدير إلى CSV", key=f"export_csv_{survey_id}"):
+                export = load_survey_export(survey_id, scope)
+                if export is None:
+                    st.error("الاستبيان المحدد غير موجود")
+                else:
+                    st.download_button(
+                        label="⬇️ تنزيل ملف CSV",
+                        data=build_survey_csv(export),
+                        file_name=filename + ".csv",
+                        mime="text/csv",
+                        key=f"download_csv_{survey_id}"
+                    )
+                    st.success(f"تم إنشاء ملف CSV بنجاح ({len(export.responses)} إجابة)")
@@ -1,10 +1,9 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
-import json
 from typing import List, Tuple, Optional
 from database import (
-    DATABASE_PATH,
+    get_connection,
     get_governorate_admin_data,
     get_governorate_surveys,
     get_governorate_employees,
@@ -13,49 +12,49 @@ from database import (
     update_user,
     get_user_allowed_surveys,
     update_user_allowed_surveys,
-    get_response_info,
-    get_response_details,
-    update_response_detail
+    get_health_admins_by_governorate,
+    bump_reference_data_version
 )
+from auth import get_principal
+from navigation import render_sections
+from assignments import show_bulk_assignment
+from exports import show_export_panel, ExportScope
+from metrics import show_metrics_strip, show_field_statistics, show_compliance_matrix
+from response_browser import show_response_browser, ResponseFilter
+from response_editor import show_response_editor
 
 def show_governorate_admin_dashboard():
     """
     عرض لوحة تحكم مسؤول المحافظة
     """
+    principal = get_principal()
+
     # التحقق من الصلاحيات
-    if st.session_state.get('role') != 'governorate_admin':
+    if principal is None or principal.role != 'governorate_admin':
         st.error("غير مصرح لك بالوصول إلى هذه الصفحة")
         return
     
-    # الحصول على بيانات المحافظة
-    gov_data = get_governorate_admin_data(st.session_state.user_id)
-    
-    if not gov_data:
+    # بيانات المحافظة (محملة مع بيانات الجلسة)
+    if not principal.governorate_id:
         st.error("حسابك غير مرتبط بأي محافظة. يرجى التواصل مع مسؤول النظام.")
         return
     
-    governorate_id, governorate_name, description = gov_data
+    governorate_id = principal.governorate_id
+    governorate_name = principal.governorate_name
+    description = principal.governorate_description
     
     # تنسيق واجهة المستخدم
     st.set_page_config(layout="wide")
     st.title(f"لوحة تحكم محافظة {governorate_name}")
     st.markdown(f"**وصف المحافظة:** {description}")
     
-    # تبويبات لوحة التحكم
-    tab1, tab2, tab3 = st.tabs([
-        "📋 إدارة الاستبيانات",
-        "📊 عرض البيانات",
-        "👥 إدارة الموظفين"
-    ])
-    
-    with tab1:
-        manage_governorate_surveys(governorate_id, governorate_name)
-    
-    with tab2:
-        view_governorate_data(governorate_id, governorate_name)
-    
-    with tab3:
-        manage_governorate_employees(governorate_id, governorate_name)
+    # أقسام لوحة التحكم (يتم تنفيذ القسم النشط فقط)
+    render_sections([
+        ("📋 إدارة الاستبيانات", lambda: manage_governorate_surveys(governorate_id, governorate_name)),
+        ("📊 عرض البيانات", lambda: view_governorate_data(governorate_id, governorate_name)),
+        ("👥 إدارة الموظفين", lambda: manage_governorate_employees(governorate_id, governorate_name)),
+        ("✅ الالتزام اليومي", lambda: show_compliance_matrix(governorate_id)),
+    ], key="governorate_dashboard")
 
 def manage_governorate_surveys(governorate_id: int, governorate_name: str):
     """
@@ -103,7 +102,7 @@ def edit_governorate_survey(survey_id: int, governorate_id: int):
     """
     st.subheader("تعديل حالة الاستبيان")
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         # الحصول على بيانات الاستبيان
         survey = conn.execute(
@@ -128,6 +127,7 @@ def edit_governorate_survey(survey_id: int, governorate_id: int):
                         (is_active, survey_id)
                     )
                     conn.commit()
+                    bump_reference_data_version()
                     st.success("تم تحديث حالة الاستبيان بنجاح")
                     del st.session_state.editing_survey
                     st.rerun()
@@ -171,7 +171,7 @@ def view_survey_responses(survey_id: int, governorate_id: int):
     """
     عرض إجابات استبيان معين للمحافظة فقط
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         # الحصول على معلومات الاستبيان
         survey = conn.execute(
@@ -180,118 +180,29 @@ def view_survey_responses(survey_id: int, governorate_id: int):
         ).fetchone()
         
         st.subheader(f"إجابات استبيان {survey[0]}")
-        if st.button("📊 تصدير إلى Google Sheets", key=f"export_gsheet_{survey_id}"):
-            sheet_name = st.text_input("أدخل اسم ملف Google Sheets", 
-                                     value=f"استبيانات_{survey[0]}_{datetime.now().strftime('%Y%m%d')}")
-            
-            if sheet_name and st.button("تأكيد التصدير"):
-                if export_to_google_sheet(survey_id, sheet_name):
-                    st.success(f"تم تصدير البيانات بنجاح إلى ملف Google Sheets: {sheet_name}")
-                else:
-                    st.error("فشل في تصدير البيانات")
-        # الحصول على الإجابات للمحافظة فقط
-        responses = conn.execute('''
-            SELECT r.response_id, u.username, ha.admin_name, 
-                   r.submission_date, r.is_completed
-            FROM Responses r
-            JOIN Users u ON r.user_id = u.user_id
-            JOIN HealthAdministrations ha ON r.region_id = ha.admin_id
-            WHERE r.survey_id = ? AND ha.governorate_id = ?
-            ORDER BY r.submission_date DESC
-        ''', (survey_id, governorate_id)).fetchall()
-        
-        if not responses:
+        show_export_panel(survey_id, survey[0], governorate_id=governorate_id)
+
+        # عرض الإحصائيات (محسوبة داخل قاعدة البيانات لمحافظة المسؤول فقط)
+        metrics = show_metrics_strip(survey_id, ExportScope(governorate_id=governorate_id),
+                                     breakdowns=('admin', 'day'))
+        if metrics.total == 0:
             st.info("لا توجد إجابات مسجلة لهذا الاستبيان في محافظتك")
             return
-        
-        # عرض الإحصائيات
-        total = len(responses)
-        completed = sum(1 for r in responses if r[4])
-        
-        col1, col2, col3 = st.columns(3)
-        col1.metric("إجمالي الإجابات", total)
-        col2.metric("الإجابات المكتملة", completed)
-        col3.metric("نسبة الإكمال", f"{round((completed/total)*100)}%")
-        
-        # عرض البيانات في جدول
-        df = pd.DataFrame(
-            [(r[0], r[1], r[2], r[3], "✔️" if r[4] else "✖️") 
-             for r in responses],
-            columns=["ID", "المستخدم", "الإدارة الصحية", "التاريخ", "الحالة"]
-        )
-        
-        st.dataframe(df, use_container_width=True)
-        
-        # استخدام مفتاح فريد يجمع بين survey_id و governorate_id و response_id
-        selected_response_id = st.selectbox(
-            "اختر إجابة لعرض وتعديل تفاصيلها",
-            options=[r[0] for r in responses],
-            format_func=lambda x: f"إجابة #{x}",
-            key=f"response_select_{survey_id}_{governorate_id}"
+
+        if st.toggle("📈 عرض إحصائيات الحقول", key=f"field_stats_{survey_id}_{governorate_id}"):
+            show_field_statistics(survey_id, ExportScope(governorate_id=governorate_id))
+
+        # تصفح إجابات المحافظة فقط (صفحات ومرشحات داخل الاستعلام)
+        selected_response_id = show_response_browser(
+            survey_id,
+            key=f"responses_{survey_id}_{governorate_id}",
+            base=ResponseFilter(scope=ExportScope(governorate_id=governorate_id)),
+            filters=('region', 'user', 'status', 'date'),
+            columns=["ID", "المستخدم", "الإدارة الصحية", "تاريخ التقديم", "الحالة"]
         )
 
         if selected_response_id:
-            response_info = get_response_info(selected_response_id)
-            if response_info:
-                st.subheader(f"تفاصيل الإجابة #{selected_response_id}")
-                st.markdown(f"""
-                **الاستبيان:** {response_info[1]}  
-                **المستخدم:** {response_info[2]}  
-                **الإدارة الصحية:** {response_info[3]}  
-                **المحافظة:** {response_info[4]}  
-                **تاريخ التقديم:** {response_info[5]}
-                """)
-                
-                details = get_response_details(selected_response_id)
-                updates = {}  # لتخزين التعديلات
-                
-                # استخدم نموذج لتجميع التعديلات
-                with st.form(key=f"edit_response_{survey_id}_{governorate_id}_{selected_response_id}"):
-                    for detail in details:
-                        detail_id, field_id, label, field_type, options, answer = detail
-                        
-                        col1, col2 = st.columns([1, 3])
-                        with col1:
-                            st.markdown(f"**{label}**")
-                        with col2:
-                            if field_type == 'dropdown':
-                                options_list = json.loads(options) if options else []
-                                new_value = st.selectbox(
-                                    f"تعديل {label}",
-                                    options_list,
-                                    index=options_list.index(answer) if answer in options_list else 0,
-                                    key=f"edit_dropdown_{detail_id}_{selected_response_id}"
-                                )
-                            else:
-                                new_value = st.text_input(
-                                    f"تعديل {label}",
-                                    value=answer,
-                                    key=f"edit_input_{detail_id}_{selected_response_id}"
-                                )
-                            
-                            if new_value != answer:
-                                updates[detail_id] = new_value
-                    
-                    # أزرار الحفظ والإلغاء
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("💾 حفظ جميع التعديلات"):
-                            if updates:
-                                success_count = 0
-                                for detail_id, new_value in updates.items():
-                                    if update_response_detail(detail_id, new_value):
-                                        success_count += 1
-                                
-                                if success_count == len(updates):
-                                    st.success("تم تحديث جميع التعديلات بنجاح")
-                                else:
-                                    st.error(f"تم تحديث {success_count} من أصل {len(updates)} تعديلات")
-                                st.rerun()
-                            else:
-                                st.info("لم تقم بإجراء أي تعديلات")
-                    with col2:
-                        if st.form_submit_button("❌ إلغاء التعديلات"):
-                            st.rerun()
+            show_response_editor(selected_response_id, key=f"response_editor_{survey_id}_{governorate_id}")
         
     except sqlite3.Error as e:
         st.error(f"حدث خطأ في قاعدة البيانات: {str(e)}")
@@ -309,6 +220,8 @@ def manage_governorate_employees(governorate_id: int, governorate_name: str):
     if not employees:
         st.info("لا يوجد موظفون مسجلون لهذه المحافظة")
         return
+
+    show_bulk_assignment(f"governorate_bulk_assignment_{governorate_id}", governorate_id)
     
     # عرض الموظفين
     for emp in employees:
@@ -336,7 +249,7 @@ def edit_employee(user_id: int, governorate_id: int):
     """
     st.subheader("تعديل بيانات الموظف")
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     try:
         # الحصول على بيانات الموظف
         employee = conn.execute('''
@@ -352,11 +265,8 @@ def edit_employee(user_id: int, governorate_id: int):
             return
         
         # الحصول على الإدارات الصحية للمحافظة فقط
-        health_admins = conn.execute('''
-            SELECT admin_id, admin_name FROM HealthAdministrations
-            WHERE governorate_id = ?
-            ORDER BY admin_name
-        ''', (governorate_id,)).fetchall()
+        health_admins = sorted(get_health_admins_by_governorate(governorate_id), key=lambda a: a[1])
+        health_admin_names = dict(health_admins)
         
         # الحصول على الاستبيانات المتاحة للمحافظة فقط
         surveys = get_governorate_surveys(governorate_id)
@@ -366,8 +276,8 @@ def edit_employee(user_id: int, governorate_id: int):
         allowed_survey_ids = [s[0] for s in allowed_surveys]
         
         # تصفية allowed_survey_ids لضمان وجودها في surveys
-        survey_ids = [s[0] for s in surveys]
-        valid_allowed_survey_ids = [sid for sid in allowed_survey_ids if sid in survey_ids]
+        survey_names = {s[0]: s[1] for s in surveys}
+        valid_allowed_survey_ids = [sid for sid in allowed_survey_ids if sid in survey_names]
         
         # نموذج التعديل
         with st.form(f"edit_employee_{user_id}"):
@@ -377,7 +287,7 @@ def edit_employee(user_id: int, governorate_id: int):
                 "الإدارة الصحية",
                 options=[a[0] for a in health_admins],
                 index=[a[0] for a in health_admins].index(employee[1]) if health_admins else 0,
-                format_func=lambda x: next(a[1] for a in health_admins if a[0] == x)
+                format_func=lambda x: health_admin_names[x]
             )
             
             if surveys:
@@ -385,7 +295,7 @@ def edit_employee(user_id: int, governorate_id: int):
                     "الاستبيانات المسموح بها",
                     options=[s[0] for s in surveys],
                     default=valid_allowed_survey_ids,
-                    format_func=lambda x: next(s[1] for s in surveys if s[0] == x)
+                    format_func=lambda x: survey_names[x]
                 )
             else:
                 st.info("لا توجد استبيانات متاحة لهذه المحافظة")
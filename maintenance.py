@@ -0,0 +1,84 @@
+"""
+أوامر صيانة قاعدة البيانات
+
+الاستخدام:
+    python maintenance.py rebuild-rollups
+    python maintenance.py enable-answer-documents
+    python maintenance.py disable-answer-documents
+    python maintenance.py check-answer-documents [--repair]
+    python maintenance.py archive-audit-logs [--days 365]
+"""
+import argparse
+import sys
+
+from audit import AUDIT_RETENTION_DAYS, archive_audit_logs
+
+from database import (init_db, rebuild_submission_rollup, set_answer_documents,
+                      answer_documents_enabled, check_answer_documents)
+
+
+def cmd_rebuild_rollups(args):
+    """إعادة بناء جدول تجميع الإجابات اليومي من جدول Responses"""
+    rows = rebuild_submission_rollup()
+    print(f"SubmissionRollup: {rows} rows")
+
+
+def cmd_enable_answer_documents(args):
+    """تفعيل مستندات الإجابات وبنائها للإجابات الموجودة"""
+    documents = set_answer_documents(True)
+    print(f"ResponseDocuments: {documents} documents")
+
+
+def cmd_disable_answer_documents(args):
+    """إيقاف مستندات الإجابات (القراءة تعود إلى Response_Details)"""
+    set_answer_documents(False)
+    print("ResponseDocuments: disabled")
+
+
+def cmd_check_answer_documents(args):
+    """التحقق من تطابق مستندات الإجابات مع Response_Details"""
+    if not answer_documents_enabled():
+        print("ResponseDocuments: disabled")
+        return 0
+    mismatched = check_answer_documents(repair=args.repair)
+    if not mismatched:
+        print("ResponseDocuments: consistent")
+        return 0
+    print(f"ResponseDocuments: {len(mismatched)} mismatched responses"
+          f"{' (repaired)' if args.repair else ''}")
+    print(" ".join(str(response_id) for response_id in mismatched[:100]))
+    return 0 if args.repair else 1
+
+
+def cmd_archive_audit_logs(args):
+    """نقل سجل التعديلات الأقدم من المدة المحددة إلى ملفات الأرشيف الشهرية"""
+    archived = archive_audit_logs(args.days)
+    for month, rows in archived.items():
+        print(f"AuditLog {month}: {rows} rows archived")
+    print(f"AuditLog: {sum(archived.values())} rows archived")
+
+
+COMMANDS = {
+    'rebuild-rollups': cmd_rebuild_rollups,
+    'enable-answer-documents': cmd_enable_answer_documents,
+    'disable-answer-documents': cmd_disable_answer_documents,
+    'check-answer-documents': cmd_check_answer_documents,
+    'archive-audit-logs': cmd_archive_audit_logs,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="أوامر صيانة قاعدة البيانات")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--repair', action='store_true',
+                        help="إعادة بناء المستندات غير المتطابقة (check-answer-documents)")
+    parser.add_argument('--days', type=int, default=AUDIT_RETENTION_DAYS,
+                        help="عمر سجل التعديلات بالأيام قبل أرشفته (archive-audit-logs)")
+    args = parser.parse_args()
+
+    init_db()
+    return COMMANDS[args.command](args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,508 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from database import get_connection, get_compiled_survey, get_reference_data, CompiledField
+from exports import ExportScope
+
+# التفصيلات المتاحة من جدول التجميع: (مفتاح التجميع، العنوان المعروض، الربط، اسم العمود)
+METRIC_BREAKDOWNS: Dict[str, Tuple[str, str, str, str]] = {
+    'governorate': ("ru.governorate_id", "g.governorate_name",
+                    "LEFT JOIN Governorates g ON g.governorate_id = ru.governorate_id", "المحافظة"),
+    'admin': ("ru.admin_id", "h.admin_name",
+              "LEFT JOIN HealthAdministrations h ON h.admin_id = ru.admin_id", "الإدارة الصحية"),
+    'day': ("ru.day", "ru.day", "", "اليوم"),
+}
+
+BREAKDOWN_LABELS = {
+    'governorate': "حسب المحافظة",
+    'admin': "حسب الإدارة الصحية",
+    'day': "حسب اليوم",
+}
+
+
+class SurveyMetrics(NamedTuple):
+    """مؤشرات استبيان مقروءة من جدول التجميع SubmissionRollup"""
+    total: int
+    completed: int
+    health_admins: int
+    governorates: int
+    first_day: Optional[str]
+    last_day: Optional[str]
+
+    @property
+    def drafts(self) -> int:
+        return self.total - self.completed
+
+    @property
+    def completion_rate(self) -> float:
+        """نسبة الإجابات المكتملة (0-100)"""
+        return (self.completed / self.total * 100) if self.total else 0.0
+
+
+def _scope_sql(survey_id: int, scope: ExportScope) -> Tuple[str, list]:
+    conditions, params = scope.conditions()
+    return " AND ".join(["r.survey_id = ?"] + conditions), [survey_id] + params
+
+
+def _rollup_sql(survey_id: int, scope: ExportScope) -> Tuple[str, list, str, str]:
+    """
+    شروط النطاق على SubmissionRollup (الاسم المستعار ru)
+    يعيد (WHERE، المعاملات، تعبير الإجمالي، تعبير المسودات)
+    """
+    conditions, params = ["ru.survey_id = ?"], [survey_id]
+    if scope.governorate_id is not None:
+        conditions.append("ru.governorate_id = ?")
+        params.append(scope.governorate_id)
+    if scope.admin_id is not None:
+        conditions.append("ru.admin_id = ?")
+        params.append(scope.admin_id)
+    if scope.date_from is not None:
+        conditions.append("ru.day >= ?")
+        params.append(scope.date_from.isoformat())
+    if scope.date_to is not None:
+        conditions.append("ru.day <= ?")
+        params.append(scope.date_to.isoformat())
+    if scope.completed_only:
+        conditions.append("ru.completed > 0")
+        return " AND ".join(conditions), params, "ru.completed", "0"
+    return " AND ".join(conditions), params, "ru.drafts + ru.completed", "ru.drafts"
+
+
+def get_survey_metrics(survey_id: int, scope: ExportScope = ExportScope()) -> SurveyMetrics:
+    """إجمالي الإجابات والمكتمل منها وعدد الإدارات والمحافظات من جدول التجميع"""
+    where, params, total, _ = _rollup_sql(survey_id, scope)
+    conn = get_connection()
+    try:
+        row = conn.execute(f'''
+            SELECT COALESCE(SUM({total}), 0),
+                   COALESCE(SUM(ru.completed), 0),
+                   COUNT(DISTINCT ru.admin_id),
+                   COUNT(DISTINCT ru.governorate_id),
+                   MIN(ru.day),
+                   MAX(ru.day)
+            FROM SubmissionRollup ru
+            WHERE {where}
+        ''', params).fetchone()
+    finally:
+        conn.close()
+    return SurveyMetrics(*row)
+
+
+def get_survey_metrics_breakdown(survey_id: int, by: str,
+                                 scope: ExportScope = ExportScope()) -> pd.DataFrame:
+    """
+    المؤشرات مفصلة حسب المحافظة أو الإدارة الصحية أو اليوم من جدول التجميع
+    by: أحد مفاتيح METRIC_BREAKDOWNS
+    """
+    key, label, join, column = METRIC_BREAKDOWNS[by]
+    where, params, total, drafts = _rollup_sql(survey_id, scope)
+    conn = get_connection()
+    try:
+        rows = conn.execute(f'''
+            SELECT {label},
+                   SUM({total}),
+                   SUM(ru.completed),
+                   SUM({drafts})
+            FROM SubmissionRollup ru
+            {join}
+            WHERE {where}
+            GROUP BY {key}
+            ORDER BY {"1" if by == 'day' else "2 DESC"}
+        ''', params).fetchall()
+    finally:
+        conn.close()
+
+    df = pd.DataFrame(rows, columns=[column, "إجمالي الإجابات", "الإجابات المكتملة", "المسودات"])
+    df["نسبة الإكمال %"] = (df["الإجابات المكتملة"] / df["إجمالي الإجابات"] * 100).round(1)
+    return df
+
+
+def show_metrics_strip(survey_id: int, scope: ExportScope = ExportScope(),
+                       breakdowns: Tuple[str, ...] = ('governorate', 'admin', 'day')) -> SurveyMetrics:
+    """عرض شريط المؤشرات مع تفصيل اختياري، ويعيد المؤشرات للاستخدام في الصفحة"""
+    metrics = get_survey_metrics(survey_id, scope)
+    if metrics.total == 0:
+        return metrics
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("إجمالي الإجابات", metrics.total)
+    col2.metric("الإجابات المكتملة", metrics.completed)
+    col3.metric("نسبة الإكمال", f"{round(metrics.completion_rate)}%")
+    col4.metric("عدد المناطق", metrics.health_admins)
+
+    by = st.selectbox(
+        "تفصيل المؤشرات",
+        (None,) + tuple(breakdowns),
+        format_func=lambda x: "بدون تفصيل" if x is None else BREAKDOWN_LABELS[x],
+        key=f"metrics_breakdown_{survey_id}"
+    )
+    if by:
+        df = get_survey_metrics_breakdown(survey_id, by, scope)
+        if by == 'day':
+            st.bar_chart(df.set_index(METRIC_BREAKDOWNS[by][3])[["الإجابات المكتملة", "المسودات"]])
+        st.dataframe(df, use_container_width=True, hide_index=True)
+    return metrics
+
+
+# ==================== إحصائيات الحقول ====================
+
+FIELD_STATS_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+CHECKBOX_LABELS = {"True": "نعم", "False": "لا"}
+
+
+class FieldStats(NamedTuple):
+    """إحصائيات إجابات حقل واحد"""
+    field: CompiledField
+    answered: int
+    distribution: Optional[pd.Series] = None   # القيمة ← عدد التكرار (قائمة منسدلة/مربع اختيار)
+    summary: Optional[pd.Series] = None        # count/mean/std/min/quantiles/max (رقم)
+    histogram: Optional[pd.Series] = None      # الفترة ← العدد (تاريخ)
+    distinct: Optional[int] = None             # عدد القيم المختلفة (نص)
+
+
+def compute_field_stats(fields: Sequence[CompiledField], field_ids: np.ndarray,
+                        values: np.ndarray) -> Dict[int, FieldStats]:
+    """
+    حساب إحصائيات جميع الحقول دفعة واحدة من مصفوفتي (field_id, answer_value)
+    كل نوع حقل يحسب بعملية تجميع واحدة على جميع حقوله
+    """
+    frame = pd.DataFrame({"field_id": field_ids, "value": values})
+    frame = frame[frame["value"].notna() & (frame["value"] != "")]
+    answered = frame.groupby("field_id").size()
+
+    ids_by_type: Dict[str, List[int]] = {}
+    for field in fields:
+        ids_by_type.setdefault(field.field_type, []).append(field.field_id)
+
+    def of_type(*types: str) -> pd.DataFrame:
+        ids = [field_id for t in types for field_id in ids_by_type.get(t, [])]
+        return frame[frame["field_id"].isin(ids)]
+
+    # توزيع القيم لحقول القوائم المنسدلة ومربعات الاختيار
+    distributions = of_type('dropdown', 'checkbox').groupby(["field_id", "value"]).size()
+
+    # الملخص الإحصائي للحقول الرقمية
+    numbers = of_type('number')
+    numbers = numbers.assign(number=pd.to_numeric(numbers["value"], errors="coerce")).dropna(subset=["number"])
+    summaries = numbers.groupby("field_id")["number"].describe(percentiles=FIELD_STATS_QUANTILES)
+
+    # توزيع التواريخ (يومي للفترات القصيرة، شهري لغير ذلك)
+    dates = of_type('date')
+    dates = dates.assign(date=pd.to_datetime(dates["value"], errors="coerce", format="ISO8601")).dropna(subset=["date"])
+    histograms = {}
+    for field_id, series in dates.groupby("field_id")["date"]:
+        freq = "D" if series.max() - series.min() <= pd.Timedelta(days=62) else "M"
+        counts = series.dt.to_period(freq).value_counts().sort_index()
+        histograms[field_id] = pd.Series(counts.to_numpy(), index=counts.index.astype(str))
+
+    distinct = of_type('text').groupby("field_id")["value"].nunique()
+
+    result = {}
+    for field in fields:
+        field_id = field.field_id
+        stats = FieldStats(field=field, answered=int(answered.get(field_id, 0)))
+        if field.field_type in ('dropdown', 'checkbox'):
+            counts = distributions.xs(field_id, level="field_id") if field_id in answered.index else pd.Series(dtype=int)
+            if field.field_type == 'dropdown':
+                order = list(field.options) + [v for v in counts.index if v not in field.options]
+                counts = counts.reindex(order, fill_value=0)
+            else:
+                counts = counts.rename(index=CHECKBOX_LABELS)
+            stats = stats._replace(distribution=counts)
+        elif field.field_type == 'number' and field_id in summaries.index:
+            stats = stats._replace(summary=summaries.loc[field_id])
+        elif field.field_type == 'date' and field_id in histograms:
+            stats = stats._replace(histogram=histograms[field_id])
+        elif field.field_type == 'text':
+            stats = stats._replace(distinct=int(distinct.get(field_id, 0)))
+        result[field_id] = stats
+    return result
+
+
+def _load_answers(survey_id: int, scope: ExportScope) -> Tuple[np.ndarray, np.ndarray]:
+    """قراءة جميع إجابات الاستبيان (field_id, answer_value) باستعلام واحد"""
+    where, params = _scope_sql(survey_id, scope)
+    join = "JOIN HealthAdministrations h ON r.region_id = h.admin_id" if scope.governorate_id is not None else ""
+    conn = get_connection()
+    try:
+        rows = conn.execute(f'''
+            SELECT rd.field_id, rd.answer_value
+            FROM Response_Details rd
+            JOIN Responses r ON r.response_id = rd.response_id
+            {join}
+            WHERE {where}
+        ''', params).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+    field_ids, values = zip(*rows)
+    return np.fromiter(field_ids, dtype=np.int64, count=len(rows)), np.array(values, dtype=object)
+
+
+def _answers_version(survey_id: int) -> Tuple[int, int, int]:
+    """يتغير عند إضافة أو حذف إجابة للاستبيان أو تعديل أي إجابة (ResponseChanges)"""
+    conn = get_connection()
+    try:
+        return conn.execute('''
+            SELECT COUNT(*), COALESCE(MAX(response_id), 0),
+                   COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'ResponseChanges'), 0)
+            FROM Responses
+            WHERE survey_id = ?
+        ''', (survey_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+# أقصى عدد من (الاستبيان، النطاق) تحفظ إحصائياته؛ الأقدم استخداماً يحذف أولاً
+FIELD_STATS_CACHE_SIZE = int(os.environ.get("SURVEY_FIELD_STATS_CACHE_SIZE", "64"))
+
+_field_stats_cache: "OrderedDict[Tuple[int, str], Tuple[tuple, Dict[int, FieldStats]]]" = OrderedDict()
+_field_stats_lock = threading.Lock()
+
+def get_field_stats(survey_id: int, scope: ExportScope = ExportScope()) -> Dict[int, FieldStats]:
+    """إحصائيات حقول الاستبيان من الذاكرة، تعاد حسابها فقط عند وصول إجابات جديدة أو تعديلها"""
+    survey = get_compiled_survey(survey_id)
+    version = (survey.version,) + tuple(_answers_version(survey_id))
+    cache_key = (survey_id, scope.key())
+
+    with _field_stats_lock:
+        cached = _field_stats_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            _field_stats_cache.move_to_end(cache_key)
+            return cached[1]
+
+    field_ids, values = _load_answers(survey_id, scope)
+    stats = compute_field_stats(survey.fields, field_ids, values)
+    with _field_stats_lock:
+        # مدخل واحد لكل (استبيان، نطاق) بآخر إصدار فقط، مع حد أقصى لعدد المدخلات
+        _field_stats_cache[cache_key] = (version, stats)
+        _field_stats_cache.move_to_end(cache_key)
+        while len(_field_stats_cache) > FIELD_STATS_CACHE_SIZE:
+            _field_stats_cache.popitem(last=False)
+    return stats
+
+
+# الأعمدة المكتوبة في Response_Details لكل نوع حقل
+TYPED_ANSWER_COLUMNS = {'number': "answer_number", 'date': "answer_date", 'checkbox': "answer_bool"}
+
+
+class FieldAggregate(NamedTuple):
+    """تجميع إجابات حقل محسوب في SQL (total و mean للأرقام والاختيار فقط)"""
+    answered: int
+    minimum: object
+    maximum: object
+    total: Optional[float]
+    mean: Optional[float]
+
+
+def get_field_aggregate(survey_id: int, field: CompiledField, scope: ExportScope = ExportScope(),
+                        low=None, high=None) -> FieldAggregate:
+    """
+    عدد الإجابات وأدناها وأعلاها ومجموعها لحقل رقمي أو تاريخ أو اختيار
+    low/high: حدود نطاق اختيارية (شاملة) تطبق على العمود المكتوب عبر فهرسه
+    """
+    column = TYPED_ANSWER_COLUMNS.get(field.field_type)
+    if column is None:
+        raise ValueError(f"نوع الحقل غير مدعوم للتجميع: {field.field_type}")
+
+    where, params = _scope_sql(survey_id, scope)
+    join = "JOIN HealthAdministrations h ON r.region_id = h.admin_id" if scope.governorate_id is not None else ""
+    conditions = ["rd.field_id = ?", f"rd.{column} IS NOT NULL"]
+    range_params = [field.field_id]
+    if low is not None:
+        conditions.append(f"rd.{column} >= ?")
+        range_params.append(low.isoformat() if isinstance(low, date) else low)
+    if high is not None:
+        conditions.append(f"rd.{column} <= ?")
+        range_params.append(high.isoformat() if isinstance(high, date) else high)
+    numeric = field.field_type != 'date'
+
+    conn = get_connection()
+    try:
+        row = conn.execute(f'''
+            SELECT COUNT(*), MIN(rd.{column}), MAX(rd.{column}),
+                   {f"SUM(rd.{column}), AVG(rd.{column})" if numeric else "NULL, NULL"}
+            FROM Response_Details rd
+            JOIN Responses r ON r.response_id = rd.response_id
+            {join}
+            WHERE {" AND ".join(conditions)} AND {where}
+        ''', range_params + params).fetchone()
+    finally:
+        conn.close()
+    return FieldAggregate(*row)
+
+
+def _show_range_filter(survey_id: int, field: CompiledField, scope: ExportScope):
+    """عدد الإجابات ضمن نطاق يحدده المستخدم (يحسب في SQL)"""
+    key = f"field_range_{survey_id}_{field.field_id}"
+    with st.expander("🔢 الإجابات ضمن نطاق"):
+        col1, col2 = st.columns(2)
+        if field.field_type == 'date':
+            low = col1.date_input("من", value=None, key=f"{key}_low")
+            high = col2.date_input("إلى", value=None, key=f"{key}_high")
+        else:
+            low = col1.number_input("من", value=None, key=f"{key}_low")
+            high = col2.number_input("إلى", value=None, key=f"{key}_high")
+        aggregate = get_field_aggregate(survey_id, field, scope, low, high)
+        col1, col2 = st.columns(2)
+        col1.metric("عدد الإجابات", aggregate.answered)
+        if aggregate.total is not None:
+            col2.metric("المجموع", f"{aggregate.total:.2f}")
+
+
+def show_field_statistics(survey_id: int, scope: ExportScope = ExportScope()):
+    """عرض إحصائيات كل حقل حسب نوعه"""
+    stats = get_field_stats(survey_id, scope)
+    if not stats:
+        st.info("لا توجد حقول في هذا الاستبيان")
+        return
+
+    for field_stats in stats.values():
+        field = field_stats.field
+        st.markdown(f"**{field.label}** — {field_stats.answered} إجابة")
+        if field_stats.distribution is not None and len(field_stats.distribution):
+            counts = field_stats.distribution
+            st.bar_chart(counts)
+            st.dataframe(
+                pd.DataFrame({"العدد": counts, "النسبة %": (counts / max(counts.sum(), 1) * 100).round(1)}),
+                use_container_width=True
+            )
+        elif field_stats.summary is not None:
+            summary = field_stats.summary
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("المتوسط", f"{summary['mean']:.2f}")
+            col2.metric("الوسيط", f"{summary['50%']:.2f}")
+            col3.metric("الأدنى", f"{summary['min']:.2f}")
+            col4.metric("الأعلى", f"{summary['max']:.2f}")
+            st.dataframe(summary.to_frame("القيمة").T, use_container_width=True, hide_index=True)
+        elif field_stats.histogram is not None:
+            st.bar_chart(field_stats.histogram)
+        elif field_stats.distinct is not None:
+            st.caption(f"عدد القيم المختلفة: {field_stats.distinct}")
+        else:
+            st.caption("لا توجد إجابات")
+        if field.field_type in ('number', 'date') and field_stats.answered:
+            _show_range_filter(survey_id, field, scope)
+        st.divider()
+
+
+# ==================== الالتزام اليومي ====================
+
+COMPLIANCE_LABELS = {
+    'completed': "✔️ مكتمل",
+    'draft': "📝 مسودة فقط",
+    'missing': "❌ لم يبدأ",
+}
+
+
+def get_daily_compliance(governorate_id: int, day: Optional[date] = None,
+                         admin_id: Optional[int] = None) -> pd.DataFrame:
+    """
+    حالة كل (موظف، استبيان مخصص له) في يوم معين باستعلام واحد:
+    completed (سجل في DailyCompletions)، draft (مسودة فقط في نفس اليوم)، missing
+    day: الافتراضي اليوم الحالي (بنفس توقيت DailyCompletions)
+    """
+    conditions, params = ["h.governorate_id = ?", "u.role = 'employee'"], [governorate_id]
+    if admin_id is not None:
+        conditions.append("u.assigned_region = ?")
+        params.append(admin_id)
+
+    conn = get_connection()
+    try:
+        rows = conn.execute(f'''
+            WITH target(day) AS (SELECT COALESCE(?, DATE('now')))
+            SELECT u.user_id, u.username, h.admin_name, s.survey_id, s.survey_name,
+                   CASE
+                       WHEN dc.response_id IS NOT NULL THEN 'completed'
+                       WHEN EXISTS (
+                           SELECT 1 FROM Responses r
+                           WHERE r.user_id = u.user_id
+                             AND r.survey_id = us.survey_id
+                             AND r.submission_date >= target.day
+                             AND r.submission_date < DATE(target.day, '+1 day')
+                       ) THEN 'draft'
+                       ELSE 'missing'
+                   END
+            FROM target
+            CROSS JOIN Users u
+            JOIN HealthAdministrations h ON u.assigned_region = h.admin_id
+            JOIN UserSurveys us ON us.user_id = u.user_id
+            JOIN Surveys s ON s.survey_id = us.survey_id AND s.is_active
+            LEFT JOIN DailyCompletions dc
+                   ON dc.user_id = u.user_id
+                  AND dc.survey_id = us.survey_id
+                  AND dc.completion_day = target.day
+            WHERE {" AND ".join(conditions)}
+            ORDER BY h.admin_name, u.username, s.survey_name
+        ''', [day.isoformat() if day else None] + params).fetchall()
+    finally:
+        conn.close()
+
+    return pd.DataFrame(rows, columns=["user_id", "المستخدم", "الإدارة الصحية",
+                                       "survey_id", "الاستبيان", "status"])
+
+
+def _survey_labels(df: pd.DataFrame) -> Dict[int, str]:
+    """اسم عرض لكل survey_id مع تمييز الأسماء المكررة برقم الاستبيان"""
+    names = df[["survey_id", "الاستبيان"]].drop_duplicates()
+    duplicated = set(names.loc[names["الاستبيان"].duplicated(keep=False), "الاستبيان"])
+    return {survey_id: f"{name} ({survey_id})" if name in duplicated else name
+            for survey_id, name in names.itertuples(index=False, name=None)}
+
+
+def show_compliance_matrix(governorate_id: int):
+    """مصفوفة الموظفين × الاستبيانات المخصصة مع حالة الإكمال اليومية"""
+    ref = get_reference_data()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        # نفس اليوم الذي يسجل به DailyCompletions (DATE('now') في SQLite بتوقيت UTC)
+        day = st.date_input("اليوم", value=datetime.now(timezone.utc).date(), key="compliance_day")
+    with col2:
+        admin_id = st.selectbox(
+            "الإدارة الصحية",
+            [None] + [a[0] for a in ref.health_admins_by_governorate.get(governorate_id, [])],
+            format_func=lambda x: "الكل" if x is None else ref.health_admin_names[x],
+            key="compliance_admin"
+        )
+    with col3:
+        pending_only = st.checkbox("غير المكتمل فقط", key="compliance_pending")
+
+    df = get_daily_compliance(governorate_id, day, admin_id)
+    if df.empty:
+        st.info("لا توجد استبيانات مخصصة لموظفي المحافظة")
+        return
+
+    counts = df["status"].value_counts()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("التكليفات", len(df))
+    col2.metric("مكتمل", int(counts.get('completed', 0)))
+    col3.metric("مسودة فقط", int(counts.get('draft', 0)))
+    col4.metric("لم يبدأ", int(counts.get('missing', 0)))
+
+    # أسماء الاستبيانات غير فريدة، فالتجميع على survey_id ثم يعاد تسميته للعرض
+    survey_labels = _survey_labels(df)
+
+    # ملخص لكل استبيان
+    summary = pd.crosstab(df["survey_id"], df["status"]).reindex(columns=list(COMPLIANCE_LABELS), fill_value=0)
+    summary = summary.rename(index=survey_labels, columns=COMPLIANCE_LABELS)
+    summary.index.name = "الاستبيان"
+    st.dataframe(summary, use_container_width=True)
+
+    if pending_only:
+        pending_users = df.loc[df["status"] != 'completed', "user_id"].unique()
+        df = df[df["user_id"].isin(pending_users)]
+
+    matrix = df.assign(status=df["status"].map(COMPLIANCE_LABELS)).pivot(
+        index=["user_id", "المستخدم", "الإدارة الصحية"], columns="survey_id", values="status"
+    ).fillna("—")
+    matrix = matrix.droplevel("user_id").rename(columns=survey_labels)
+    matrix.columns.name = "الاستبيان"
+    st.dataframe(matrix, use_container_width=True)
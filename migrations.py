@@ -0,0 +1,865 @@
+import json
+import sqlite3
+from typing import Callable, List, Optional, Tuple
+
+# ترحيلات مخطط قاعدة البيانات
+# كل ترحيل له رقم إصدار تصاعدي ودالة تستقبل الاتصال وتكون قابلة لإعادة التنفيذ بأمان.
+# رقم الإصدار الحالي يحفظ في PRAGMA user_version وسجل التنفيذ في جدول SchemaMigrations.
+
+
+def _create_baseline_schema(c: sqlite3.Cursor):
+    """الجداول الأساسية للنظام والمستخدم الافتراضي"""
+    # Create Users table
+    c.execute('''CREATE TABLE IF NOT EXISTS Users
+                 (user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  username TEXT UNIQUE NOT NULL,
+                  password_hash TEXT NOT NULL,
+                  role TEXT NOT NULL,
+                  assigned_region INTEGER,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  last_login TIMESTAMP,
+                  FOREIGN KEY(assigned_region) REFERENCES Regions(region_id))''')
+
+    # Create Governorates table
+    c.execute('''CREATE TABLE IF NOT EXISTS Governorates
+                 (governorate_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  governorate_name TEXT NOT NULL UNIQUE,
+                  description TEXT)''')
+
+    # Create Regions table (with governorate relationship)
+    c.execute('''CREATE TABLE IF NOT EXISTS HealthAdministrations
+             (admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
+              admin_name TEXT NOT NULL,
+              description TEXT,
+              governorate_id INTEGER NOT NULL,
+              FOREIGN KEY(governorate_id) REFERENCES Governorates(governorate_id),
+              UNIQUE(admin_name, governorate_id))''')
+
+    # Create Surveys table
+    c.execute('''CREATE TABLE IF NOT EXISTS Surveys
+                 (survey_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  survey_name TEXT NOT NULL,
+                  created_by INTEGER NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  is_active BOOLEAN DEFAULT TRUE,
+                  FOREIGN KEY(created_by) REFERENCES Users(user_id))''')
+
+    # Create Survey_Fields table
+    c.execute('''CREATE TABLE IF NOT EXISTS Survey_Fields
+                 (field_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  survey_id INTEGER NOT NULL,
+                  field_type TEXT NOT NULL,
+                  field_label TEXT NOT NULL,
+                  field_options TEXT,
+                  is_required BOOLEAN DEFAULT FALSE,
+                  field_order INTEGER NOT NULL,
+                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id))''')
+
+    # Create Responses table
+    c.execute('''CREATE TABLE IF NOT EXISTS Responses
+                 (response_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  survey_id INTEGER NOT NULL,
+                  user_id INTEGER NOT NULL,
+                  region_id INTEGER NOT NULL,
+                  submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  is_completed BOOLEAN DEFAULT FALSE,
+                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
+                  FOREIGN KEY(user_id) REFERENCES Users(user_id),
+                  FOREIGN KEY(region_id) REFERENCES Regions(region_id))''')
+
+    # Create Response_Details table
+    c.execute('''CREATE TABLE IF NOT EXISTS Response_Details
+                 (detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  response_id INTEGER NOT NULL,
+                  field_id INTEGER NOT NULL,
+                  answer_value TEXT,
+                  FOREIGN KEY(response_id) REFERENCES Responses(response_id),
+                  FOREIGN KEY(field_id) REFERENCES Survey_Fields(field_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS GovernorateAdmins
+             (admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER NOT NULL,
+              governorate_id INTEGER NOT NULL,
+              FOREIGN KEY(user_id) REFERENCES Users(user_id),
+              FOREIGN KEY(governorate_id) REFERENCES Governorates(governorate_id),
+              UNIQUE(user_id, governorate_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS UserSurveys
+             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER NOT NULL,
+              survey_id INTEGER NOT NULL,
+              FOREIGN KEY(user_id) REFERENCES Users(user_id),
+              FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
+              UNIQUE(user_id, survey_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS SurveyGovernorate
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  survey_id INTEGER NOT NULL,
+                  governorate_id INTEGER NOT NULL,
+                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
+                  FOREIGN KEY(governorate_id) REFERENCES Governorates(governorate_id),
+                  UNIQUE(survey_id, governorate_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS AuditLog
+             (log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER NOT NULL,
+              action_type TEXT NOT NULL,
+              table_name TEXT NOT NULL,
+              record_id INTEGER,
+              old_value TEXT,
+              new_value TEXT,
+              action_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              FOREIGN KEY(user_id) REFERENCES Users(user_id))''')
+
+    # Add default admin user if none exists
+    c.execute("SELECT COUNT(*) FROM Users WHERE role='admin'")
+    if c.fetchone()[0] == 0:
+        from auth import hash_password
+        admin_password = hash_password("admin123")
+        c.execute("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, ?)",
+                  ("admin", admin_password, "admin"))
+
+
+def _create_query_indexes(c: sqlite3.Cursor):
+    """فهارس مسارات الاستعلام الأكثر استخداماً"""
+    # إجابات الاستبيان مرتبة بالتاريخ (يغطي أعمدة جدول العرض)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_responses_survey_date
+                 ON Responses(survey_id, submission_date, is_completed, user_id, region_id)''')
+    # إجابات المستخدم لاستبيان معين (التحقق اليومي وعرض الموظف)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_responses_user_survey_date
+                 ON Responses(user_id, survey_id, submission_date)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_responses_region
+                 ON Responses(region_id, survey_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_response_details_response_field
+                 ON Response_Details(response_id, field_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_response_details_field
+                 ON Response_Details(field_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_survey_fields_survey_order
+                 ON Survey_Fields(survey_id, field_order)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_users_region_role
+                 ON Users(assigned_region, role, username)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_health_admins_governorate
+                 ON HealthAdministrations(governorate_id, admin_name)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_survey_governorate_governorate
+                 ON SurveyGovernorate(governorate_id, survey_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_user_surveys_survey
+                 ON UserSurveys(survey_id, user_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp
+                 ON AuditLog(action_timestamp)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_audit_log_table_timestamp
+                 ON AuditLog(table_name, action_timestamp)''')
+
+
+def _rebuild_table(c: sqlite3.Cursor, table: str, create_sql: str):
+    """
+    إعادة بناء جدول بتعريف جديد مع الحفاظ على البيانات والفهارس وعداد AUTOINCREMENT
+    (SQLite لا يدعم تعديل المفاتيح الأجنبية مباشرة)
+    """
+    old_columns = [row[1] for row in c.execute(f"PRAGMA table_info({table})").fetchall()]
+    indexes = [row[0] for row in c.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()]
+    seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+
+    temp_table = f"{table}__new"
+    c.execute(f"DROP TABLE IF EXISTS {temp_table}")
+    c.execute(create_sql.format(table=temp_table))
+    new_columns = [row[1] for row in c.execute(f"PRAGMA table_info({temp_table})").fetchall()]
+    columns = ", ".join(col for col in new_columns if col in old_columns)
+    c.execute(f"INSERT INTO {temp_table} ({columns}) SELECT {columns} FROM {table}")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {temp_table} RENAME TO {table}")
+
+    for index_sql in indexes:
+        c.execute(index_sql)
+    if seq:
+        c.execute("UPDATE sqlite_sequence SET seq=? WHERE name=?", (seq[0], table))
+
+
+def _references_regions(c: sqlite3.Cursor, table: str) -> bool:
+    return any(row[2] == 'Regions' for row in c.execute(f"PRAGMA foreign_key_list({table})").fetchall())
+
+
+def _fix_region_foreign_keys(c: sqlite3.Cursor):
+    """ربط Users.assigned_region و Responses.region_id بجدول HealthAdministrations بدلاً من Regions غير الموجود"""
+    if _references_regions(c, 'Users'):
+        _rebuild_table(c, 'Users', '''CREATE TABLE {table}
+                 (user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  username TEXT UNIQUE NOT NULL,
+                  password_hash TEXT NOT NULL,
+                  role TEXT NOT NULL,
+                  assigned_region INTEGER,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  last_login TIMESTAMP,
+                  FOREIGN KEY(assigned_region) REFERENCES HealthAdministrations(admin_id))''')
+
+    if _references_regions(c, 'Responses'):
+        _rebuild_table(c, 'Responses', '''CREATE TABLE {table}
+                 (response_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  survey_id INTEGER NOT NULL,
+                  user_id INTEGER NOT NULL,
+                  region_id INTEGER NOT NULL,
+                  submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  is_completed BOOLEAN DEFAULT FALSE,
+                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
+                  FOREIGN KEY(user_id) REFERENCES Users(user_id),
+                  FOREIGN KEY(region_id) REFERENCES HealthAdministrations(admin_id))''')
+
+
+def _create_daily_completions(c: sqlite3.Cursor):
+    """
+    سجل الإكمال اليومي: صف واحد لكل (مستخدم، استبيان، يوم) مع قيد فريد
+    يحدث تلقائياً عبر triggers على جدول Responses، وأي محاولة لإكمال نفس
+    الاستبيان مرتين في نفس اليوم تفشل داخل قاعدة البيانات
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS DailyCompletions
+                 (user_id INTEGER NOT NULL,
+                  survey_id INTEGER NOT NULL,
+                  completion_day TEXT NOT NULL,
+                  response_id INTEGER NOT NULL,
+                  PRIMARY KEY(user_id, survey_id, completion_day),
+                  FOREIGN KEY(response_id) REFERENCES Responses(response_id)) WITHOUT ROWID''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_daily_completions_response
+                 ON DailyCompletions(response_id)''')
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_completed_insert
+                 AFTER INSERT ON Responses
+                 WHEN NEW.is_completed
+                 BEGIN
+                     INSERT INTO DailyCompletions (user_id, survey_id, completion_day, response_id)
+                     VALUES (NEW.user_id, NEW.survey_id, DATE(NEW.submission_date), NEW.response_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_completed_update
+                 AFTER UPDATE OF is_completed ON Responses
+                 WHEN NEW.is_completed AND NOT OLD.is_completed
+                 BEGIN
+                     INSERT INTO DailyCompletions (user_id, survey_id, completion_day, response_id)
+                     VALUES (NEW.user_id, NEW.survey_id, DATE(NEW.submission_date), NEW.response_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_uncompleted_update
+                 AFTER UPDATE OF is_completed ON Responses
+                 WHEN OLD.is_completed AND NOT NEW.is_completed
+                 BEGIN
+                     DELETE FROM DailyCompletions WHERE response_id = OLD.response_id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_completed_delete
+                 AFTER DELETE ON Responses
+                 WHEN OLD.is_completed
+                 BEGIN
+                     DELETE FROM DailyCompletions WHERE response_id = OLD.response_id;
+                 END''')
+
+    # تعبئة السجل من الإجابات المكتملة الموجودة (أول إكمال في كل يوم)
+    c.execute('''INSERT OR IGNORE INTO DailyCompletions (user_id, survey_id, completion_day, response_id)
+                 SELECT user_id, survey_id, DATE(submission_date), MIN(response_id)
+                 FROM Responses
+                 WHERE is_completed
+                 GROUP BY user_id, survey_id, DATE(submission_date)''')
+
+
+def _create_sheet_sync(c: sqlite3.Cursor):
+    """
+    حالة المزامنة التزايدية مع Google Sheets:
+    - GoogleSheetSync: آخر response_id وآخر تغيير تم تصديره لكل (استبيان، ملف)
+    - ResponseChanges: سجل الإجابات التي عدلت بعد إرسالها (يحدث عبر triggers)
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS GoogleSheetSync
+                 (survey_id INTEGER NOT NULL,
+                  spreadsheet_name TEXT NOT NULL,
+                  worksheet_title TEXT NOT NULL,
+                  header_hash TEXT NOT NULL,
+                  last_response_id INTEGER NOT NULL DEFAULT 0,
+                  last_change_id INTEGER NOT NULL DEFAULT 0,
+                  last_synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  PRIMARY KEY(survey_id, spreadsheet_name),
+                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS ResponseChanges
+                 (change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  response_id INTEGER NOT NULL,
+                  changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+    # إدخال التفاصيل عند الإرسال لا يسجل؛ فقط التعديلات اللاحقة
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_response_details_changed_update
+                 AFTER UPDATE OF answer_value ON Response_Details
+                 WHEN NEW.answer_value IS NOT OLD.answer_value
+                 BEGIN
+                     INSERT INTO ResponseChanges (response_id) VALUES (NEW.response_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_response_details_changed_delete
+                 AFTER DELETE ON Response_Details
+                 BEGIN
+                     INSERT INTO ResponseChanges (response_id) VALUES (OLD.response_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_changed_update
+                 AFTER UPDATE ON Responses
+                 BEGIN
+                     INSERT INTO ResponseChanges (response_id) VALUES (NEW.response_id);
+                 END''')
+
+
+def _add_sheet_sync_scope(c: sqlite3.Cursor):
+    """حالة مزامنة مستقلة لكل نطاق تصدير (المحافظة، الإدارة، الفترة، المكتملة فقط)"""
+    # بقايا محاولة سابقة لم تكتمل
+    c.execute("DROP TABLE IF EXISTS GoogleSheetSync_new")
+    c.execute('''CREATE TABLE GoogleSheetSync_new
+                 (survey_id INTEGER NOT NULL,
+                  spreadsheet_name TEXT NOT NULL,
+                  scope_key TEXT NOT NULL DEFAULT '',
+                  worksheet_title TEXT NOT NULL,
+                  header_hash TEXT NOT NULL,
+                  last_response_id INTEGER NOT NULL DEFAULT 0,
+                  last_change_id INTEGER NOT NULL DEFAULT 0,
+                  last_synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  PRIMARY KEY(survey_id, spreadsheet_name, scope_key),
+                  FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id))''')
+    c.execute('''INSERT INTO GoogleSheetSync_new
+                 (survey_id, spreadsheet_name, worksheet_title, header_hash,
+                  last_response_id, last_change_id, last_synced_at)
+                 SELECT survey_id, spreadsheet_name, worksheet_title, header_hash,
+                        last_response_id, last_change_id, last_synced_at
+                 FROM GoogleSheetSync''')
+    c.execute("DROP TABLE GoogleSheetSync")
+    c.execute("ALTER TABLE GoogleSheetSync_new RENAME TO GoogleSheetSync")
+
+
+def _create_keyset_indexes(c: sqlite3.Cursor):
+    """
+    فهارس تصفح الإجابات بـ keyset على (submission_date, response_id):
+    response_id هو rowid فيأتي ضمنياً بعد آخر عمود في الفهرس فيغطي الترتيب كاملاً
+    """
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_responses_survey_keyset
+                 ON Responses(survey_id, submission_date)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_responses_region_survey_date
+                 ON Responses(region_id, survey_id, submission_date)''')
+    # أصبح جزءاً من الفهرس السابق
+    c.execute("DROP INDEX IF EXISTS idx_responses_region")
+
+
+def backfill_submission_rollup(c: sqlite3.Cursor):
+    """إعادة بناء SubmissionRollup بالكامل من جدول Responses"""
+    c.execute("DELETE FROM SubmissionRollup")
+    c.execute('''INSERT INTO SubmissionRollup
+                     (survey_id, day, admin_id, governorate_id, drafts, completed)
+                 SELECT r.survey_id, DATE(r.submission_date), r.region_id, h.governorate_id,
+                        SUM(CASE WHEN r.is_completed THEN 0 ELSE 1 END),
+                        SUM(CASE WHEN r.is_completed THEN 1 ELSE 0 END)
+                 FROM Responses r
+                 LEFT JOIN HealthAdministrations h ON r.region_id = h.admin_id
+                 GROUP BY r.survey_id, DATE(r.submission_date), r.region_id''')
+
+
+def _create_submission_rollup(c: sqlite3.Cursor):
+    """
+    تجميع مسبق لعدد المسودات والإجابات المكتملة لكل (استبيان، يوم، إدارة صحية)
+    مع المحافظة، يحدث عبر triggers على Responses فتقرأ لوحات التحكم منه مباشرة
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS SubmissionRollup
+                 (survey_id INTEGER NOT NULL,
+                  day TEXT NOT NULL,
+                  admin_id INTEGER NOT NULL,
+                  governorate_id INTEGER,
+                  drafts INTEGER NOT NULL DEFAULT 0,
+                  completed INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY(survey_id, day, admin_id)) WITHOUT ROWID''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_submission_rollup_governorate
+                 ON SubmissionRollup(survey_id, governorate_id, day)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_submission_rollup_admin
+                 ON SubmissionRollup(admin_id, survey_id, day)''')
+
+    add_new = '''
+                     INSERT INTO SubmissionRollup (survey_id, day, admin_id, governorate_id, drafts, completed)
+                     VALUES (NEW.survey_id, DATE(NEW.submission_date), NEW.region_id,
+                             (SELECT governorate_id FROM HealthAdministrations WHERE admin_id = NEW.region_id),
+                             CASE WHEN NEW.is_completed THEN 0 ELSE 1 END,
+                             CASE WHEN NEW.is_completed THEN 1 ELSE 0 END)
+                     ON CONFLICT(survey_id, day, admin_id) DO UPDATE SET
+                         drafts = drafts + excluded.drafts,
+                         completed = completed + excluded.completed;'''
+    remove_old = '''
+                     UPDATE SubmissionRollup
+                     SET drafts = drafts - CASE WHEN OLD.is_completed THEN 0 ELSE 1 END,
+                         completed = completed - CASE WHEN OLD.is_completed THEN 1 ELSE 0 END
+                     WHERE survey_id = OLD.survey_id
+                       AND day = DATE(OLD.submission_date)
+                       AND admin_id = OLD.region_id;
+                     DELETE FROM SubmissionRollup
+                     WHERE survey_id = OLD.survey_id
+                       AND day = DATE(OLD.submission_date)
+                       AND admin_id = OLD.region_id
+                       AND drafts <= 0 AND completed <= 0;'''
+
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_responses_insert
+                  AFTER INSERT ON Responses
+                  BEGIN{add_new}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_responses_update
+                  AFTER UPDATE OF survey_id, region_id, submission_date, is_completed ON Responses
+                  BEGIN{remove_old}{add_new}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_responses_delete
+                  AFTER DELETE ON Responses
+                  BEGIN{remove_old}
+                  END''')
+    # نقل إدارة صحية إلى محافظة أخرى
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_rollup_health_admin_governorate
+                 AFTER UPDATE OF governorate_id ON HealthAdministrations
+                 BEGIN
+                     UPDATE SubmissionRollup SET governorate_id = NEW.governorate_id
+                     WHERE admin_id = NEW.admin_id;
+                 END''')
+
+    backfill_submission_rollup(c)
+
+
+TYPED_FIELD_TYPES = ('number', 'date', 'checkbox')
+
+
+def _strict_number(value: str) -> str:
+    """
+    تعبير SQL يحول النص إلى رقم فقط إذا كان بالصيغة الكاملة [+-]أرقام[.أرقام][e[+-]أرقام]
+    (CAST وحده يقبل أي بادئة رقمية مثل '1-2' أو '1e')؛ يطابق typed_answer_values في database.py
+    """
+    return f'''(SELECT CASE WHEN m NOT IN ('', '.') AND m NOT GLOB '*[^0-9.]*' AND m NOT GLOB '*.*.*'
+                                   AND (x IS NULL OR (x <> '' AND x NOT GLOB '*[^0-9]*'))
+                              THEN CAST(t AS REAL) END
+                 FROM (SELECT t,
+                              CASE WHEN e > 0 THEN substr(s, 1, e - 1) ELSE s END AS m,
+                              CASE WHEN e > 0 THEN
+                                  CASE WHEN substr(s, e + 1, 1) IN ('+', '-') THEN substr(s, e + 2)
+                                       ELSE substr(s, e + 1) END
+                              END AS x
+                       FROM (SELECT t, s, instr(lower(s), 'e') AS e
+                             FROM (SELECT t, CASE WHEN substr(t, 1, 1) IN ('+', '-') THEN substr(t, 2)
+                                                  ELSE t END AS s
+                                   FROM (SELECT trim({value}) AS t)))))'''
+
+
+def _typed_answer_assignments(value: str, field_type: str) -> str:
+    """
+    تعبير SET لتحويل answer_value النصي إلى الأعمدة المكتوبة حسب نوع الحقل
+    (القيم غير الصالحة تبقى NULL في العمود المكتوب)
+    """
+    return f'''
+        answer_number = CASE WHEN {field_type} = 'number' THEN {_strict_number(value)} END,
+        answer_date = CASE WHEN {field_type} = 'date'
+                            AND trim({value}) GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+                            AND DATE(trim({value}), '+0 days') = trim({value})
+                           THEN trim({value}) END,
+        answer_bool = CASE WHEN {field_type} = 'checkbox' THEN
+                          CASE lower(trim({value}))
+                              WHEN 'true' THEN 1 WHEN '1' THEN 1
+                              WHEN 'false' THEN 0 WHEN '0' THEN 0
+                          END
+                      END'''
+
+
+def _create_typed_answer_triggers(c: sqlite3.Cursor):
+    """
+    triggers الأعمدة المكتوبة لمسارات الكتابة التي لا تحسبها بنفسها
+    (submit_survey_response يكتبها مباشرة مع الإدخال فلا يحدث الإدخال صفه مرة ثانية)
+    """
+    field_type = "(SELECT field_type FROM Survey_Fields WHERE field_id = NEW.field_id)"
+    typed_types = ", ".join(f"'{t}'" for t in TYPED_FIELD_TYPES)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_response_details_typed_insert
+                  AFTER INSERT ON Response_Details
+                  WHEN NEW.answer_value IS NOT NULL AND NEW.answer_number IS NULL
+                   AND NEW.answer_date IS NULL AND NEW.answer_bool IS NULL
+                   AND {field_type} IN ({typed_types})
+                  BEGIN
+                      UPDATE Response_Details
+                      SET {_typed_answer_assignments("NEW.answer_value", field_type)}
+                      WHERE detail_id = NEW.detail_id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_response_details_typed_update
+                  AFTER UPDATE OF answer_value ON Response_Details
+                  WHEN NEW.answer_value IS NOT OLD.answer_value
+                  BEGIN
+                      UPDATE Response_Details
+                      SET {_typed_answer_assignments("NEW.answer_value", field_type)}
+                      WHERE detail_id = NEW.detail_id;
+                  END''')
+    # تغيير نوع الحقل يعيد تحويل إجاباته المحفوظة
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_survey_fields_typed_update
+                  AFTER UPDATE OF field_type ON Survey_Fields
+                  WHEN NEW.field_type IS NOT OLD.field_type
+                  BEGIN
+                      UPDATE Response_Details
+                      SET {_typed_answer_assignments("answer_value", "NEW.field_type")}
+                      WHERE field_id = NEW.field_id;
+                  END''')
+
+
+def _backfill_typed_answers(c: sqlite3.Cursor):
+    """إعادة تحويل الإجابات الموجودة لحقول الأنواع المكتوبة"""
+    typed_types = ", ".join(f"'{t}'" for t in TYPED_FIELD_TYPES)
+    c.execute(f'''UPDATE Response_Details
+                  SET {_typed_answer_assignments(
+                      "answer_value",
+                      "(SELECT field_type FROM Survey_Fields sf WHERE sf.field_id = Response_Details.field_id)")}
+                  WHERE field_id IN (SELECT field_id FROM Survey_Fields
+                                     WHERE field_type IN ({typed_types}))''')
+
+
+def _add_typed_answer_columns(c: sqlite3.Cursor):
+    """
+    أعمدة مكتوبة للإجابات (رقم، تاريخ، منطقي) بجانب answer_value
+    يكتبها الإرسال مباشرة، وتملأ عبر triggers حسب Survey_Fields.field_type لباقي مسارات الكتابة
+    فتنفذ استعلامات النطاق والتجميع في SQL باستخدام الفهارس
+    """
+    columns = {row[1] for row in c.execute("PRAGMA table_info(Response_Details)")}
+    for column, sql_type in (("answer_number", "REAL"), ("answer_date", "TEXT"), ("answer_bool", "INTEGER")):
+        if column not in columns:
+            c.execute(f"ALTER TABLE Response_Details ADD COLUMN {column} {sql_type}")
+
+    _create_typed_answer_triggers(c)
+
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_response_details_number
+                 ON Response_Details(field_id, answer_number, response_id)
+                 WHERE answer_number IS NOT NULL''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_response_details_date
+                 ON Response_Details(field_id, answer_date, response_id)
+                 WHERE answer_date IS NOT NULL''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_response_details_bool
+                 ON Response_Details(field_id, answer_bool, response_id)
+                 WHERE answer_bool IS NOT NULL''')
+
+    # تحويل الإجابات الموجودة
+    _backfill_typed_answers(c)
+
+
+# triggers وضع المستندات؛ وجودها يعني أن الوضع مفعل
+ANSWER_DOCUMENT_TRIGGERS = {
+    'trg_response_documents_insert': '''
+        AFTER INSERT ON Response_Details
+        BEGIN
+            INSERT INTO ResponseDocuments (response_id, answers)
+            VALUES (NEW.response_id, json_object(CAST(NEW.field_id AS TEXT), NEW.answer_value))
+            ON CONFLICT(response_id) DO UPDATE SET
+                answers = json_set(answers, '$."' || NEW.field_id || '"', NEW.answer_value);
+        END''',
+    'trg_response_documents_update': '''
+        AFTER UPDATE OF field_id, answer_value ON Response_Details
+        BEGIN
+            UPDATE ResponseDocuments
+            SET answers = json_remove(answers, '$."' || OLD.field_id || '"')
+            WHERE response_id = OLD.response_id;
+            INSERT INTO ResponseDocuments (response_id, answers)
+            VALUES (NEW.response_id, json_object(CAST(NEW.field_id AS TEXT), NEW.answer_value))
+            ON CONFLICT(response_id) DO UPDATE SET
+                answers = json_set(answers, '$."' || NEW.field_id || '"', NEW.answer_value);
+        END''',
+    'trg_response_documents_delete': '''
+        AFTER DELETE ON Response_Details
+        BEGIN
+            UPDATE ResponseDocuments
+            SET answers = json_remove(answers, '$."' || OLD.field_id || '"')
+            WHERE response_id = OLD.response_id;
+        END''',
+    'trg_response_documents_response_delete': '''
+        AFTER DELETE ON Responses
+        BEGIN
+            DELETE FROM ResponseDocuments WHERE response_id = OLD.response_id;
+        END''',
+}
+
+
+def backfill_answer_documents(c: sqlite3.Cursor, response_ids: Optional[List[int]] = None):
+    """إعادة بناء مستندات الإجابات من Response_Details (كلها أو إجابات محددة)"""
+    if response_ids is None:
+        c.execute("DELETE FROM ResponseDocuments")
+        where, params = "", []
+    else:
+        ids = json.dumps(list(response_ids))
+        c.execute("DELETE FROM ResponseDocuments WHERE response_id IN (SELECT value FROM json_each(?))", (ids,))
+        where, params = "WHERE response_id IN (SELECT value FROM json_each(?))", [ids]
+    c.execute(f'''INSERT INTO ResponseDocuments (response_id, answers)
+                  SELECT response_id, json_group_object(CAST(field_id AS TEXT), answer_value)
+                  FROM (SELECT response_id, field_id, answer_value
+                        FROM Response_Details {where}
+                        ORDER BY response_id, detail_id)
+                  GROUP BY response_id''', params)
+
+
+def set_answer_document_triggers(c: sqlite3.Cursor, enabled: bool):
+    """تفعيل وضع المستندات (إنشاء triggers وإعادة البناء) أو إيقافه (حذفها وتفريغ الجدول)"""
+    for name, body in ANSWER_DOCUMENT_TRIGGERS.items():
+        if enabled:
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        else:
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+    if enabled:
+        backfill_answer_documents(c)
+    else:
+        c.execute("DELETE FROM ResponseDocuments")
+
+
+def _create_response_documents(c: sqlite3.Cursor):
+    """
+    مستند مضغوط لكل إجابة (JSON بمفتاح field_id) بجانب جدول Response_Details
+    يملأ فقط عند تفعيل الوضع عبر set_answer_document_triggers
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS ResponseDocuments
+                 (response_id INTEGER PRIMARY KEY,
+                  answers TEXT NOT NULL DEFAULT '{}')''')
+
+
+def _add_response_version(c: sqlite3.Cursor):
+    """رقم إصدار لكل إجابة يزداد مع كل تعديل (للتحقق التفاؤلي من التعارض عند التعديل)"""
+    columns = {row[1] for row in c.execute("PRAGMA table_info(Responses)")}
+    if "version" not in columns:
+        c.execute("ALTER TABLE Responses ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def _audit_search_text(value: str) -> str:
+    """نص قابل للبحث من قيمة JSON (المفاتيح والقيم بعد فك ترميز \\uXXXX)"""
+    return f'''CASE WHEN json_valid({value}) THEN
+                   (SELECT group_concat(COALESCE(j.key, '') || ' ' || j.value, ' ')
+                    FROM json_tree({value}) j WHERE j.atom IS NOT NULL)
+               ELSE {value} END'''
+
+
+def backfill_audit_search(c: sqlite3.Cursor):
+    """إعادة بناء فهرس البحث النصي لسجل التعديلات"""
+    c.execute("DELETE FROM AuditLogSearch")
+    c.execute(f'''INSERT INTO AuditLogSearch
+                      (rowid, username, table_name, action_type, old_value, new_value)
+                  SELECT a.log_id, u.username, a.table_name, a.action_type,
+                         {_audit_search_text("a.old_value")}, {_audit_search_text("a.new_value")}
+                  FROM AuditLog a
+                  LEFT JOIN Users u ON u.user_id = a.user_id''')
+
+
+def _create_audit_search(c: sqlite3.Cursor):
+    """
+    فهرس بحث نصي FTS5 لسجل التعديلات (اسم المستخدم، الجدول، الإجراء، القيم)
+    يحدث عبر triggers؛ إذا لم تكن FTS5 متاحة يبقى البحث عبر LIKE
+    """
+    try:
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS AuditLogSearch USING fts5
+                     (username, table_name, action_type, old_value, new_value, prefix='2 3')''')
+    except sqlite3.OperationalError:
+        return
+
+    insert_new = f'''
+                     INSERT INTO AuditLogSearch (rowid, username, table_name, action_type, old_value, new_value)
+                     VALUES (NEW.log_id,
+                             (SELECT username FROM Users WHERE user_id = NEW.user_id),
+                             NEW.table_name, NEW.action_type,
+                             {_audit_search_text("NEW.old_value")}, {_audit_search_text("NEW.new_value")});'''
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_audit_search_insert
+                  AFTER INSERT ON AuditLog
+                  BEGIN{insert_new}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_audit_search_update
+                  AFTER UPDATE ON AuditLog
+                  BEGIN
+                      DELETE FROM AuditLogSearch WHERE rowid = OLD.log_id;{insert_new}
+                  END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_audit_search_delete
+                 AFTER DELETE ON AuditLog
+                 BEGIN
+                     DELETE FROM AuditLogSearch WHERE rowid = OLD.log_id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_audit_search_username
+                 AFTER UPDATE OF username ON Users
+                 WHEN NEW.username IS NOT OLD.username
+                 BEGIN
+                     UPDATE AuditLogSearch SET username = NEW.username
+                     WHERE rowid IN (SELECT log_id FROM AuditLog WHERE user_id = NEW.user_id);
+                 END''')
+    backfill_audit_search(c)
+
+
+def _create_audit_archives(c: sqlite3.Cursor):
+    """فهرس ملفات أرشيف سجل التعديلات (ملف JSONL مضغوط لكل شهر)"""
+    c.execute('''CREATE TABLE IF NOT EXISTS AuditArchives
+                 (month TEXT PRIMARY KEY,
+                  file_name TEXT NOT NULL,
+                  row_count INTEGER NOT NULL,
+                  first_log_id INTEGER NOT NULL,
+                  last_log_id INTEGER NOT NULL,
+                  first_timestamp TEXT NOT NULL,
+                  last_timestamp TEXT NOT NULL,
+                  archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+
+# جدول مؤقت بصف واحد لكل اتصال يحمل المستخدم المنفذ (NULL لإيقاف التسجيل)
+AUDIT_CONTEXT_TABLE = "AuditContext"
+
+# الجداول المراقبة تلقائياً: (المفتاح، الأعمدة المسجلة، العمليات)
+# إدخال Response_Details غير مسجل لأن الإجابة نفسها مسجلة عند إنشائها في Responses
+AUDITED_TABLES = {
+    "Users": ("user_id", ("username", "password_hash", "role", "assigned_region"),
+              ("INSERT", "UPDATE", "DELETE")),
+    "Surveys": ("survey_id", ("survey_name", "created_by", "is_active"),
+                ("INSERT", "UPDATE", "DELETE")),
+    "Survey_Fields": ("field_id", ("survey_id", "field_type", "field_label", "field_options",
+                                   "is_required", "field_order"),
+                      ("INSERT", "UPDATE", "DELETE")),
+    "Responses": ("response_id", ("survey_id", "user_id", "region_id", "submission_date", "is_completed"),
+                  ("INSERT", "UPDATE", "DELETE")),
+    "Response_Details": ("detail_id", ("response_id", "field_id", "answer_value"),
+                         ("UPDATE", "DELETE")),
+    "UserSurveys": ("id", ("user_id", "survey_id"), ("INSERT", "UPDATE", "DELETE")),
+    "SurveyGovernorate": ("id", ("survey_id", "governorate_id"), ("INSERT", "UPDATE", "DELETE")),
+}
+
+# أعمدة يسجل تغييرها فقط دون قيمتها
+MASKED_AUDIT_COLUMNS = frozenset({"password_hash"})
+
+
+def _audit_value(row: str, column: str) -> str:
+    return "'***'" if column in MASKED_AUDIT_COLUMNS else f"{row}.{column}"
+
+
+def _audit_snapshot(row: str, columns: Tuple[str, ...]) -> str:
+    """كائن JSON بكل الأعمدة المسجلة للصف"""
+    return "json_object(" + ", ".join(f"'{col}', {_audit_value(row, col)}" for col in columns) + ")"
+
+
+def _audit_diff(row: str, columns: Tuple[str, ...]) -> str:
+    """كائن JSON بالأعمدة التي تغيرت فقط بين OLD و NEW"""
+    rows = " UNION ALL ".join(
+        f"SELECT '{col}' AS name, {_audit_value(row, col)} AS value WHERE OLD.{col} IS NOT NEW.{col}"
+        for col in columns
+    )
+    return f"(SELECT json_group_object(name, value) FROM ({rows}))"
+
+
+def connection_audit_statements() -> List[str]:
+    """
+    أوامر تسجيل التعديلات التلقائي لاتصال واحد: جدول AuditContext وtriggers مؤقتة (TEMP)
+    تكتب في AuditLog داخل نفس المعاملة؛ التحديث يسجل الأعمدة المتغيرة فقط،
+    والإدخال/الحذف يسجل الصف كاملاً
+    الـ triggers المؤقتة خاصة بالاتصال الذي أنشأها، فأدوات مثل sqlite3 أو النسخ
+    الاحتياطي تكتب في قاعدة البيانات دون أي اعتماد على التطبيق
+    """
+    actor = f"(SELECT user_id FROM temp.{AUDIT_CONTEXT_TABLE})"
+    statements = [
+        f"CREATE TEMP TABLE IF NOT EXISTS {AUDIT_CONTEXT_TABLE} (user_id INTEGER)",
+        f'''INSERT INTO temp.{AUDIT_CONTEXT_TABLE} (user_id)
+            SELECT NULL WHERE NOT EXISTS (SELECT 1 FROM temp.{AUDIT_CONTEXT_TABLE})''',
+    ]
+    for table, (key, columns, operations) in AUDITED_TABLES.items():
+        for operation in operations:
+            if operation == "INSERT":
+                event, row, old, new = "INSERT", "NEW", "NULL", _audit_snapshot("NEW", columns)
+                condition = ""
+            elif operation == "DELETE":
+                event, row, old, new = "DELETE", "OLD", _audit_snapshot("OLD", columns), "NULL"
+                condition = ""
+            else:
+                event = f"UPDATE OF {', '.join(columns)}"
+                row, old, new = "NEW", _audit_diff("OLD", columns), _audit_diff("NEW", columns)
+                condition = " AND (" + " OR ".join(f"OLD.{col} IS NOT NEW.{col}" for col in columns) + ")"
+            statements.append(f'''CREATE TEMP TRIGGER IF NOT EXISTS trg_audit_{table.lower()}_{operation.lower()}
+                                 AFTER {event} ON main.{table}
+                                 WHEN {actor} IS NOT NULL{condition}
+                                 BEGIN
+                                     INSERT INTO AuditLog
+                                         (user_id, action_type, table_name, record_id, old_value, new_value)
+                                     VALUES ({actor}, '{operation}', '{table}', {row}.{key}, {old}, {new});
+                                 END''')
+    return statements
+
+
+def _refine_response_changes(c: sqlite3.Cursor):
+    """
+    تضييق سجل ResponseChanges على ما يظهر في ملفات Google Sheets:
+    - تعديل Responses يسجل فقط عند تغير الأعمدة المصدرة (لا رقم الإصدار مثلاً)
+    - حذف الإجابة يسجل حتى تحذف صفها من الورقة
+    - بدون أي مزامنة مهيأة لا يحتفظ بالسجل (يبقى sqlite_sequence مؤشراً للتغيير)
+    """
+    c.execute("DROP TRIGGER IF EXISTS trg_responses_changed_update")
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_changed_update
+                 AFTER UPDATE OF survey_id, user_id, region_id, submission_date, is_completed ON Responses
+                 WHEN NEW.survey_id IS NOT OLD.survey_id OR NEW.user_id IS NOT OLD.user_id
+                   OR NEW.region_id IS NOT OLD.region_id
+                   OR NEW.submission_date IS NOT OLD.submission_date
+                   OR NEW.is_completed IS NOT OLD.is_completed
+                 BEGIN
+                     INSERT INTO ResponseChanges (response_id) VALUES (NEW.response_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_responses_changed_delete
+                 AFTER DELETE ON Responses
+                 BEGIN
+                     INSERT INTO ResponseChanges (response_id) VALUES (OLD.response_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_response_changes_prune
+                 AFTER INSERT ON ResponseChanges
+                 WHEN NOT EXISTS (SELECT 1 FROM GoogleSheetSync)
+                 BEGIN
+                     DELETE FROM ResponseChanges WHERE change_id <= NEW.change_id;
+                 END''')
+    c.execute('''DELETE FROM ResponseChanges
+                 WHERE NOT EXISTS (SELECT 1 FROM GoogleSheetSync)
+                    OR change_id <= (SELECT MIN(last_change_id) FROM GoogleSheetSync)''')
+
+
+def _strict_typed_answers(c: sqlite3.Cursor):
+    """إعادة إنشاء triggers الأعمدة المكتوبة بتحويل صارم للأرقام والتواريخ وإعادة تحويل الإجابات"""
+    for trigger in ("trg_response_details_typed_insert", "trg_response_details_typed_update",
+                    "trg_survey_fields_typed_update"):
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _create_typed_answer_triggers(c)
+    _backfill_typed_answers(c)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "baseline_schema", _create_baseline_schema),
+    (2, "query_indexes", _create_query_indexes),
+    (3, "fix_region_foreign_keys", _fix_region_foreign_keys),
+    (4, "daily_completions", _create_daily_completions),
+    (5, "sheet_sync", _create_sheet_sync),
+    (6, "sheet_sync_scope", _add_sheet_sync_scope),
+    (7, "keyset_indexes", _create_keyset_indexes),
+    (8, "submission_rollup", _create_submission_rollup),
+    (9, "typed_answer_columns", _add_typed_answer_columns),
+    (10, "response_documents", _create_response_documents),
+    (11, "response_version", _add_response_version),
+    (12, "audit_search", _create_audit_search),
+    (13, "audit_archives", _create_audit_archives),
+    (14, "response_changes_scope", _refine_response_changes),
+    (15, "strict_typed_answers", _strict_typed_answers),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn) -> int:
+    """رقم إصدار المخطط المسجل في قاعدة البيانات"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn) -> List[int]:
+    """
+    تطبيق الترحيلات غير المنفذة بالترتيب، كل ترحيل في معاملة مستقلة
+    يعيد أرقام الترحيلات التي تم تطبيقها
+    """
+    applied = []
+    for version, name, apply in MIGRATIONS:
+        if get_schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # إعادة التحقق بعد أخذ القفل في حال قامت عملية أخرى بالترحيل
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            c = conn.cursor()
+            apply(c)
+            c.execute('''CREATE TABLE IF NOT EXISTS SchemaMigrations
+                         (version INTEGER PRIMARY KEY,
+                          name TEXT NOT NULL,
+                          applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            c.execute("INSERT OR REPLACE INTO SchemaMigrations (version, name) VALUES (?, ?)",
+                      (version, name))
+            c.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,73 @@
+import time
+from typing import Callable, List, Tuple
+
+import streamlit as st
+
+# عند التفعيل يتم تنفيذ القسم النشط فقط بدلاً من تنفيذ جميع التبويبات في كل تفاعل
+LAZY_NAVIGATION = True
+
+
+def _render_timed(key: str, label: str, render: Callable[[], None]):
+    """تنفيذ القسم وتسجيل زمن عرضه في الجلسة"""
+    start = time.perf_counter()
+    try:
+        render()
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        st.session_state.setdefault(f"{key}_section_timings", {})[label] = elapsed
+    st.caption(f"⏱️ زمن عرض القسم: {elapsed:.0f} مللي ثانية")
+
+
+def _keep_section_state(key: str, label: str):
+    """
+    إبقاء قيم أدوات قسم غير نشط: Streamlit يحذف حالة الأدوات غير المعروضة في نهاية
+    التشغيل، وإعادة تعيين مفاتيحها تحولها إلى حالة جلسة عادية تستخدمها الأدوات عند عودة القسم
+    """
+    for name in st.session_state.get(f"{key}_{label}_state", ()):
+        if name in st.session_state:
+            st.session_state[name] = st.session_state[name]
+
+
+def _render_tracked(key: str, label: str, render: Callable[[], None]):
+    """تنفيذ القسم النشط مع تسجيل مفاتيح الجلسة التي أنشأها ضمن حالته"""
+    before = set(st.session_state.keys())
+    try:
+        _render_timed(key, label, render)
+    finally:
+        owned = st.session_state.setdefault(f"{key}_{label}_state", set())
+        owned.update(set(st.session_state.keys()) - before - {f"{key}_section_timings", f"{key}_{label}_state"})
+
+
+def render_sections(sections: List[Tuple[str, Callable[[], None]]], key: str,
+                    lazy: bool = LAZY_NAVIGATION):
+    """
+    عرض أقسام لوحة التحكم
+    - lazy: شريط تنقل يحفظ القسم المختار في الجلسة ولا ينفذ إلا القسم النشط،
+      مع إبقاء حالة أدوات الأقسام الأخرى (الفلاتر، الاختيارات، الصفحات) حتى العودة إليها
+    - غير ذلك: تبويبات st.tabs مع تنفيذ جميع الأقسام
+    """
+    labels = [label for label, _ in sections]
+
+    if not lazy:
+        for tab, (label, render) in zip(st.tabs(labels), sections):
+            with tab:
+                _render_timed(key, label, render)
+        return
+
+    active = st.radio(
+        "القسم",
+        labels,
+        horizontal=True,
+        key=f"{key}_active_section",
+        label_visibility="collapsed"
+    )
+    st.divider()
+    for label in labels:
+        if label != active:
+            _keep_section_state(key, label)
+    _render_tracked(key, active, dict(sections)[active])
+
+
+def get_section_timings(key: str) -> dict:
+    """آخر زمن عرض (بالمللي ثانية) لكل قسم في لوحة التحكم"""
+    return dict(st.session_state.get(f"{key}_section_timings", {}))
@@ -0,0 +1,194 @@
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from database import get_connection, get_reference_data
+from exports import ExportScope
+
+PAGE_SIZE = 50
+
+BROWSER_COLUMNS = ["ID", "المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
+
+# (response_id, username, admin_name, governorate_name, submission_date, is_completed)
+_RESPONSES_SELECT = '''
+    SELECT r.response_id, u.username, h.admin_name, g.governorate_name,
+           r.submission_date, r.is_completed
+    FROM Responses r
+    JOIN Users u ON r.user_id = u.user_id
+    JOIN HealthAdministrations h ON r.region_id = h.admin_id
+    JOIN Governorates g ON h.governorate_id = g.governorate_id
+'''
+
+
+class ResponseFilter(NamedTuple):
+    """مرشحات قائمة الإجابات (تطبق داخل استعلام SQL)"""
+    scope: ExportScope = ExportScope()
+    user_id: Optional[int] = None
+    username: Optional[str] = None     # بداية اسم المستخدم
+    status: Optional[bool] = None      # True مكتملة، False مسودة، None الكل
+
+
+def _filter_sql(survey_id: int, flt: ResponseFilter) -> Tuple[List[str], list]:
+    conditions, params = flt.scope.conditions()
+    conditions.insert(0, "r.survey_id = ?")
+    params.insert(0, survey_id)
+    if flt.user_id is not None:
+        conditions.append("r.user_id = ?")
+        params.append(flt.user_id)
+    if flt.username:
+        escaped = flt.username.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append("u.username LIKE ? ESCAPE '\\'")
+        params.append(escaped + "%")
+    if flt.status is not None:
+        conditions.append("r.is_completed" if flt.status else "NOT r.is_completed")
+    return conditions, params
+
+
+def fetch_response_page(survey_id: int, flt: ResponseFilter = ResponseFilter(),
+                        cursor: Optional[Tuple[str, int]] = None,
+                        page_size: int = PAGE_SIZE) -> Tuple[List[Tuple], bool]:
+    """
+    صفحة من الإجابات مرتبة من الأحدث باستخدام keyset على (submission_date, response_id)
+    cursor: (submission_date, response_id) لآخر صف في الصفحة السابقة
+    يعيد (الصفوف، هل توجد صفحة تالية)
+    """
+    conditions, params = _filter_sql(survey_id, flt)
+    if cursor is not None:
+        conditions.append("(r.submission_date, r.response_id) < (?, ?)")
+        params.extend(cursor)
+
+    conn = get_connection()
+    try:
+        rows = conn.execute(f'''
+            {_RESPONSES_SELECT}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY r.submission_date DESC, r.response_id DESC
+            LIMIT ?
+        ''', params + [page_size + 1]).fetchall()
+    finally:
+        conn.close()
+    return rows[:page_size], len(rows) > page_size
+
+
+def find_response(survey_id: int, response_id: int,
+                  flt: ResponseFilter = ResponseFilter()) -> Optional[Tuple]:
+    """البحث عن إجابة برقمها ضمن نطاق المرشحات (None إذا كانت خارج النطاق)"""
+    conditions, params = _filter_sql(survey_id, flt)
+    conn = get_connection()
+    try:
+        return conn.execute(f'''
+            {_RESPONSES_SELECT}
+            WHERE r.response_id = ? AND {" AND ".join(conditions)}
+        ''', [response_id] + params).fetchone()
+    finally:
+        conn.close()
+
+
+def _render_filters(key: str, base: ResponseFilter, filters: Sequence[str]) -> ResponseFilter:
+    """عناصر التصفية المطلوبة؛ قيود base (المحافظة/المستخدم) تبقى مفروضة دائماً"""
+    ref = get_reference_data()
+    scope = base.scope
+    governorate_id, admin_id = scope.governorate_id, scope.admin_id
+    date_from, date_to = scope.date_from, scope.date_to
+    username, status = base.username, base.status
+
+    with st.expander("🔎 تصفية الإجابات"):
+        col1, col2 = st.columns(2)
+        with col1:
+            if 'governorate' in filters and base.scope.governorate_id is None:
+                governorate_id = st.selectbox(
+                    "المحافظة",
+                    [None] + [g[0] for g in ref.governorates],
+                    format_func=lambda x: "الكل" if x is None else ref.governorate_names[x],
+                    key=f"{key}_governorate"
+                )
+            if 'region' in filters and base.scope.admin_id is None:
+                if governorate_id is None:
+                    admins = [(a[0], a[1]) for a in ref.health_admins]
+                else:
+                    admins = ref.health_admins_by_governorate.get(governorate_id, [])
+                admin_id = st.selectbox(
+                    "الإدارة الصحية",
+                    [None] + [a[0] for a in admins],
+                    format_func=lambda x: "الكل" if x is None else ref.health_admin_names[x],
+                    key=f"{key}_admin"
+                )
+            if 'user' in filters:
+                username = st.text_input("اسم المستخدم (يبدأ بـ)", key=f"{key}_username").strip() or None
+        with col2:
+            if 'status' in filters:
+                status = st.selectbox(
+                    "الحالة",
+                    [None, True, False],
+                    format_func=lambda x: "الكل" if x is None else ("مكتملة" if x else "مسودة"),
+                    key=f"{key}_status"
+                )
+            if 'date' in filters:
+                date_from = st.date_input("من تاريخ", value=None, key=f"{key}_date_from")
+                date_to = st.date_input("إلى تاريخ", value=None, key=f"{key}_date_to")
+
+    return base._replace(
+        scope=scope._replace(governorate_id=governorate_id, admin_id=admin_id,
+                             date_from=date_from, date_to=date_to),
+        username=username,
+        status=status
+    )
+
+
+def show_response_browser(survey_id: int, key: str,
+                          base: ResponseFilter = ResponseFilter(),
+                          filters: Sequence[str] = ('governorate', 'region', 'user', 'status', 'date'),
+                          columns: Sequence[str] = BROWSER_COLUMNS,
+                          page_size: int = PAGE_SIZE) -> Optional[int]:
+    """
+    قائمة إجابات مقسمة إلى صفحات مع مرشحات وبحث برقم الإجابة
+    base: القيود المفروضة على العرض (محافظة المسؤول أو إجابات الموظف)
+    يعيد رقم الإجابة المختارة
+    """
+    flt = _render_filters(key, base, filters)
+
+    # العودة للصفحة الأولى عند تغيير المرشحات
+    pages_key = f"{key}_pages"
+    if st.session_state.get(f"{key}_filter") != (survey_id, flt):
+        st.session_state[f"{key}_filter"] = (survey_id, flt)
+        st.session_state[pages_key] = [None]
+    cursors = st.session_state[pages_key]
+
+    rows, has_next = fetch_response_page(survey_id, flt, cursors[-1], page_size)
+    if not rows:
+        st.info("لا توجد إجابات مطابقة")
+    else:
+        df = pd.DataFrame(
+            [(r[0], r[1], r[2], r[3], r[4], "مكتملة" if r[5] else "مسودة") for r in rows],
+            columns=BROWSER_COLUMNS
+        )
+        st.dataframe(df[list(columns)], use_container_width=True, hide_index=True)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        st.button("⬅️ السابق", key=f"{key}_prev", disabled=len(cursors) == 1,
+                  on_click=cursors.pop)
+    with col2:
+        st.caption(f"الصفحة {len(cursors)}")
+    with col3:
+        st.button("التالي ➡️", key=f"{key}_next", disabled=not has_next,
+                  on_click=cursors.append, args=((rows[-1][4], rows[-1][0]) if rows else None,))
+
+    # الانتقال المباشر إلى إجابة برقمها أو الاختيار من الصفحة الحالية
+    jump_id = st.number_input("الانتقال إلى إجابة رقم", min_value=0, step=1, value=0,
+                              key=f"{key}_jump")
+    if jump_id:
+        if find_response(survey_id, int(jump_id), base) is None:
+            st.warning(f"لا توجد إجابة رقم {int(jump_id)} ضمن الإجابات المتاحة")
+            return None
+        return int(jump_id)
+
+    if not rows:
+        return None
+    return st.selectbox(
+        "اختر إجابة من الصفحة الحالية",
+        options=[r[0] for r in rows],
+        format_func=lambda x: f"إجابة #{x}",
+        key=f"{key}_select"
+    )
@@ -0,0 +1,105 @@
+import json
+
+import streamlit as st
+
+from database import get_response_info, get_response_details, save_response_edits
+
+
+def _load_editor(key: str, response_id: int, version: int) -> dict:
+    """
+    تحميل قيم الإجابة مع إصدارها معاً عند فتح المحرر (الإصدار أولاً: أي تعديل
+    يقع بينهما يظهر كتعارض عند الحفظ بدلاً من الكتابة فوقه)
+    """
+    editor = {
+        'response_id': response_id,
+        'version': version,
+        'details': get_response_details(response_id),
+    }
+    for detail in editor['details']:
+        st.session_state.pop(f"{key}_dropdown_{detail[0]}", None)
+        st.session_state.pop(f"{key}_input_{detail[0]}", None)
+    st.session_state[f"{key}_editor"] = editor
+    return editor
+
+
+def _editor_rendered(key: str, editor: dict) -> bool:
+    """
+    هل عرض المحرر في التشغيل السابق؟ (Streamlit يحذف حالة الأدوات غير المعروضة،
+    فالعودة إلى الإجابة بعد الانتقال لصفحة أخرى تعيد التحميل)
+    """
+    return any(f"{key}_dropdown_{detail[0]}" in st.session_state or f"{key}_input_{detail[0]}" in st.session_state
+               for detail in editor['details'])
+
+
+def show_response_editor(response_id: int, key: str):
+    """
+    عرض تفاصيل إجابة ونموذج تعديل قيمها
+    يعاد تحميل القيم والإصدار كلما تغيرت الإجابة المختارة أو بعد الحفظ أو التعارض
+    """
+    response_info = get_response_info(response_id)
+    if not response_info:
+        return
+
+    st.subheader(f"تفاصيل الإجابة #{response_id}")
+    st.markdown(f"""
+    **الاستبيان:** {response_info[1]}  
+    **المستخدم:** {response_info[2]}  
+    **الإدارة الصحية:** {response_info[3]}  
+    **المحافظة:** {response_info[4]}  
+    **تاريخ التقديم:** {response_info[5]}
+    """)
+
+    editor = st.session_state.get(f"{key}_editor")
+    if editor is None or editor['response_id'] != response_id or not _editor_rendered(key, editor):
+        editor = _load_editor(key, response_id, response_info[6])
+    if st.session_state.pop(f"{key}_conflict", False):
+        st.warning("تم تعديل هذه الإجابة من مستخدم آخر أثناء تعديلك لها. تم تحميل القيم الحالية، يرجى إعادة التعديل.")
+
+    updates = {}  # لتخزين التعديلات
+    with st.form(key=f"{key}_form_{response_id}"):
+        for detail_id, field_id, label, field_type, options, answer in editor['details']:
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                st.markdown(f"**{label}**")
+            with col2:
+                if field_type == 'dropdown':
+                    options_list = json.loads(options) if options else []
+                    new_value = st.selectbox(
+                        f"تعديل {label}",
+                        options_list,
+                        index=options_list.index(answer) if answer in options_list else 0,
+                        key=f"{key}_dropdown_{detail_id}"
+                    )
+                else:
+                    new_value = st.text_input(
+                        f"تعديل {label}",
+                        value=answer,
+                        key=f"{key}_input_{detail_id}"
+                    )
+
+                if new_value != answer:
+                    updates[detail_id] = new_value
+
+        # أزرار الحفظ والإلغاء
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.form_submit_button("💾 حفظ جميع التعديلات"):
+                if updates:
+                    new_version = save_response_edits(
+                        response_id, editor['version'], updates, st.session_state.user_id
+                    )
+                    if new_version is not None:
+                        st.session_state.pop(f"{key}_editor", None)
+                        st.success("تم تحديث جميع التعديلات بنجاح")
+                        st.rerun()
+                    elif get_response_info(response_id)[6] != editor['version']:
+                        # تعارض: إعادة تحميل القيم والإصدار الحاليين من قاعدة البيانات
+                        st.session_state.pop(f"{key}_editor", None)
+                        st.session_state[f"{key}_conflict"] = True
+                        st.rerun()
+                else:
+                    st.info("لم تقم بإجراء أي تعديلات")
+        with col2:
+            if st.form_submit_button("❌ إلغاء التعديلات"):
+                st.session_state.pop(f"{key}_editor", None)
+                st.rerun()